@@ -0,0 +1,36 @@
+/*
+ File: edgetrace.h
+ Tracing of the region boundaries of a thresholded importance plane.
+
+ The pixels at or above the threshold are inside. Starting from a boundary
+ pixel, the square of side 2 * step + 1 around every traced point is walked
+ along its perimeter, and every inside pixel where the perimeter crosses the
+ boundary is traced next (breadth first). So the points follow every
+ boundary about step pixels apart; a boundary no traced square reaches seeds
+ a new trace, so every region and hole is traced.
+*/
+
+#ifndef EDGETRACE_H
+#define EDGETRACE_H
+
+#include <vector>
+
+#include "sampler/quasisampler_prototype.h"
+
+/// A traced boundary point: a pixel center, and the index of the point it was
+/// traced from (-1 for the first point of a trace). Following the parents
+/// gives the polylines along the boundaries.
+struct EdgePoint {
+  Point2D pt;
+  int parent;
+
+  EdgePoint(const Point2D &pt, int parent) : pt(pt), parent(parent) {}
+};
+
+/// Traces the boundaries of the row-major width x height plane, with the
+/// pixels at or above threshold times the maximum of the plane inside.
+/// Throws std::invalid_argument for a step below 1.
+std::vector<EdgePoint> traceEdges(const float *plane, int width, int height,
+                                  int step, double threshold = 0.2);
+
+#endif // EDGETRACE_H
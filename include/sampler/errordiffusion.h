@@ -0,0 +1,35 @@
+/*
+ File: errordiffusion.h
+ Error-diffusion sampling of an importance plane.
+
+ Thresholds the importance, scaled to a per-pixel point density, and
+ diffuses the error of every pixel onto its unvisited neighbors. The points
+ are the pixels the threshold turned on, so their number follows the summed
+ density and their spacing the local density.
+*/
+
+#ifndef ERRORDIFFUSION_H
+#define ERRORDIFFUSION_H
+
+#include <string>
+#include <vector>
+
+#include "sampler/quasisampler_prototype.h"
+
+/// The error-diffusion kernels: Floyd-Steinberg, and the wider Jarvis-Judice-Ninke and Stucki.
+enum DiffusionKernel { FloydSteinberg, JarvisJudiceNinke, Stucki };
+
+/// The kernel named "floyd-steinberg", "jarvis" or "stucki".
+/// Throws std::invalid_argument for any other name.
+DiffusionKernel diffusionKernelByName(const std::string &name);
+
+/// Dithers the row-major width x height plane, scaled by scale to a density
+/// of points per pixel (at most one point per pixel), and returns the centers
+/// of the pixels turned on. With serpentine, odd rows are scanned from right
+/// to left with the kernel mirrored, which avoids the directional artifacts
+/// of scanning every row the same way.
+std::vector<Point2D> diffuseErrors(const float *plane, int width, int height,
+                                   double scale, DiffusionKernel kernel,
+                                   bool serpentine = true);
+
+#endif // ERRORDIFFUSION_H
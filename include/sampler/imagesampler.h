@@ -3,7 +3,10 @@
 
 #include <vector>
 #include <fstream>
+#include <memory>
 #include "quasisampler_prototype.h"
+#include "errordiffusion.h"
+#include "edgetrace.h"
 #include <boost/python.hpp>
 #include <boost/python/numpy.hpp>
 #include <pyboostcvconverter/pyboostcvconverter.hpp>
@@ -24,12 +27,45 @@ struct ChannelException : public std::exception
     	return "Image Channel Exception";
     }
 };
+struct FormatException : public std::exception
+{
+	const char * what () const throw ()
+    {
+    	return "Unsupported importance map buffer (expected a 2D or 3D array of uint8, uint16, int16, int32, float32 or float64)";
+    }
+};
+
+/// Importance sampler over a single importance plane.
+/// The channels of the input map are summed once on load. A C-contiguous,
+/// single-channel float32 map is borrowed through the buffer protocol and
+/// not copied at all; every other map is reduced into an owned float plane.
 class ImageQuasisampler : public Quasisampler {
 private:
-  std::vector<double> data;
+  std::shared_ptr<Py_buffer> view; // Borrowed buffer, released with the last copy.
+  std::shared_ptr<std::vector<float> > owned; // Reduced plane, when the input is not borrowed.
+  const float *plane;              // width * height importance values, row-major.
   int channels, type;
   double mag;
 
+  /// Max-mipmap of the plane: level k > 0 holds the maximum of each 2^k x 2^k
+  /// block of pixels, down to a single value. Level 0 is the plane itself.
+  /// The levels 0 < k < pyramidBase are not kept (their vectors stay empty).
+  std::vector<std::vector<float> > pyramid;
+  std::vector<int> pyramidWidth;
+  int pyramidBase;
+
+  void reset();
+  void buildPyramid();
+  /// Upper bound of the plane over the inclusive pixel rectangle [x0, x1] x [y0, y1],
+  /// from at most 4 x 4 cells of the first pyramid level coarse enough to cover it.
+  float maxInRect(int x0, int y0, int x1, int y1) const;
+  std::vector<Point2D> searchMagnitude(unsigned n_points, double tolerance, unsigned max_iter);
+
+protected:
+  /// Bounds the importance over the bounding box of the tile with the pyramid,
+  /// rather than sampling a few points, so the initial tiling can stay coarse.
+  unsigned getTileImportance(TileNode *tile);
+
 public:
   
   ImageQuasisampler();
@@ -41,6 +77,36 @@ public:
   unsigned getImportanceAt(Point2D pt);
   cv::Mat debugTool();
   cv::Mat getSampledPoints();
+
+  /// Samples about n_points points (within tolerance * n_points), searching for
+  /// the magnitude that gives them. The tiling is kept between the trials and
+  /// only refined or pruned where the importance changed. The sampler keeps
+  /// the magnitude it settled on, see getMagnitude().
+  cv::Mat sample(unsigned n_points, double tolerance = 0.05, unsigned max_iter = 8);
+  /// The rank of every point of the last getSampledPoints() or sample() call,
+  /// as an Nx1 array; see Quasisampler::pointRanks.
+  cv::Mat getSampledRanks() const;
+  /// Error-diffusion sampling of the loaded plane instead of the Penrose tiling:
+  /// every pixel is turned into a point with a probability of scale times its
+  /// importance (at most 1), see diffuseErrors(). Returns an Nx2 array of pixel
+  /// centers. The kernel is "floyd-steinberg", "jarvis" or "stucki".
+  cv::Mat getDitheredPoints(double scale, const std::string &kernel = "floyd-steinberg",
+                            bool serpentine = true);
+  /// Traces the boundaries of the regions of the loaded plane at or above
+  /// threshold times its maximum, with points about step pixels apart, see
+  /// traceEdges(). Returns an Nx3 array of (x, y, parent) rows: pixel
+  /// centers, and the row each point was traced from (-1 for none).
+  cv::Mat getEdgeTrace(int step = 8, double threshold = 0.2);
+  double getMagnitude() const;
+  void setMagnitude(double mag);
+  /// Sets the finest pyramid level kept from the next loadImg() on (at least
+  /// 1). The pyramid takes about 4 / 3 * 4^(1 - level) bytes per pixel;
+  /// rectangles finer than the level are bounded from the plane itself, which
+  /// is slower but bounds the memory of very large maps.
+  void setPyramidBase(int level);
+  /// Forgets the loaded map, its pyramid and the tiling: a borrowed buffer is
+  /// released, so e.g. a memory-mapped file can be closed and removed.
+  void release();
 };
 }
 #endif // IMAGESAMPLER_H
\ No newline at end of file
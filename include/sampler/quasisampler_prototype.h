@@ -194,12 +194,14 @@ protected:
     Point2D getP2() const;
     Point2D getP3() const;
     Point2D getCenter() const;
+    double getScale() const;
     unsigned getFCode() const;
     bool isSamplingType() const;
     unsigned getLevel();
     bool isTerminal() const;
     TileNode* getParent();
     TileNode* getChild(unsigned i);
+    unsigned getNumChildren() const;
 
     /// Obtains the correction vector from the lookup table,
     /// then scales and adds it to the reference point.
@@ -247,6 +249,21 @@ protected:
   /// Extents of the region of interest.
   double width, height;
 
+  /// Optional window [x0, x1) x [y0, y1) inside the region of interest.
+  /// When set, only tiles that can reach the window are refined and only
+  /// points inside it are collected, so that disjoint windows sampled
+  /// separately add up to exactly the point set of the whole region.
+  bool windowed;
+  double win_x0, win_y0, win_x1, win_y1;
+
+  /// Number of threads the subtrees of the tiling are refined and collected
+  /// on; 0 uses every hardware thread.
+  unsigned numThreads;
+
+  /// Level every tile is subdivided to before the adaptive subdivision.
+  /// Only needs to be high when getTileImportance() is a coarse estimate.
+  unsigned minSubdivisionLevel;
+
   /// Protected constructor, which initializes the Region of Interest.
   Quasisampler(double width=0.0, double height=0.0);
   
@@ -258,25 +275,77 @@ protected:
   /// to the region of interest.
   unsigned getImportanceAt_bounded(Point2D pt);
 
+  /// Checks whether a tile, or a sampling point displaced from one of its
+  /// descendants, can fall inside the window.
+  bool reachesWindow(TileNode *tile) const;
+
+  /// Returns the importance that decides whether a (non-sampling) tile is refined.
+  /// The default approximates the maximum over the tile by the values at its
+  /// corners and center; implementations that can bound the maximum over the
+  /// tile should override it and lower minSubdivisionLevel.
+  virtual unsigned getTileImportance(TileNode *tile);
+
+  /// Checks whether a leaf tile has to be refined further.
+  bool needsRefinement(TileNode *tile);
+
+  /// Refines a leaf that needs it, or prunes the children of a tile that no
+  /// longer needs them. Returns true if the tile has children afterwards.
+  bool adaptTile(TileNode *tile);
+
+  /// Recursively adapts a tile and its descendants, so that the subtree is the
+  /// one a fresh subdivision builds for the current importance function.
+  void adaptSubtree(TileNode *tile);
+
+  /// Collects the points of the leaves below a tile, and their ranks, in depth-first order.
+  void collectSubtree(TileNode *tile, std::vector<Point2D> &pointlist,
+                      std::vector<double> &ranks, bool filterBounds);
+
+  /// Splits the tree into at least count independent subtrees (if it is deep
+  /// enough), in depth-first order. With adapt set, the tiles on the way are
+  /// adapted as buildAdaptiveSubdivision() would.
+  std::vector<TileNode*> splitSubtrees(size_t count, bool adapt);
+
   /// Subdivides all tiles down a level, a given number of times.
   void subdivideAll(int times=1);
 
-  /// Generates the hierarchical structure.
-  void buildAdaptiveSubdivision( unsigned minSubdivisionLevel = 6 );
+  /// Generates the hierarchical structure. An existing tree is adapted to
+  /// the current importance function rather than built again: only the
+  /// leaves whose importance changed are refined or pruned.
+  void buildAdaptiveSubdivision();
 
-  /// Collect the resulting point set.
+  /// Collect the resulting point set, and the rank of every point into pointRanks.
   void collectPoints(std::vector<Point2D> &pointlist,bool filterBounds = true );
 
+  /// The rank of every point of the last collected point set: the F-code value
+  /// of its tile over its importance, in [0, 1]. The points of rank at most t
+  /// are about those a sampling at t times the importance gives, at the same
+  /// positions, so thresholds on the rank give nested, progressively denser
+  /// blue-noise subsets.
+  std::vector<double> pointRanks;
+
 public:
 
   /// This virtual function must be implemented in order to use the sampling system.
   /// It should return the value of the importance function at the given point.
+  /// It (and getTileImportance()) is called from several threads at once
+  /// when numThreads is not 1, and must not modify the sampler.
   virtual unsigned getImportanceAt( Point2D pt ) = 0;
 
   /// Builds and collects the point set generated be the sampling system,
   /// using the previously defined importance function.
   std::vector<Point2D> getSamplingPoints();
 
+  /// Restricts the sampling to the window [x0, x1) x [y0, y1), in the
+  /// coordinates of the region of interest.
+  void setWindow(double x0, double y0, double x1, double y1);
+
+  /// Samples the whole region of interest again.
+  void clearWindow();
+
+  /// Sets the number of threads used by getSamplingPoints(); 0 uses every
+  /// hardware thread. The point set and its order do not depend on it.
+  void setNumThreads(unsigned threads);
+
 }; 
 
 
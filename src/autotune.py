@@ -0,0 +1,233 @@
+"""
+Per-image search of the importance map gamma, the sampling density and the
+decimation factor for a quality floor or a size budget.
+
+The candidates are ordered by their predicted triangle count, along which the
+quality and the size both grow, and a k-ary search over that order evaluates
+up to jobs candidates per round in parallel threads, until the boundary of the
+target is found or the evaluation budget is spent. The stages a candidate
+shares with others are computed once: the importance map per gamma, and the
+sampled points and their Delaunay triangulation per gamma and density.
+"""
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+import sampler.BN_Sample as Sampler
+from mesh.decimation import Decimate
+from mesh.delaunay import Delaunay
+from pipeline import write_svg
+from sampling.edges import EdgeTracer
+from sampling.importance_map import ImportanceMap
+from sampling.triangulate import Triangulate
+from util.bench import Bench
+from util.geometry_types import Mesh
+from util.metrics import psnr, ssim
+from util.render import MeshRenderer
+from util.settings import Settings
+
+Candidate = Tuple[float, float, float]
+
+
+class AutoTuner:
+    """
+    Converts images into SVG files like Pipeline, with gamma, mag and shrink
+    searched per image for settings.autotune.
+
+    A quality target ("psnr" or "ssim") gives the candidate with the fewest
+    triangles that reaches it, a budget ("triangles" or "bytes") the candidate
+    with the best PSNR within it. If no evaluated candidate meets the target,
+    the closest one is written and the result says so.
+    """
+
+    GAMMAS = (0.3, 0.5, 0.8)
+    MAGS = (250.0, 500.0, 1000.0, 2000.0, 4000.0)
+    SHRINKS = (4.0, 10.0, 25.0)
+
+    def __init__(self, settings: Settings, gammas: Sequence[float] = GAMMAS, mags: Sequence[float] = MAGS,
+                 shrinks: Sequence[float] = SHRINKS, jobs: Optional[int] = None, verbose: bool = False):
+        """
+        Keyword arguments:
+            settings -- the parsed command line settings, with the target in settings.autotune
+            gammas -- the importance map gammas searched
+            mags -- the blue-noise sampling densities searched
+            shrinks -- the decimation face count reduction factors searched
+            jobs -- the number of candidates evaluated in parallel (default: settings.jobs)
+            verbose -- print a line per search round
+        """
+        self.settings = settings
+        self.metric, self.bound = settings.autotune
+        self.candidates: List[Candidate] = list(product(gammas, mags, shrinks))
+        self.jobs = max(jobs or settings.jobs, 1)
+        self.max_evals = max(settings.auto_evals, 1)
+        self.verbose = verbose
+
+        self.importance_map = ImportanceMap(settings.luma)
+        self.sampler = Sampler.ImageQuasisampler()
+        self.edges = EdgeTracer(settings.edges, settings.edge_threshold) if settings.edges else None
+        self.delaunay = Delaunay()
+        self.decimate = Decimate()
+        self.triangulate = Triangulate()
+        self.renderer = MeshRenderer()
+
+    def _log(self, message: str) -> None:
+        if self.verbose:
+            print(message)
+
+    def _feasible(self, score: dict) -> bool:
+        if self.metric in ("psnr", "ssim"):
+            return score.get(self.metric, -np.inf) >= self.bound
+        return score.get(self.metric, np.inf) <= self.bound
+
+    def _better(self, a: dict, b: Optional[dict]) -> bool:
+        """Whether score a beats score b: feasible first, then the objective, then closeness to the target."""
+        if b is None:
+            return True
+        if a["feasible"] != b["feasible"]:
+            return a["feasible"]
+        quality = self.metric in ("psnr", "ssim")
+        if a["feasible"]:
+            return a["triangles"] < b["triangles"] if quality else a.get("psnr", -np.inf) > b.get("psnr", -np.inf)
+        return a[self.metric] > b[self.metric] if quality else a[self.metric] < b[self.metric]
+
+    def _evaluate(self, image: np.ndarray, mesh: Mesh, candidate: Candidate, directory: str,
+                  complete: bool = False) -> dict:
+        """Decimate, color and score one candidate.
+
+        Unless complete, the work its outcome no longer depends on is skipped:
+        a candidate over a budget is neither colored nor rendered.
+        """
+        settings = self.settings
+        gamma, mag, shrink = candidate
+        h, w = image.shape[:2]
+        mesh = self.decimate.simplify(image, mesh, shrink).compact()
+        score = {"gamma": gamma, "mag": mag, "shrink": shrink, "triangles": len(mesh)}
+        if self.metric == "triangles" and len(mesh) > self.bound and not complete:
+            # Over the budget, so no need to know how good it looks
+            score["feasible"] = False
+            return score
+
+        mesh = self.triangulate.color(settings, image, mesh, settings.color_mode)
+        score["mesh"] = mesh
+        if self.metric == "bytes" and not complete:
+            path = os.path.join(directory, "%g_%g_%g.svg" % candidate)
+            score["bytes"] = write_svg(settings, w, h, [mesh], path)
+            os.remove(path)
+            if score["bytes"] > self.bound:
+                score["feasible"] = False
+                return score
+
+        rendered = self.renderer.render(mesh, w, h)
+        score["psnr"] = psnr(rendered, image)
+        if self.metric == "ssim" or settings.quality:
+            score["ssim"] = ssim(rendered, image)
+        score["feasible"] = self._feasible(score)
+        return score
+
+    def run(self, image_path: str, output_path: str, bench: Optional[Bench] = None) -> dict:
+        """Search the parameters of one image and write its best SVG file. Return the sizes and the choice."""
+        settings = self.settings
+        bench = bench or Bench()
+
+        self._log("Loading image...")
+        with bench.stage("image decode") as stage:
+            image = cv2.imread(image_path)
+            if image is None:
+                raise ValueError(f"Could not read image '{image_path}'")
+            stage.set(pixels=image.shape[0] * image.shape[1])
+        h, w = image.shape[:2]
+
+        importance: Dict[float, np.ndarray] = {}
+        triangulated: Dict[Tuple[float, float], Mesh] = {}
+
+        def prepare(gamma: float, mag: float) -> Mesh:
+            """The Delaunay triangulation of the points sampled at gamma and mag, computed once."""
+            if (gamma, mag) not in triangulated:
+                with bench.stage("BN sampling", pixels=h * w) as stage:
+                    self.sampler.loadImg(importance[gamma], mag)
+                    points = np.asarray(self.sampler.getSampledPoints())
+                    if self.edges:
+                        points = np.vstack((points, self.edges.run(settings, importance[gamma])))
+                    stage.set(points=len(points))
+                with bench.stage("triangulation", points=len(points)) as stage:
+                    triangulated[gamma, mag] = Mesh(*self.delaunay.run(w, h, points))
+                    stage.set(triangles=len(triangulated[gamma, mag]))
+            return triangulated[gamma, mag]
+
+        # Order the candidates by predicted triangles: the sampled points grow with mag and the
+        # summed importance, and decimation divides the faces by shrink
+        for gamma in sorted({c[0] for c in self.candidates}):
+            with bench.stage("importance map", pixels=h * w):
+                importance[gamma] = self.importance_map.run(settings, image, gamma)
+        total = {gamma: float(np.sum(plane, dtype=np.float64)) for gamma, plane in importance.items()}
+        order = sorted(self.candidates, key=lambda c: (c[1] * total[c[0]] / c[2], c))
+
+        # Quality and size grow along the order: find the first candidate reaching a quality floor,
+        # or the last one within a budget
+        quality = self.metric in ("psnr", "ssim")
+        lo, hi = 0, len(order)
+        scores: Dict[Candidate, dict] = {}
+        best = None
+        with tempfile.TemporaryDirectory() as directory, ThreadPoolExecutor(self.jobs) as pool:
+            while lo < hi and len(scores) < self.max_evals:
+                k = min(self.jobs, hi - lo, self.max_evals - len(scores))
+                # k probes splitting [lo, hi) into k + 1 parts
+                probes = sorted({lo + (hi - lo) * (i + 1) // (k + 1) for i in range(k)})
+                self._log(f"Evaluating {len(probes)} candidate(s) of {hi - lo} remaining...")
+                with bench.stage("autotune round", candidates=len(probes)) as stage:
+                    meshes = [prepare(*order[i][:2]) for i in probes]
+                    round_scores = list(pool.map(
+                        lambda i, mesh: self._evaluate(image, mesh, order[i], directory), probes, meshes))
+                    stage.set(feasible=sum(s["feasible"] for s in round_scores))
+
+                for i, score in zip(probes, round_scores):
+                    scores[order[i]] = score
+                    if self._better(score, best):
+                        if best is not None:
+                            best.pop("mesh", None)
+                        best = score
+                    else:
+                        score.pop("mesh", None)
+
+                # Narrow [lo, hi) to the boundary between the failing and the passing probes
+                for i, score in zip(probes, round_scores):
+                    if score["feasible"] == quality:
+                        hi = min(hi, i)
+                    else:
+                        lo = max(lo, i + 1)
+
+        if best is None or "mesh" not in best:
+            # Nothing was colored, as every candidate was over the budget: take the smallest
+            best = self._evaluate(image, prepare(*order[0][:2]), order[0], "", complete=True)
+        if not best["feasible"]:
+            print(f"Warning: no candidate meets {self.metric}={self.bound:g} for '{image_path}'")
+        self._log("Chose gamma %g, mag %g, shrink %g (%d triangles, PSNR %.2f dB)"
+                  % (best["gamma"], best["mag"], best["shrink"], best["triangles"], best.get("psnr", np.nan)))
+
+        mesh = best["mesh"]
+        with bench.stage("SVG write", triangles=len(mesh)) as stage:
+            size = write_svg(settings, w, h, [mesh], output_path)
+            stage.set(bytes=size)
+
+        result = {
+            "width": w,
+            "height": h,
+            "vertices": len(mesh.vertices),
+            "triangles": len(mesh),
+            "bytes": size,
+            "gamma": best["gamma"],
+            "mag": best["mag"],
+            "shrink": best["shrink"],
+            "feasible": best["feasible"],
+            "evaluations": len(scores),
+        }
+        if "psnr" in best:
+            result["psnr"] = round(best["psnr"], 3)
+        if "ssim" in best:
+            result["ssim"] = round(best["ssim"], 4)
+        return result
@@ -0,0 +1,195 @@
+"""
+Batch conversion of a directory or glob of images over a pool of worker processes.
+
+Every worker imports the pipeline and builds its stages once, then converts
+images until the queue is empty. A failing image is recorded in the manifest
+and does not stop the batch. A worker process that dies takes the pool down
+with it: the images that had not started go back in the queue, and those that
+had are retried alone until the culprit is known.
+"""
+import glob
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+import cv2
+
+from util.bench import Bench
+from util.settings import Settings
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp", ".pgm", ".ppm", ".pnm")
+
+# Times an image may be in flight when a worker process dies before it is given up on
+MAX_ATTEMPTS = 2
+
+# The per-process pipeline, built by _init_worker
+_pipeline = None
+# The images started in the current pool, shared with the parent (path -> worker pid)
+_started = None
+
+
+def find_images(pattern: str) -> List[str]:
+    """The image files in a directory, or the files matching a glob, sorted by name."""
+    if os.path.isdir(pattern):
+        paths = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+    else:
+        paths = glob.glob(pattern, recursive=True)
+    return sorted(p for p in paths if os.path.isfile(p) and p.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def output_paths(inputs: List[str], output_dir: str, extension: str) -> Dict[str, str]:
+    """Map every input to <output_dir>/<stem>.<extension>, keeping the input extension for colliding stems."""
+    stems = [os.path.splitext(os.path.basename(p))[0] for p in inputs]
+    counts: Dict[str, int] = {}
+    for stem in stems:
+        counts[stem] = counts.get(stem, 0) + 1
+    outputs = {}
+    for path, stem in zip(inputs, stems):
+        if counts[stem] > 1:
+            stem = os.path.basename(path).replace(".", "_")
+        outputs[path] = os.path.join(output_dir, f"{stem}.{extension}")
+    return outputs
+
+
+def _init_worker(settings: Settings, threads: Optional[int], started=None) -> None:
+    global _pipeline, _started
+    _started = started
+    if settings.autotune:
+        # One candidate at a time per worker, the workers already use every core
+        from autotune import AutoTuner
+        _pipeline = AutoTuner(settings, jobs=threads)
+    else:
+        from pipeline import Pipeline
+        _pipeline = Pipeline(settings)
+    if threads is not None:
+        cv2.setNumThreads(threads)
+        _pipeline.sampler.setNumThreads(threads)
+
+
+def _convert(image_path: str, output_path: str) -> dict:
+    """Convert one image in a worker; never raises, failures are returned as the entry status."""
+    settings = _pipeline.settings
+    profile_dir = None
+    if settings.profile_dir:
+        profile_dir = os.path.join(settings.profile_dir, os.path.splitext(os.path.basename(output_path))[0])
+    bench = Bench(True, profile_dir, memory=settings.bench)
+
+    if _started is not None:
+        # Stored synchronously by the manager, so it is known even if this process dies
+        _started[image_path] = os.getpid()
+    entry = {"input": image_path, "output": output_path, "status": "ok", "pid": os.getpid()}
+    start = time.perf_counter()
+    try:
+        entry.update(_pipeline.run(image_path, output_path, bench))
+    except Exception as e:
+        entry["status"] = "failed"
+        entry["error"] = f"{type(e).__name__}: {e}"
+        entry["traceback"] = traceback.format_exc()
+    entry["seconds"] = time.perf_counter() - start
+    entry["stages"] = bench.to_dict()["stages"]
+    return entry
+
+
+def run_batch(settings: Settings) -> dict:
+    """Convert every image matched by settings.image into settings.output. Return the manifest."""
+    inputs = find_images(settings.image)
+    if not inputs:
+        raise SystemExit(f"No images found for '{settings.image}'")
+    os.makedirs(settings.output, exist_ok=True)
+    outputs = output_paths(inputs, settings.output, settings.extension)
+
+    jobs = max(min(settings.jobs, len(inputs)), 1)
+    # One OpenCV and sampler thread per worker when the pool already uses every core
+    threads = 1 if jobs > 1 else None
+    print(f"Converting {len(inputs)} images with {jobs} worker(s)...")
+
+    # Largest files first, so a big image does not end up alone at the tail of the batch
+    pending = sorted(inputs, key=os.path.getsize, reverse=True)
+    # Images that were in flight together when a worker died, each retried alone
+    isolated: List[str] = []
+    attempts = {path: 0 for path in inputs}
+    entries: Dict[str, dict] = {}
+    start = time.perf_counter()
+
+    def record(path: str, entry: dict) -> None:
+        entries[path] = entry
+        done = len(entries)
+        if entry["status"] != "ok":
+            print(f"[{done}/{len(inputs)}] FAILED {path}: {entry['error']}", flush=True)
+        else:
+            print(f"[{done}/{len(inputs)}] {path} ({entry['seconds']:.2f} s)", flush=True)
+
+    def charge(path: str) -> None:
+        attempts[path] += 1
+        if attempts[path] < MAX_ATTEMPTS:
+            isolated.append(path)
+        else:
+            record(path, {"input": path, "output": outputs[path], "status": "failed",
+                          "error": "worker process died"})
+
+    with multiprocessing.Manager() as manager:
+        started = manager.dict()
+        while pending or isolated:
+            if pending:
+                batch, pending, workers = pending, [], jobs
+            else:
+                batch, workers = [isolated.pop(0)], 1
+            started.clear()
+            crashed = []
+            with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                     initargs=(settings, threads, started)) as pool:
+                futures = {pool.submit(_convert, path, outputs[path]): path for path in batch}
+                for future in as_completed(futures):
+                    path = futures[future]
+                    try:
+                        record(path, future.result())
+                    except BrokenProcessPool:
+                        crashed.append(path)
+            if not crashed:
+                continue
+
+            # A dead worker (e.g. crashed in native code) fails every unfinished image of the
+            # pool; only those that had started can have killed it, the rest go back in the queue
+            suspects = [path for path in crashed if path in started]
+            if not suspects:
+                # Nothing had started, e.g. a worker died starting up: charge them all so this cannot loop
+                for path in crashed:
+                    charge(path)
+                continue
+            pending.extend(path for path in crashed if path not in started)
+            if len(suspects) == 1:
+                charge(suspects[0])
+            else:
+                # Any of them may be the culprit; running each alone tells
+                isolated.extend(suspects)
+
+    failed = sum(e["status"] != "ok" for e in entries.values())
+    manifest = {
+        "input": settings.image,
+        "output": settings.output,
+        "jobs": jobs,
+        "images": len(inputs),
+        "succeeded": len(inputs) - failed,
+        "failed": failed,
+        "wall_s": time.perf_counter() - start,
+        "entries": [entries[path] for path in inputs],
+    }
+    if settings.cache:
+        manifest["cache_hits"] = sum(e.get("cache_hits", 0) for e in entries.values())
+        manifest["cache_misses"] = sum(e.get("cache_misses", 0) for e in entries.values())
+    if settings.quality:
+        # The worst outputs, to gate a batch on
+        scored = [e for e in entries.values() if "psnr" in e]
+        manifest["min_psnr"] = min((e["psnr"] for e in scored), default=None)
+        manifest["min_ssim"] = min((e["ssim"] for e in scored), default=None)
+    manifest_path = os.path.join(settings.output, "manifest.json")
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"{manifest['succeeded']} converted, {failed} failed in {manifest['wall_s']:.1f} s; "
+          f"manifest written to {manifest_path}")
+    return manifest
@@ -0,0 +1,294 @@
+"""
+Reproducible benchmark suite for the vectorization stages.
+
+Runs every stage over the sample images and over synthetic upscaled versions
+of them, reports throughput and scaling, and stores the results as a JSON
+baseline that a later run can be compared against.
+
+    $ python src/bench_suite.py --sizes 0.25 1 4 --out bench/baseline.json
+    $ python src/bench_suite.py --sizes 0.25 1 4 --compare bench/baseline.json
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from mesh.decimation import Decimate
+from sampling.importance_map import ImportanceMap
+from sampling.triangulate import Triangulate
+from tracer.color_quant import ColorQuantization
+from util.bench import Bench
+from util.mesh_to_svg import SVGWriter
+
+try:
+    import sampler.BN_Sample as Sampler
+except ImportError:
+    Sampler = None
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_IMAGES = ["img/test*.jpg", "img/lab*.jpg", "image.pgm"]
+DEFAULT_SIZES = [0.25, 1, 4, 12, 25, 50]
+STAGES = ["importance map", "BN sampling", "decimation", "triangulation", "SVG write", "color quantization"]
+
+
+def parse_args() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--images", nargs="+", default=DEFAULT_IMAGES,
+                    help="input images or globs, relative to the repository root")
+    ap.add_argument("--sizes", nargs="*", type=float, default=DEFAULT_SIZES,
+                    help="synthetic sizes in megapixels the images are upscaled to")
+    ap.add_argument("--native", action="store_true",
+                    help="also benchmark every image at its native size")
+    ap.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES,
+                    help="stages to benchmark")
+    ap.add_argument("--repeat", type=int, default=1,
+                    help="run every configuration this many times and keep the fastest")
+    ap.add_argument("--gamma", type=float, default=0.5)
+    ap.add_argument("--mag", type=float, default=1000.0)
+    ap.add_argument("--shrink", type=float, default=10)
+    ap.add_argument("-k", type=int, default=8, help="number of colors for color quantization")
+    ap.add_argument("--out", default=None, help="write the results as a JSON baseline to this file")
+    ap.add_argument("--compare", default=None, help="compare against a JSON baseline written by --out")
+    ap.add_argument("--tolerance", type=float, default=0.1,
+                    help="relative slowdown reported as a regression by --compare")
+    return ap.parse_args()
+
+
+def environment() -> dict:
+    """Describe the machine and code version the results were measured on."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "sampler": Sampler is not None,
+        # Without the extension the points are weighted random ones, and every stage after
+        # sampling sees a different point set
+        "points": "BN_Sample" if Sampler is not None else "weighted random fallback",
+    }
+
+
+def load_images(patterns: List[str]) -> Dict[str, np.ndarray]:
+    images = {}
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.join(REPO, pattern))):
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+            if image is not None:
+                images[os.path.relpath(path, REPO)] = image
+    return images
+
+
+def upscale(image: np.ndarray, megapixels: float) -> np.ndarray:
+    h, w = image.shape[:2]
+    scale = np.sqrt(megapixels * 1e6 / (h * w))
+    size = (max(int(round(w * scale)), 1), max(int(round(h * scale)), 1))
+    return cv2.resize(image, size, interpolation=cv2.INTER_CUBIC)
+
+
+def fallback_points(importance: np.ndarray, mag: float, seed: int = 0) -> np.ndarray:
+    """Deterministic importance-weighted random points, used when BN_Sample is not built."""
+    plane = importance.reshape(importance.shape[0], importance.shape[1], -1).sum(axis=2)
+    density = plane / max(plane.sum(), 1e-12)
+    n = int(min(plane.size * 0.02, mag * 20)) or 1
+    rng = np.random.default_rng(seed)
+    idx = rng.choice(plane.size, size=n, p=density.ravel())
+    y, x = np.divmod(idx, plane.shape[1])
+    return np.column_stack((x, y)).astype(np.float64) + rng.random((n, 2)) * 0.5
+
+
+def run_once(args: argparse.Namespace, image: np.ndarray) -> Bench:
+    """Run the selected stages once on the image and return the instrumentation."""
+    bench = Bench(True)
+    h, w = image.shape[:2]
+    pixels = h * w
+    importance = sampled = mesh = None
+
+    with bench.stage("importance map", pixels=pixels) as stage:
+        importance = ImportanceMap().run(None, image, args.gamma)
+        stage.set(pixels=pixels)
+
+    if Sampler is not None:
+        with bench.stage("BN sampling", pixels=pixels) as stage:
+            bn = Sampler.ImageQuasisampler()
+            bn.loadImg(importance, args.mag)
+            sampled = bn.getSampledPoints()
+            stage.set(points=len(sampled))
+    else:
+        sampled = fallback_points(importance, args.mag)
+
+    if "decimation" in args.stages or "triangulation" in args.stages or "SVG write" in args.stages:
+        if "decimation" in args.stages:
+            with bench.stage("decimation", points=len(sampled)) as stage:
+                mesh = Decimate().run(image, sampled, args.shrink)
+                stage.set(points=len(mesh.vertices), triangles=len(mesh))
+
+            # As in Pipeline, the decimated mesh is colored as it is, not triangulated again
+            with bench.stage("triangulation", points=len(mesh.vertices), pixels=pixels) as stage:
+                mesh = Triangulate().color(None, image, mesh)
+                stage.set(triangles=len(mesh))
+        else:
+            with bench.stage("triangulation", points=len(sampled), pixels=pixels) as stage:
+                mesh = Triangulate().run(None, image, sampled)
+                stage.set(triangles=len(mesh))
+
+    if "SVG write" in args.stages:
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "out.svg")
+            with bench.stage("SVG write", triangles=len(mesh)) as stage:
+                SVGWriter(w, h, 1).draw_triangles(filename, mesh)
+                stage.set(bytes=os.path.getsize(filename))
+
+    if "color quantization" in args.stages:
+        with bench.stage("color quantization", pixels=pixels) as stage:
+            ColorQuantization().run(None, image, args.k)
+            stage.set(colors=args.k)
+
+    bench.records = [r for r in bench.records if r.name in args.stages]
+    return bench
+
+
+def throughput(record: dict) -> dict:
+    result = {}
+    wall = max(record["wall_s"], 1e-9)
+    pixels = record["inputs"].get("pixels")
+    if pixels:
+        result["pixels_per_s"] = pixels / wall
+    triangles = record["outputs"].get("triangles", record["inputs"].get("triangles"))
+    if triangles:
+        result["triangles_per_s"] = triangles / wall
+    points = record["outputs"].get("points")
+    if points and record["stage"] == "BN sampling":
+        result["points_per_s"] = points / wall
+    return result
+
+
+def run_suite(args: argparse.Namespace) -> List[dict]:
+    images = load_images(args.images)
+    if not images:
+        raise SystemExit(f"No images found for {args.images}")
+
+    results = []
+    for name, base in images.items():
+        configs = [(None, base)] if args.native else []
+        configs += [(mp, None) for mp in args.sizes]
+        for megapixels, image in configs:
+            if image is None:
+                image = upscale(base, megapixels)
+            h, w = image.shape[:2]
+            label = "native" if megapixels is None else f"{megapixels:g} MP"
+            print(f"{name} @ {label} ({w}x{h})", flush=True)
+
+            best: Dict[str, dict] = {}
+            for _ in range(args.repeat):
+                for record in run_once(args, image).to_dict()["stages"]:
+                    if record["stage"] not in best or record["wall_s"] < best[record["stage"]]["wall_s"]:
+                        best[record["stage"]] = record
+
+            for record in best.values():
+                record.update({
+                    "image": name,
+                    "megapixels": round(h * w / 1e6, 4) if megapixels is None else megapixels,
+                    "width": w,
+                    "height": h,
+                    "throughput": throughput(record),
+                })
+                results.append(record)
+                rates = ", ".join(f"{k}={v:,.0f}" for k, v in record["throughput"].items())
+                print(f"    {record['stage']:<20} {record['wall_s']:8.3f} s  {rates}", flush=True)
+    return results
+
+
+def scaling(results: List[dict]) -> Dict[str, dict]:
+    """Fit time ~ pixels^b per stage and find the first size step that scales worse than linear."""
+    report = {}
+    for stage in sorted({r["stage"] for r in results}):
+        rows = [r for r in results if r["stage"] == stage]
+        pixels = np.array([r["width"] * r["height"] for r in rows], dtype=np.float64)
+        wall = np.array([max(r["wall_s"], 1e-9) for r in rows])
+        entry = {"exponent": None, "superlinear_from_mp": None}
+        if len(np.unique(pixels)) >= 2:
+            entry["exponent"] = float(np.polyfit(np.log(pixels), np.log(wall), 1)[0])
+
+        # Median time per size across images, then the local exponent between neighboring sizes
+        sizes = np.unique([r["megapixels"] for r in rows])
+        medians = [np.median([max(r["wall_s"], 1e-9) / (r["width"] * r["height"])
+                              for r in rows if r["megapixels"] == mp]) for mp in sizes]
+        for mp, prev, cur in zip(sizes[1:], medians[:-1], medians[1:]):
+            if cur > prev * 1.25:
+                entry["superlinear_from_mp"] = float(mp)
+                break
+        report[stage] = entry
+    return report
+
+
+def compare(results: List[dict], env: dict, baseline_file: str, tolerance: float) -> None:
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    if baseline["environment"].get("sampler") != env["sampler"]:
+        old_points = baseline["environment"].get("points", "unknown")
+        raise SystemExit(f"Cannot compare against {baseline_file}: its points came from {old_points}, "
+                         f"these from {env['points']}")
+    old = {(r["image"], r["megapixels"], r["stage"]): r for r in baseline["results"]}
+    print(f"\nComparison against {baseline_file} (commit {baseline['environment'].get('commit')})")
+    print(f"{'stage':<20} {'image':<18} {'MP':>6} {'old s':>9} {'new s':>9} {'ratio':>7}")
+    regressions = 0
+    for r in results:
+        key = (r["image"], r["megapixels"], r["stage"])
+        if key not in old:
+            continue
+        ratio = r["wall_s"] / max(old[key]["wall_s"], 1e-9)
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif ratio < 1 - tolerance:
+            flag = "  faster"
+        print(f"{r['stage']:<20} {r['image']:<18} {r['megapixels']:>6g} "
+              f"{old[key]['wall_s']:>9.3f} {r['wall_s']:>9.3f} {ratio:>7.2f}{flag}")
+    print(f"{regressions} regression(s) above {tolerance:.0%}")
+
+
+def main(args: Optional[argparse.Namespace] = None) -> None:
+    args = args or parse_args()
+    env = environment()
+    if Sampler is None:
+        print("BN_Sample is not built: sampling is skipped and downstream stages use weighted random points")
+
+    results = run_suite(args)
+    curves = scaling(results)
+    print("\nScaling (time ~ pixels^exponent)")
+    for stage, entry in curves.items():
+        exponent = "n/a" if entry["exponent"] is None else f"{entry['exponent']:.2f}"
+        knee = entry["superlinear_from_mp"]
+        print(f"    {stage:<20} exponent {exponent:>5}"
+              + ("" if knee is None else f", superlinear from {knee:g} MP"))
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump({"environment": env, "config": vars(args), "results": results, "scaling": curves}, f, indent=2)
+        print(f"Baseline written to {args.out}")
+
+    if args.compare:
+        compare(results, env, args.compare, args.tolerance)
+
+
+if __name__ == "__main__":
+    main()
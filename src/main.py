@@ -1,11 +1,8 @@
 import cv2
-import sampler.BN_Sample as Sampler
-from sampling.importance_map import ImportanceMap
-from sampling.triangulate import Triangulate
+from pipeline import Pipeline
 from tracer.color_quant import ColorQuantization
-from util.mesh_to_svg import SVGWriter
-from mesh.decimation import Decimate
 from util.settings import Settings
+from util.bench import Bench
 import matplotlib.pyplot as plt
 from PIL import Image
 import numpy as np
@@ -30,39 +27,47 @@ if __name__ == "__main__":
     settings = Settings()
     settings.print()
 
-    # Load the input image
-    print("Loading image...")
-    image = cv2.imread(settings.image)
+    if settings.batch and not settings.sequence:
+        from batch import run_batch
+        manifest = run_batch(settings)
+        sys.exit(1 if manifest["failed"] else 0)
+
+    bench = Bench(settings.bench, settings.profile_dir)
 
     # # TESTING COLOR QUANTIZATION
     # k = 4
     # print(f"Color quantization with k={k}")
     # cq = ColorQuantization()
-    # cq.run_and_export(settings, image, k)
+    # cq.run_and_export(settings, cv2.imread(settings.image), k)
     # sys.exit(0)
 
-    # Perform importance map for blue-noise sampling
-    print("Performing importance map...")
-    im = ImportanceMap()
-    importance_map = im.run(settings, image, 0.5)
-
     # # Perform Floyd-Steinberg error dithering for blue-noise sampling
     # print("Performing error diffusion...")
     # ed = ErrorDither()
 
-    bn = Sampler.ImageQuasisampler()
-    bn.loadImg(importance_map, 1000.0)
-    # bn.loadPGM('image.pgm', 100.0)
-    sampled = bn.getSampledPoints()
-
-    print("Performing decimation...")
-    md = Decimate()
-    new_pts = md.run(image, sampled, 10)
-
-    print("Performing triangulation...")
-    dt = Triangulate()
-    triangulated = dt.run(None, image, new_pts.astype(float))
+    if settings.sequence:
+        from sequence import SequencePipeline
+        pipeline = SequencePipeline(settings, verbose=True)
+    elif settings.mode == "regions":
+        pipeline = Pipeline(settings, verbose=True)
+    elif settings.autotune:
+        from autotune import AutoTuner
+        pipeline = AutoTuner(settings, verbose=True)
+    elif settings.tile_size:
+        from tiled import TiledPipeline
+        pipeline = TiledPipeline(settings, verbose=True)
+    elif settings.memory:
+        from strips import StripPipeline
+        pipeline = StripPipeline(settings, verbose=True)
+    else:
+        pipeline = Pipeline(settings, verbose=True)
+    result = pipeline.run(settings.image, settings.output, bench)
+    if settings.quality and "psnr" in result:
+        print(f"Quality: PSNR {result['psnr']} dB, SSIM {result['ssim']}")
+    if getattr(pipeline, "cache", None):
+        print(f"Cache: {pipeline.cache.summary()}")
 
-    # Convert mesh to SVG
-    sw = SVGWriter(image.shape[1], image.shape[0], 1)
-    sw.draw_triangles(settings.output, triangulated)
+    if settings.bench:
+        print(bench.table())
+        bench.write_json(settings.bench_json)
+        print(f"Benchmark report written to {settings.bench_json}")
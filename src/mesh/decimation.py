@@ -1,55 +1,205 @@
-import open3d as o3d
+from typing import Optional
+
 import numpy as np
-from util.geometry_types import PointList
-import cv2
+
+from mesh.delaunay import Delaunay
+from util.geometry_types import Mesh, PointList
+
 
 class Decimate:
+    """
+    Color-driven mesh decimation on the 2D Delaunay mesh.
+
+    Each round scores every vertex by how far its color is from the mean color
+    of its neighbors (how badly it would be interpolated if removed), picks an
+    independent set of the cheapest vertices and collapses each of them onto
+    the neighbor with the closest color whose collapse does not fold any
+    triangle over. The faces are updated in place, so the mesh is triangulated
+    only once. Vertices on the boundary of the mesh are never removed, so the
+    mesh keeps covering the image.
+    """
+
     def __init__(self):
-        None
-
-    def run(self, image: np.ndarray, vertices: PointList, shrink = 20) -> PointList:
-        rect = (0, 0, image.shape[1], image.shape[0])
-        subdiv = cv2.Subdiv2D(rect)
-
-        for x in vertices:
-            subdiv.insert(x)
-
-        pointlist = subdiv.getTriangleList()
-
-        pointlist = np.array(pointlist)
-        pointlist = pointlist.reshape(pointlist.shape[0], pointlist.shape[1] // 2, -1)
-
-        pr = np.pad(pointlist, ((0, 0), (0, 0), (0, 1)), 'constant', constant_values=(0))
-        pg = np.copy(pr)
-        pb = np.copy(pr)
-
-        for pcount, points in enumerate(pointlist):
-
-            for vcount, point in enumerate(points):
-                # print(p[0])
-                r, g, b = image[tuple(point.astype(int))[::-1]]
-                pr[pcount][vcount][-1] = r
-                pg[pcount][vcount][-1] = g
-                pb[pcount][vcount][-1] = b
-
-        pr = pr.reshape(-1, pr.shape[-1])
-        len = pr.shape[0]
-        tri_ind = np.arange(0, len).reshape(-1, 3)
-        mesh = o3d.geometry.TriangleMesh()
-        mesh.vertices = o3d.utility.Vector3dVector(pr)
-        mesh.triangles = o3d.utility.Vector3iVector(tri_ind)
-
-        new_mesh = mesh.simplify_quadric_decimation(len // shrink)
-        vets = np.asarray(new_mesh.vertices)
-        vets = vets[:, :2].astype(int)
-        tri = np.asarray(new_mesh.triangles)
-
-        pix_map = np.full_like(image[:, :, 0], 0)
-        for t in tri.flatten():
-            x = vets[t][0]
-            y = vets[t][1]
-            pix_map[y - 1][x - 1] = 1
-
-        new_pts = np.array(np.where(pix_map == 1)).T
-        new_pts[:, [0, 1]] = new_pts[:, [1, 0]]
-        return new_pts
+        self.delaunay = Delaunay()
+
+    def _vertex_colors(self, image: np.ndarray, vertices: np.ndarray) -> np.ndarray:
+        """Look up the image color under every vertex."""
+        h, w = image.shape[:2]
+        x = np.clip(vertices[:, 0].astype(int), 0, w - 1)
+        y = np.clip(vertices[:, 1].astype(int), 0, h - 1)
+        return image[y, x].reshape(len(vertices), -1).astype(np.float32)
+
+    def _edges(self, faces: np.ndarray) -> np.ndarray:
+        """Return every directed edge of the mesh (both directions, without duplicates) as an Ex2 array."""
+        e = np.concatenate((faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]])).astype(np.int64)
+        e = np.concatenate((e, e[:, ::-1]))
+        n = int(e.max()) + 1
+        keys = np.sort(e[:, 0] * n + e[:, 1])
+        keys = keys[np.append(True, keys[1:] != keys[:-1])]
+        return np.column_stack((keys // n, keys % n))
+
+    def _boundary(self, n_vertices: int, faces: np.ndarray) -> np.ndarray:
+        """Flag the vertices of edges used by only one face."""
+        e = np.concatenate((faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]))
+        e = np.sort(e, axis=1).astype(np.int64)
+        keys = np.sort(e[:, 0] * n_vertices + e[:, 1])
+        starts = np.flatnonzero(np.append(True, keys[1:] != keys[:-1]))
+        counts = np.diff(np.append(starts, len(keys)))
+        once = keys[starts[counts == 1]]
+        boundary = np.zeros(n_vertices, dtype=bool)
+        boundary[once // n_vertices] = True
+        boundary[once % n_vertices] = True
+        return boundary
+
+    def _vertex_error(self, colors: np.ndarray, edges: np.ndarray) -> np.ndarray:
+        """Distance between each vertex color and the mean color of its neighbors."""
+        n = len(colors)
+        degree = np.bincount(edges[:, 0], minlength=n)
+        mean = np.stack([
+            np.bincount(edges[:, 0], weights=colors[edges[:, 1], c], minlength=n)
+            for c in range(colors.shape[1])], axis=1) / np.maximum(degree, 1)[:, None]
+        return np.linalg.norm(colors - mean, axis=1)
+
+    def _select(self, error: np.ndarray, edges: np.ndarray, available: np.ndarray) -> np.ndarray:
+        """Pick an independent set of the available vertices, preferring the cheapest.
+
+        Repeatedly takes the vertices that are cheaper than all of their available
+        neighbors (ties broken by index) and blocks their neighbors.
+        """
+        n = len(error)
+        rank = np.empty(n, dtype=np.int64)
+        rank[np.lexsort((np.arange(n), error))] = np.arange(n)
+        available = available.copy()
+        selected = []
+        while np.any(available):
+            masked = np.where(available, rank, n)
+            neighbor_min = np.full(n, n, dtype=np.int64)
+            np.minimum.at(neighbor_min, edges[:, 0], masked[edges[:, 1]])
+            minima = available & (rank < neighbor_min)
+            selected.append(np.flatnonzero(minima))
+
+            available &= ~minima
+            blocked = minima[edges[:, 0]]
+            available[edges[blocked, 1]] = False
+        return np.concatenate(selected) if selected else np.zeros(0, dtype=np.int64)
+
+    def _collapse_targets(self, points: np.ndarray, faces: np.ndarray, colors: np.ndarray,
+                          edges: np.ndarray, selected: np.ndarray) -> np.ndarray:
+        """For every selected vertex, the neighbor to collapse it onto, or -1 if none is valid.
+
+        A collapse v -> u is valid if no face of v that does not contain u flips
+        its orientation or becomes degenerate when v is moved onto u.
+        """
+        n = len(points)
+        target = np.full(n, -1, dtype=np.int64)
+        is_selected = np.zeros(n, dtype=bool)
+        is_selected[selected] = True
+
+        # Candidate half-edges v -> u
+        half = edges[is_selected[edges[:, 0]]]
+        hv, hu = half[:, 0], half[:, 1]
+
+        # Incident face corners of every vertex
+        corners = np.argsort(faces.ravel(), kind="stable")
+        degree = np.bincount(faces.ravel(), minlength=n)
+        first = np.cumsum(degree) - degree
+
+        # Pair every half-edge with every face of its source vertex
+        counts = degree[hv]
+        pair_edge = np.repeat(np.arange(len(half)), counts)
+        local = np.arange(len(pair_edge)) - np.repeat(np.cumsum(counts) - counts, counts)
+        corner = corners[first[hv[pair_edge]] + local]
+        face = faces[corner // 3].astype(np.int64)
+        u = hu[pair_edge]
+
+        # Faces containing u disappear with the collapse, the others must not fold over
+        keeps = (face != u[:, None]).all(axis=1)
+        p = points[face].astype(np.float64)
+        moved = p.copy()
+        moved[np.arange(len(face)), corner % 3] = points[u]
+
+        def area(t):
+            return (t[:, 1, 0] - t[:, 0, 0]) * (t[:, 2, 1] - t[:, 0, 1]) \
+                - (t[:, 2, 0] - t[:, 0, 0]) * (t[:, 1, 1] - t[:, 0, 1])
+
+        folds = keeps & (area(p) * area(moved) <= 0)
+        valid = np.bincount(pair_edge, weights=folds, minlength=len(half)) == 0
+
+        # Among the valid half-edges pick the closest color
+        cost = np.linalg.norm(colors[hv] - colors[hu], axis=1)
+        idx = np.flatnonzero(valid)
+        idx = idx[np.lexsort((cost[idx], hv[idx]))]
+        first_of_v = np.ones(len(idx), dtype=bool)
+        first_of_v[1:] = hv[idx][1:] != hv[idx][:-1]
+        idx = idx[first_of_v]
+        target[hv[idx]] = hu[idx]
+        return target
+
+    def run(self, image: np.ndarray, vertices: PointList, shrink: float = 20,
+            target_faces: Optional[int] = None, max_error: Optional[float] = None) -> Mesh:
+        """Triangulate the points and decimate the mesh. Return the simplified (uncolored) Mesh.
+
+        Keyword arguments:
+            image -- the BGR image the vertex colors are looked up in
+            vertices -- an Nx2 array of (x, y) points
+            shrink -- the face count reduction factor, used when target_faces is not given
+            target_faces -- stop once the mesh has at most this many faces
+            max_error -- never remove a vertex whose color error is above this budget
+        """
+        h, w = image.shape[:2]
+        points, faces = self.delaunay.run(w, h, vertices)
+        return self.simplify(image, Mesh(points, faces), shrink, target_faces, max_error).compact()
+
+    def simplify(self, image: np.ndarray, mesh: Mesh, shrink: float = 20,
+                 target_faces: Optional[int] = None, max_error: Optional[float] = None) -> Mesh:
+        """Decimate an already triangulated mesh. Return an (uncolored) Mesh on the same vertex array.
+
+        The vertices on the boundary of the mesh are kept, so a piece of a larger
+        mesh can be simplified on its own and still fit its neighbors.
+
+        Keyword arguments:
+            image -- the BGR image the vertex colors are looked up in
+            mesh -- the triangle mesh to simplify
+            shrink -- the face count reduction factor, used when target_faces is not given
+            target_faces -- stop once the mesh has at most this many faces
+            max_error -- never remove a vertex whose color error is above this budget
+        """
+        points, faces = mesh.vertices, mesh.faces.astype(np.int64)
+        if target_faces is None:
+            target_faces = int(len(faces) / shrink) if shrink else len(faces)
+        colors = self._vertex_colors(image, points)
+        removed = np.zeros(len(points), dtype=bool)
+        boundary = self._boundary(len(points), faces)
+
+        while len(faces) > target_faces:
+            edges = self._edges(faces)
+            error = self._vertex_error(colors, edges)
+            available = ~boundary & ~removed
+            if max_error is not None:
+                available &= error <= max_error
+
+            # Removing an interior vertex removes two faces; only consider
+            # a bounded number of the cheapest vertices in each round
+            n_remove = max((len(faces) - target_faces + 1) // 2, 1)
+            candidates = np.flatnonzero(available)
+            if len(candidates) > 2 * n_remove:
+                # Inclusive, so vertices tied at the cutoff (e.g. in flat regions, all
+                # at error 0) are kept rather than all dropped
+                cutoff = np.partition(error[candidates], 2 * n_remove)[2 * n_remove]
+                available &= error <= cutoff
+
+            selected = self._select(error, edges, available)
+            target = self._collapse_targets(points, faces, colors, edges, selected)
+            collapse = np.flatnonzero(target >= 0)
+            collapse = collapse[np.argsort(error[collapse], kind="stable")][:n_remove]
+            if len(collapse) == 0:
+                break
+
+            remap = np.arange(len(points))
+            remap[collapse] = target[collapse]
+            removed[collapse] = True
+            faces = remap[faces]
+            degenerate = (faces[:, 0] == faces[:, 1]) | (faces[:, 1] == faces[:, 2]) | (faces[:, 2] == faces[:, 0])
+            faces = faces[~degenerate]
+
+        return Mesh(points, faces)
@@ -0,0 +1,56 @@
+from typing import Tuple
+
+import numpy as np
+import cv2
+
+
+class Delaunay:
+    """
+    Index-based Delaunay triangulation.
+
+    All points are inserted into a cv2.Subdiv2D in a single call. The triangles
+    are returned as int32 indices into a shared float32 vertex array, with the
+    outer "virtual" triangles of the subdivision already removed.
+    """
+
+    @staticmethod
+    def _keys(points: np.ndarray) -> np.ndarray:
+        """Pack float32 (x, y) pairs into sortable uint64 keys (exact, no rounding)."""
+        bits = np.ascontiguousarray(points, dtype=np.float32).view(np.uint32).reshape(-1, 2)
+        return (bits[:, 0].astype(np.uint64) << np.uint64(32)) | bits[:, 1].astype(np.uint64)
+
+    def run(self, width: int, height: int, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Triangulate an Nx2 point array.
+
+        Returns (vertices, faces), where vertices is a float32 Vx2 array of the unique
+        input points and faces is an int32 Mx3 array of indices into vertices.
+
+        Keyword arguments:
+            width -- the width of the region containing the points
+            height -- the height of the region containing the points
+            points -- an Nx2 array of (x, y) coordinates
+        """
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        vertices = np.unique(points, axis=0)
+        if len(vertices) < 3:
+            return vertices, np.zeros((0, 3), dtype=np.int32)
+
+        subdiv = cv2.Subdiv2D((0, 0, int(width), int(height)))
+        subdiv.insert(vertices)
+
+        # getTriangleList() skips the triangles touching the outer vertices, and
+        # returns an empty tuple rather than an array when none are left (collinear points)
+        triangles = np.asarray(subdiv.getTriangleList(), dtype=np.float32).reshape(-1, 2)
+        if len(triangles) == 0:
+            return vertices, np.zeros((0, 3), dtype=np.int32)
+
+        # Recover the vertex indices from the (exact) float32 coordinates
+        keys = self._keys(vertices)
+        order = np.argsort(keys)
+        tri_keys = self._keys(triangles)
+        pos = np.minimum(np.searchsorted(keys, tri_keys, sorter=order), len(keys) - 1)
+        found = keys[order[pos]] == tri_keys
+
+        faces = order[pos].reshape(-1, 3).astype(np.int32)
+        faces = faces[found.reshape(-1, 3).all(axis=1)]
+        return vertices, faces
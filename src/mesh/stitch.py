@@ -0,0 +1,197 @@
+from typing import Tuple
+
+import numpy as np
+
+from mesh.delaunay import Delaunay
+from util.geometry_types import Mesh
+
+Rect = Tuple[int, int, int, int]
+
+
+class TileStitcher:
+    """
+    Tile-wise Delaunay triangulation that stitches into one global triangulation.
+
+    Every tile triangulates the points of its core rectangle grown by a margin
+    and keeps the triangles whose centroid lies in the core. A triangle is only
+    trusted if its circumdisk (within the image) lies inside the grown
+    rectangle, or is checked against all points to be empty: the triangle is
+    then a triangle of the global Delaunay triangulation. The edges bounding
+    the tile's triangulation near the core are checked to bound the global
+    one as well, so no part of the core is left uncovered. If anything
+    cannot be trusted, the margin is doubled. The cores partition the image,
+    so the kept triangles of all tiles form the global triangulation without
+    duplicates or gaps.
+    """
+
+    def __init__(self):
+        self.delaunay = Delaunay()
+
+    @staticmethod
+    def grid(width: int, height: int, tile_size: int) -> list:
+        """Split the image into (x0, y0, x1, y1) core rectangles of at most tile_size pixels."""
+        return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+                for y in range(0, height, tile_size)
+                for x in range(0, width, tile_size)]
+
+    @staticmethod
+    def circumcircles(tri: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Circumcenters (Mx2) and radii (M) of an Mx3x2 triangle array; degenerate ones get an infinite radius."""
+        a = tri[:, 0].astype(np.float64)
+        b = tri[:, 1] - a
+        c = tri[:, 2] - a
+        d = 2 * (b[:, 0] * c[:, 1] - b[:, 1] * c[:, 0])
+        b2 = (b ** 2).sum(axis=1)
+        c2 = (c ** 2).sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ux = (c[:, 1] * b2 - b[:, 1] * c2) / d
+            uy = (b[:, 0] * c2 - c[:, 0] * b2) / d
+        radius = np.hypot(ux, uy)
+        radius[~np.isfinite(radius)] = np.inf
+        return np.column_stack((ux, uy)) + a, radius
+
+    def tile_faces(self, vertices: np.ndarray, core: Rect, width: int, height: int,
+                   margin: int = 64) -> np.ndarray:
+        """Return the faces of the global triangulation owned by one tile, as indices into vertices.
+
+        Keyword arguments:
+            vertices -- the float32 Nx2 array of all unique points, sorted as returned by Delaunay
+            core -- the (x0, y0, x1, y1) rectangle of the tile
+            width -- the width of the image
+            height -- the height of the image
+            margin -- the initial number of pixels the core is grown by
+        """
+        x0, y0, x1, y1 = core
+        margin = max(int(margin), 1)
+        while True:
+            grown = (max(x0 - margin, 0), max(y0 - margin, 0),
+                     min(x1 + margin, width), min(y1 + margin, height))
+            everything = grown == (0, 0, width, height)
+            inside = (vertices[:, 0] >= grown[0]) & (vertices[:, 0] < grown[2]) \
+                & (vertices[:, 1] >= grown[1]) & (vertices[:, 1] < grown[3])
+            if everything:
+                inside[:] = True
+            index = np.flatnonzero(inside)
+
+            # The vertices are sorted, so any subset of them triangulates onto the same order
+            _, faces = self.delaunay.run(width, height, vertices[index])
+            faces = index[faces]
+            tri = vertices[faces].astype(np.float64)
+
+            lo = tri.min(axis=1)
+            hi = tri.max(axis=1)
+            touches = (hi[:, 0] >= x0) & (lo[:, 0] < x1) & (hi[:, 1] >= y0) & (lo[:, 1] < y1)
+            centroid = tri.mean(axis=1)
+            owned = (centroid[:, 0] >= x0) & (centroid[:, 0] < x1) \
+                & (centroid[:, 1] >= y0) & (centroid[:, 1] < y1)
+            if everything:
+                return faces[owned]
+
+            # The part of every circumdisk that lies in the image must lie in the grown
+            # rectangle, i.e. the disk must miss the strips of the image around it
+            center, radius = self.circumcircles(tri)
+            strips = [(0, 0, grown[0], height), (grown[2], 0, width, height),
+                      (grown[0], 0, grown[2], grown[1]), (grown[0], grown[3], grown[2], height)]
+            trusted = np.isfinite(radius)
+            for sx0, sy0, sx1, sy1 in strips:
+                if sx0 >= sx1 or sy0 >= sy1:
+                    continue
+                dx = np.maximum(np.maximum(sx0 - center[:, 0], center[:, 0] - sx1), 0)
+                dy = np.maximum(np.maximum(sy0 - center[:, 1], center[:, 1] - sy1), 0)
+                with np.errstate(invalid="ignore"):
+                    trusted &= dx ** 2 + dy ** 2 >= radius ** 2
+            # Check the few remaining disks (mostly slivers along the image border) against all points
+            for i in np.flatnonzero(touches & ~trusted & np.isfinite(radius)):
+                trusted[i] = self._is_empty(vertices, faces[i], center[i], radius[i], width, height)
+            if np.all(trusted[touches]) and np.any(touches) \
+                    and self._boundary_trusted(vertices, faces, core, width, height):
+                return faces[owned]
+            margin *= 2
+
+    def _boundary_trusted(self, vertices: np.ndarray, faces: np.ndarray, core: Rect,
+                          width: int, height: int) -> bool:
+        """Check that the edges bounding the tile triangulation near the core also bound the global one.
+
+        cv2.Subdiv2D triangulates inside three far "virtual" vertices and drops the
+        triangles touching them. Beyond a boundary edge (a, b) of the tile lies such a
+        triangle (a, b, v); the edge bounds the global triangulation too iff the
+        circle through a, b and v holds no point at all. Otherwise a part of the
+        core is left uncovered by the tile and the margin has to grow.
+        """
+        x0, y0, x1, y1 = core
+        edges = np.concatenate((faces[:, [0, 1, 2]], faces[:, [1, 2, 0]], faces[:, [2, 0, 1]])).astype(np.int64)
+        n = len(vertices)
+        keys = np.minimum(edges[:, 0], edges[:, 1]) * n + np.maximum(edges[:, 0], edges[:, 1])
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        once = np.ones(len(keys), dtype=bool)
+        once[1:] &= keys[1:] != keys[:-1]
+        once[:-1] &= keys[:-1] != keys[1:]
+        boundary = edges[order[once]]
+
+        a = vertices[boundary[:, 0]].astype(np.float64)
+        b = vertices[boundary[:, 1]].astype(np.float64)
+        c = vertices[boundary[:, 2]].astype(np.float64)
+        lo = np.minimum(a, b)
+        hi = np.maximum(a, b)
+        near = (hi[:, 0] >= x0) & (lo[:, 0] < x1) & (hi[:, 1] >= y0) & (lo[:, 1] < y1)
+
+        big = 3.0 * max(width, height)
+        virtual = np.array([(big, 0.0), (0.0, big), (-big, -big)])
+
+        def side(p, q, r):
+            return (q[..., 0] - p[..., 0]) * (r[..., 1] - p[..., 1]) - (q[..., 1] - p[..., 1]) * (r[..., 0] - p[..., 0])
+
+        for i in np.flatnonzero(near):
+            inner = side(a[i], b[i], c[i])
+            found = False
+            for v in virtual:
+                # Only virtual vertices on the far side of the edge from its face
+                if side(a[i], b[i], v) * inner >= 0:
+                    continue
+                center, radius = self.circumcircles(np.array([[a[i], b[i], v]]))
+                if np.isfinite(radius[0]) and self._is_empty(
+                        vertices, boundary[i, :2], center[0], radius[0], width, height):
+                    found = True
+                    break
+            if not found:
+                return False
+        return True
+
+    @staticmethod
+    def _is_empty(vertices: np.ndarray, face: np.ndarray, center: np.ndarray, radius: float,
+                  width: int, height: int) -> bool:
+        """Check that no vertex other than those of the face lies strictly inside the circle."""
+        # The vertices are sorted by x, so the candidates are a contiguous range
+        lo = np.searchsorted(vertices[:, 0], max(center[0] - radius, 0), side="left")
+        hi = np.searchsorted(vertices[:, 0], min(center[0] + radius, width), side="right")
+        candidates = vertices[lo:hi].astype(np.float64)
+        inside = ((candidates - center) ** 2).sum(axis=1) < radius ** 2 * (1 - 1e-9)
+        inside[face[(face >= lo) & (face < hi)] - lo] = False
+        return not np.any(inside)
+
+    def is_seamless(self, mesh: Mesh) -> bool:
+        """Check that the stitched mesh is one gap-free, non-overlapping triangulation.
+
+        All faces must have the same orientation, no directed edge may appear
+        twice (so every edge has at most one face on either side) and the mesh
+        must be a single disk without holes (V - E + F = 1).
+        """
+        if len(mesh) == 0:
+            return True
+        tri = mesh.triangles.astype(np.float64)
+        area = (tri[:, 1, 0] - tri[:, 0, 0]) * (tri[:, 2, 1] - tri[:, 0, 1]) \
+            - (tri[:, 2, 0] - tri[:, 0, 0]) * (tri[:, 1, 1] - tri[:, 0, 1])
+        if not (np.all(area > 0) or np.all(area < 0)):
+            return False
+
+        n = len(mesh.vertices)
+        e = np.concatenate((mesh.faces[:, [0, 1]], mesh.faces[:, [1, 2]], mesh.faces[:, [2, 0]])).astype(np.int64)
+        directed = np.sort(e[:, 0] * n + e[:, 1])
+        if np.any(directed[1:] == directed[:-1]):
+            return False
+
+        undirected = np.sort(np.sort(e, axis=1)[:, 0] * n + np.sort(e, axis=1)[:, 1])
+        edges = 1 + np.count_nonzero(undirected[1:] != undirected[:-1])
+        vertices = len(np.unique(mesh.faces))
+        return vertices - edges + len(mesh) == 1
@@ -0,0 +1,304 @@
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import sampler.BN_Sample as Sampler
+from mesh.decimation import Decimate
+from sampling.edges import EdgeTracer
+from sampling.error_dither import ErrorDither
+from sampling.importance_map import ImportanceMap
+from sampling.lod import LevelOfDetail
+from sampling.triangulate import Triangulate
+from tracer.color_quant import ColorQuantization
+from tracer.contour_trace import ContourTracer
+from util.bench import Bench, StageRecord
+from util.cache import StageCache
+from util.mesh_to_svg import SVGWriter
+from util.geometry_types import Mesh
+from util.metrics import psnr, ssim
+from util.render import MeshRenderer
+from util.settings import Settings
+
+
+def lod_paths(output_path: str, n_levels: int) -> List[str]:
+    """The files of the levels of detail, coarsest first; the finest level is the output itself."""
+    root, ext = os.path.splitext(output_path)
+    return [f"{root}.lod{i}{ext}" for i in range(n_levels - 1)] + [output_path]
+
+
+def write_svg(settings: Settings, width: int, height: int, meshes: List[Mesh], output_path: str) -> int:
+    """Write the finest mesh, and the coarser levels of detail before it as settings.lod_mode says.
+
+    Return the number of bytes written.
+    """
+    writer = SVGWriter(width, height, 1, settings.precision, settings.svg_backend)
+    if len(meshes) > 1 and settings.lod_mode == "layers":
+        writer.draw_layers(output_path, meshes)
+        return os.path.getsize(output_path)
+
+    paths = lod_paths(output_path, len(meshes))
+    for path, mesh in zip(paths, meshes):
+        writer.draw_triangles(path, mesh)
+    return sum(os.path.getsize(path) for path in paths)
+
+
+class Pipeline:
+    """
+    The full image to SVG conversion with every stage set up once.
+
+    A Pipeline is meant to be built once per process and reused for any
+    number of images, so the stage objects and imports are not paid per image.
+    """
+
+    def __init__(self, settings: Settings, gamma: float = 0.5, mag: float = 1000.0,
+                 shrink: float = 10, verbose: bool = False):
+        """
+        Keyword arguments:
+            settings -- the parsed command line settings
+            gamma -- the importance map gamma
+            mag -- the blue-noise sampling density (the starting guess with settings.points)
+            shrink -- the face count reduction factor of the decimation
+            verbose -- print a line as every stage starts
+        """
+        self.settings = settings
+        self.gamma = gamma
+        self.mag = mag
+        self.shrink = shrink
+        self.verbose = verbose
+
+        self.importance_map = ImportanceMap(settings.luma)
+        self.sampler = Sampler.ImageQuasisampler()
+        self.decimate = Decimate()
+        self.triangulate = Triangulate()
+        self.dither = ErrorDither(settings.dither_kernel)
+        self.edges = EdgeTracer(settings.edges, settings.edge_threshold) if settings.edges else None
+        self.lod = LevelOfDetail()
+        self.quantize = ColorQuantization()
+        self.tracer = ContourTracer(precision=settings.precision)
+        self.renderer = MeshRenderer()
+        self.cache = StageCache(settings.cache, settings.cache_size << 20) if settings.cache else None
+
+    def _log(self, message: str) -> None:
+        if self.verbose:
+            print(message)
+
+    def _keys(self, digest: str) -> Dict[str, str]:
+        """The cache key of every stage, each depending on the one before it and its own parameters."""
+        settings = self.settings
+        keys = {"importance map": StageCache.key("importance map", digest, settings.luma, self.gamma)}
+        keys["BN sampling"] = StageCache.key("BN sampling", keys["importance map"], self.mag, settings.points,
+                                             settings.sampler, settings.dither_kernel, settings.sampling_f,
+                                             settings.edges, settings.edge_threshold)
+        keys["decimation"] = StageCache.key("decimation", keys["BN sampling"], self.shrink)
+        keys["triangulation"] = StageCache.key("triangulation", keys["decimation"], settings.color_mode)
+        return keys
+
+    @staticmethod
+    def _arrays(mesh: Mesh) -> Dict[str, np.ndarray]:
+        return {"vertices": mesh.vertices, "faces": mesh.faces, "colors": mesh.colors}
+
+    def _stage(self, bench: Bench, name: str, key: Optional[str], compute: Callable[[], Dict[str, np.ndarray]],
+               loaded: Optional[Dict[str, np.ndarray]] = None,
+               **inputs: int) -> Tuple[Dict[str, np.ndarray], StageRecord]:
+        """Run one stage, or load its arrays from the cache. Return the arrays and the stage record.
+
+        loaded -- the arrays already looked up in the cache ({} for a miss), so they are not looked up again
+        """
+        with bench.stage(name, **inputs) as stage:
+            arrays = loaded if loaded is not None else (self.cache.load(key) if key else None)
+            if not arrays:
+                arrays = compute()
+                if key:
+                    self.cache.store(key, arrays)
+            else:
+                stage.set(cached=1)
+        return arrays, stage
+
+    def _run_regions(self, image_path: str, output_path: str, bench: Bench) -> dict:
+        """Convert one image into an SVG file of traced color regions."""
+        settings = self.settings
+
+        self._log("Loading image...")
+        with bench.stage("image decode") as stage:
+            image = cv2.imread(image_path)
+            if image is None:
+                raise ValueError(f"Could not read image '{image_path}'")
+            stage.set(pixels=image.shape[0] * image.shape[1])
+        h, w = image.shape[:2]
+
+        self._log("Performing color quantization...")
+        with bench.stage("color quantization", pixels=h * w) as stage:
+            quantized = self.quantize.run(settings, image, settings.colors)
+            stage.set(colors=len(quantized))
+
+        self._log("Tracing contours...")
+        with bench.stage("contour tracing", pixels=h * w, colors=len(quantized)) as stage:
+            # As many threads as OpenCV may use, i.e. one per worker in batch mode
+            self.tracer.jobs = max(cv2.getNumThreads(), 1)
+            layers = self.tracer.run(quantized)
+            stage.set(layers=len(layers))
+
+        with bench.stage("SVG write", layers=len(layers)) as stage:
+            SVGWriter(w, h, 1, settings.precision).draw_paths(output_path, layers)
+            size = os.path.getsize(output_path)
+            stage.set(bytes=size)
+
+        return {
+            "width": w,
+            "height": h,
+            "colors": len(quantized),
+            "layers": len(layers),
+            "bytes": size,
+        }
+
+    def run(self, image_path: str, output_path: str, bench: Optional[Bench] = None) -> dict:
+        """Convert one image into an SVG file. Return the sizes of the result.
+
+        With a cache, only the stages after the first one whose output is not
+        cached are run; the image is not even decoded if the mesh is cached.
+
+        Keyword arguments:
+            image_path -- the image to read
+            output_path -- the SVG (or .svgz) file to write
+            bench -- records the stages if given
+        """
+        settings = self.settings
+        bench = bench or Bench()
+        if settings.mode == "regions":
+            return self._run_regions(image_path, output_path, bench)
+        cache = self.cache
+        lod = settings.lod > 1
+
+        data, keys = None, {}
+        if cache:
+            with open(image_path, "rb") as f:
+                data = f.read()
+            keys = self._keys(StageCache.digest(data))
+            counted = {k: dict(v) for k, v in cache.stats.items()}
+
+        # Look the outputs up from the last stage back until one is cached, keeping what is loaded:
+        # another process sharing the cache may evict an entry at any time, so a stage must not be
+        # skipped on the strength of an entry that is only loaded later
+        loaded: Dict[str, Dict[str, np.ndarray]] = {}
+
+        def lookup(stage: str) -> Dict[str, np.ndarray]:
+            loaded[stage] = (cache.load(keys[stage]) if cache else None) or {}
+            return loaded[stage]
+
+        need_mesh = not lookup("triangulation")
+        need_decimation = need_mesh and not lookup("decimation")
+        need_sampling = need_decimation or lod
+        need_importance = need_sampling and not lookup("BN sampling")
+
+        image, pixels = None, 0
+        if need_importance or need_mesh or lod or settings.quality:
+            self._log("Loading image...")
+            with bench.stage("image decode") as stage:
+                if data is not None:
+                    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                else:
+                    image = cv2.imread(image_path)
+                if image is None:
+                    raise ValueError(f"Could not read image '{image_path}'")
+                stage.set(pixels=image.shape[0] * image.shape[1])
+            pixels = image.shape[0] * image.shape[1]
+
+        importance_map = None
+        if need_importance:
+            # Perform importance map for blue-noise sampling
+            self._log("Performing importance map...")
+            arrays, stage = self._stage(
+                bench, "importance map", keys.get("importance map"),
+                lambda: {"importance": self.importance_map.run(settings, image, self.gamma)}, pixels=pixels)
+            importance_map = arrays["importance"]
+            stage.set(pixels=importance_map.shape[0] * importance_map.shape[1])
+
+        def sample() -> Dict[str, np.ndarray]:
+            arrays = blue_noise()
+            if self.edges:
+                # Boundary points only join the finest level of detail
+                edges = self.edges.run(settings, importance_map)
+                arrays = {"points": np.vstack((arrays["points"].reshape(-1, 2), edges)),
+                          "ranks": np.concatenate((arrays["ranks"], np.ones(len(edges))))}
+            return arrays
+
+        def blue_noise() -> Dict[str, np.ndarray]:
+            if settings.sampler == "dither":
+                scale = None
+                if settings.points:
+                    scale = ErrorDither.scale_for(importance_map, settings.points)
+                points = self.dither.run(settings, importance_map, scale)
+                # Dithered points have no ranks; levels of detail are not allowed with them
+                return {"points": points, "ranks": np.zeros(len(points))}
+            self.sampler.loadImg(importance_map, self.mag)
+            if settings.points:
+                points = self.sampler.sample(settings.points)
+            else:
+                points = self.sampler.getSampledPoints()
+            return {"points": np.asarray(points), "ranks": np.asarray(self.sampler.getSampledRanks()).ravel()}
+
+        sampled = ranks = None
+        if need_sampling:
+            self._log("Performing blue-noise sampling...")
+            arrays, stage = self._stage(bench, "BN sampling", keys.get("BN sampling"), sample,
+                                        loaded.get("BN sampling"), pixels=pixels)
+            sampled, ranks = arrays["points"], arrays["ranks"]
+            stage.set(points=len(sampled))
+
+        mesh = None
+        if need_mesh:
+            self._log("Performing decimation...")
+            arrays, stage = self._stage(
+                bench, "decimation", keys.get("decimation"),
+                lambda: self._arrays(self.decimate.run(image, sampled, self.shrink)), loaded.get("decimation"),
+                points=len(sampled) if sampled is not None else 0)
+            mesh = Mesh(arrays["vertices"], arrays["faces"])
+            stage.set(points=len(mesh.vertices), triangles=len(mesh))
+
+        def color() -> Dict[str, np.ndarray]:
+            colored = self.triangulate.color(settings, image, mesh, settings.color_mode)
+            return dict(self._arrays(colored), shape=np.array(image.shape[:2]))
+
+        self._log("Performing triangulation...")
+        arrays, stage = self._stage(bench, "triangulation", keys.get("triangulation"), color,
+                                    loaded.get("triangulation"),
+                                    points=len(mesh.vertices) if mesh else 0, pixels=pixels)
+        mesh = Mesh(arrays["vertices"], arrays["faces"], arrays["colors"])
+        h, w = (int(n) for n in arrays["shape"])
+        stage.set(triangles=len(mesh))
+
+        meshes = [mesh]
+        if lod:
+            self._log("Building levels of detail...")
+            with bench.stage("level of detail", points=len(mesh.vertices)) as stage:
+                meshes = self.lod.run(image, mesh, sampled, ranks, settings.lod, color_mode=settings.color_mode)
+                stage.set(triangles=sum(len(m) for m in meshes[:-1]))
+
+        quality = {}
+        if settings.quality:
+            self._log("Measuring quality...")
+            with bench.stage("quality", pixels=pixels, triangles=len(mesh)):
+                rendered = self.renderer.render(mesh, w, h)
+                quality = {"psnr": round(psnr(rendered, image), 3), "ssim": round(ssim(rendered, image), 4)}
+
+        # Convert mesh to SVG
+        with bench.stage("SVG write", triangles=sum(len(m) for m in meshes)) as stage:
+            size = write_svg(settings, w, h, meshes, output_path)
+            stage.set(bytes=size)
+
+        result = {
+            "width": w,
+            "height": h,
+            "points": len(sampled) if sampled is not None else None,
+            "vertices": len(mesh.vertices),
+            "triangles": len(mesh),
+            "bytes": size,
+            **quality,
+        }
+        if cache:
+            result["cache_hits"] = sum(c["hits"] - counted.get(s, {}).get("hits", 0) for s, c in cache.stats.items())
+            result["cache_misses"] = sum(c["misses"] - counted.get(s, {}).get("misses", 0)
+                                         for s, c in cache.stats.items())
+        return result
@@ -0,0 +1,96 @@
+#include "sampler/edgetrace.h"
+
+#include <algorithm>
+#include <stdexcept>
+
+std::vector<EdgePoint> traceEdges(const float *plane, int width, int height,
+                                  int step, double threshold) {
+  if (step < 1)
+    throw std::invalid_argument("The edge tracing step must be at least 1");
+
+  std::vector<EdgePoint> points;
+  const size_t n = (size_t)width * height;
+  if (n == 0)
+    return points;
+
+  const float level = (float)(threshold * *std::max_element(plane, plane + n));
+
+  // One bit per pixel, on the heap: whether it is inside, whether it was
+  // traced, and whether it lies within step of a processed point
+  std::vector<bool> inside(n), traced(n), covered(n);
+  for (size_t i = 0; i < n; i++)
+    inside[i] = plane[i] >= level && plane[i] > 0.f;
+
+  auto isInside = [&](int x, int y) {
+    return x >= 0 && y >= 0 && x < width && y < height &&
+           inside[(size_t)y * width + x];
+  };
+  auto isBoundary = [&](int x, int y) {
+    return isInside(x, y) && (!isInside(x - 1, y) || !isInside(x + 1, y) ||
+                              !isInside(x, y - 1) || !isInside(x, y + 1));
+  };
+
+  // The perimeter of the square around a point, clockwise from its top left corner
+  std::vector<int> ringX, ringY;
+  for (int i = -step; i < step; i++) {
+    ringX.push_back(i);
+    ringY.push_back(-step);
+  }
+  for (int i = -step; i < step; i++) {
+    ringX.push_back(step);
+    ringY.push_back(i);
+  }
+  for (int i = step; i > -step; i--) {
+    ringX.push_back(i);
+    ringY.push_back(step);
+  }
+  for (int i = step; i > -step; i--) {
+    ringX.push_back(-step);
+    ringY.push_back(i);
+  }
+  const int ring = (int)ringX.size();
+
+  std::vector<int> xs, ys;
+  auto trace = [&](int x, int y, int parent) {
+    traced[(size_t)y * width + x] = true;
+    points.push_back(EdgePoint(Point2D(x + 0.5, y + 0.5), parent));
+    xs.push_back(x);
+    ys.push_back(y);
+  };
+
+  size_t head = 0;
+  for (int sy = 0; sy < height; sy++) {
+    for (int sx = 0; sx < width; sx++) {
+      if (covered[(size_t)sy * width + sx] || !isBoundary(sx, sy))
+        continue;
+      trace(sx, sy, -1);
+
+      for (; head < points.size(); head++) {
+        const int x = xs[head], y = ys[head];
+
+        // Where the perimeter crosses the boundary, trace the inside pixel of
+        // the crossing, unless an earlier point already covers it
+        bool previous = isInside(x + ringX[ring - 1], y + ringY[ring - 1]);
+        for (int k = 0; k < ring; k++) {
+          const int px = x + ringX[k], py = y + ringY[k];
+          const bool current = isInside(px, py);
+          if (current != previous) {
+            const int k0 = current ? k : (k + ring - 1) % ring;
+            const int cx = x + ringX[k0], cy = y + ringY[k0];
+            const size_t c = (size_t)cy * width + cx;
+            if (!traced[c] && !covered[c])
+              trace(cx, cy, (int)head);
+          }
+          previous = current;
+        }
+
+        const int x0 = std::max(x - step, 0), x1 = std::min(x + step, width - 1);
+        const int y0 = std::max(y - step, 0), y1 = std::min(y + step, height - 1);
+        for (int cy = y0; cy <= y1; cy++)
+          for (int cx = x0; cx <= x1; cx++)
+            covered[(size_t)cy * width + cx] = true;
+      }
+    }
+  }
+  return points;
+}
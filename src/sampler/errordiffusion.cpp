@@ -0,0 +1,94 @@
+#include "sampler/errordiffusion.h"
+
+#include <algorithm>
+#include <stdexcept>
+
+namespace {
+
+/// One weight of a kernel: the error share of the pixel dx to the right and dy below.
+struct Tap {
+  int dx, dy;
+  float weight;
+};
+
+const Tap floydSteinberg[] = {
+    {1, 0, 7 / 16.f}, {-1, 1, 3 / 16.f}, {0, 1, 5 / 16.f}, {1, 1, 1 / 16.f}};
+
+const Tap jarvisJudiceNinke[] = {
+    {1, 0, 7 / 48.f},  {2, 0, 5 / 48.f},  {-2, 1, 3 / 48.f}, {-1, 1, 5 / 48.f},
+    {0, 1, 7 / 48.f},  {1, 1, 5 / 48.f},  {2, 1, 3 / 48.f},  {-2, 2, 1 / 48.f},
+    {-1, 2, 3 / 48.f}, {0, 2, 5 / 48.f},  {1, 2, 3 / 48.f},  {2, 2, 1 / 48.f}};
+
+const Tap stucki[] = {
+    {1, 0, 8 / 42.f},  {2, 0, 4 / 42.f},  {-2, 1, 2 / 42.f}, {-1, 1, 4 / 42.f},
+    {0, 1, 8 / 42.f},  {1, 1, 4 / 42.f},  {2, 1, 2 / 42.f},  {-2, 2, 1 / 42.f},
+    {-1, 2, 2 / 42.f}, {0, 2, 4 / 42.f},  {1, 2, 2 / 42.f},  {2, 2, 1 / 42.f}};
+
+// Every kernel reaches at most this many pixels sideways and rows down
+const int REACH = 2;
+
+} // namespace
+
+DiffusionKernel diffusionKernelByName(const std::string &name) {
+  if (name == "floyd-steinberg")
+    return FloydSteinberg;
+  if (name == "jarvis")
+    return JarvisJudiceNinke;
+  if (name == "stucki")
+    return Stucki;
+  throw std::invalid_argument("Unknown error-diffusion kernel '" + name +
+                              "', expected floyd-steinberg, jarvis or stucki");
+}
+
+std::vector<Point2D> diffuseErrors(const float *plane, int width, int height,
+                                   double scale, DiffusionKernel kernel,
+                                   bool serpentine) {
+  const Tap *taps;
+  int n_taps;
+  switch (kernel) {
+  case JarvisJudiceNinke:
+    taps = jarvisJudiceNinke;
+    n_taps = sizeof(jarvisJudiceNinke) / sizeof(Tap);
+    break;
+  case Stucki:
+    taps = stucki;
+    n_taps = sizeof(stucki) / sizeof(Tap);
+    break;
+  default:
+    taps = floydSteinberg;
+    n_taps = sizeof(floydSteinberg) / sizeof(Tap);
+  }
+
+  // The errors of the current row and the REACH rows below it, in a ring,
+  // padded by REACH on both sides so the taps never need a bounds check.
+  // Errors diffused past the border are dropped.
+  const int stride = width + 2 * REACH;
+  std::vector<float> errors((REACH + 1) * stride, 0.f);
+  std::vector<Point2D> points;
+  const float density = (float)scale;
+
+  for (int y = 0; y < height; y++) {
+    float *rows[REACH + 1];
+    for (int dy = 0; dy <= REACH; dy++)
+      rows[dy] = &errors[((y + dy) % (REACH + 1)) * stride + REACH];
+    const float *in = plane + (size_t)y * width;
+    const bool reverse = serpentine && (y & 1);
+    const int dir = reverse ? -1 : 1;
+
+    for (int i = 0; i < width; i++) {
+      const int x = reverse ? width - 1 - i : i;
+      const float value = in[x] * density + rows[0][x];
+      float error = value;
+      if (value >= 0.5f) {
+        points.push_back(Point2D(x + 0.5, y + 0.5));
+        error -= 1.f;
+      }
+      for (int t = 0; t < n_taps; t++)
+        rows[taps[t].dy][x + dir * taps[t].dx] += error * taps[t].weight;
+    }
+
+    // The current row becomes the last row of the ring
+    std::fill(rows[0] - REACH, rows[0] - REACH + stride, 0.f);
+  }
+  return points;
+}
@@ -1,4 +1,6 @@
 #include "sampler/imagesampler.h"
+#include <climits>
+#include <cmath>
 #include <cstring>
 // #include "numpy/ndarrayobject.h"
 #include "opencv2/core/core.hpp"
@@ -14,59 +16,264 @@ namespace py = boost::python;
 typedef std::vector<Point2D> PointList;
 
 ImageQuasisampler::ImageQuasisampler() {
-  // Load the Matrix
-  this->data.clear();
-  this->mag = 1.0;
+  // Tiles are refined on the maximum of the importance they cover
+  this->minSubdivisionLevel = 2;
+  this->pyramidBase = 1;
+  reset();
 }
 
 ImageQuasisampler::ImageQuasisampler(PyObject *inputObject, double mag) {
-  // Load the Matrix
-  if (!loadImg(inputObject, mag)) {
-    this->data.clear();
-    this->mag = 1.0;
-    this->width = this->height = this->channels = 0;
-    this->type = -1;
+  this->minSubdivisionLevel = 2;
+  this->pyramidBase = 1;
+  reset();
+  loadImg(inputObject, mag);
+}
+
+void ImageQuasisampler::reset() {
+  this->view.reset();
+  this->owned.reset();
+  this->plane = NULL;
+  this->pyramid.clear();
+  this->pyramidWidth.clear();
+  this->mag = 1.0;
+  this->width = this->height = this->channels = 0;
+  this->type = -1;
+}
+
+void ImageQuasisampler::release() {
+  if (root)
+    delete root;
+  root = NULL;
+  std::vector<double>().swap(pointRanks);
+  reset();
+}
+
+void ImageQuasisampler::setPyramidBase(int level) {
+  this->pyramidBase = MAX(level, 1);
+}
+
+void ImageQuasisampler::buildPyramid() {
+  this->pyramid.clear();
+  this->pyramidWidth.clear();
+  int w = (int)this->width, h = (int)this->height;
+  this->pyramidWidth.push_back(w);
+  if (w <= 0 || h <= 0)
+    return;
+
+  std::vector<int> heights(1, h);
+  for (int lw = w, lh = h; lw > 1 || lh > 1;) {
+    lw = (lw + 1) / 2;
+    lh = (lh + 1) / 2;
+    this->pyramidWidth.push_back(lw);
+    heights.push_back(lh);
+  }
+  const int levels = (int)heights.size() - 1;
+  if (levels == 0)
+    return;
+  this->pyramid.resize(levels);
+
+  // The first level kept is reduced straight from the plane, reading it once
+  // row by row, so the skipped levels are never allocated
+  const int base = MIN(this->pyramidBase, levels);
+  {
+    const int bw = this->pyramidWidth[base];
+    std::vector<float> &level = this->pyramid[base - 1];
+    level.assign((size_t)bw * heights[base], 0.f);
+    for (int y = 0; y < h; y++) {
+      const float *row = this->plane + (size_t)y * w;
+      float *out = level.data() + (size_t)(y >> base) * bw;
+      for (int x = 0; x < w; x++)
+        out[x >> base] = MAX(out[x >> base], row[x]);
+    }
+  }
+
+  for (int k = base + 1; k <= levels; k++) {
+    const std::vector<float> &src = this->pyramid[k - 2];
+    const int sw = this->pyramidWidth[k - 1], sh = heights[k - 1];
+    const int nw = this->pyramidWidth[k], nh = heights[k];
+    std::vector<float> &level = this->pyramid[k - 1];
+    level.resize((size_t)nw * nh);
+    for (int y = 0; y < nh; y++) {
+      const float *row0 = src.data() + (size_t)(2 * y) * sw;
+      const float *row1 = 2 * y + 1 < sh ? row0 + sw : row0;
+      for (int x = 0; x < nw; x++) {
+        int x1 = 2 * x + 1 < sw ? 2 * x + 1 : 2 * x;
+        level[(size_t)y * nw + x] =
+            MAX(MAX(row0[2 * x], row0[x1]), MAX(row1[2 * x], row1[x1]));
+      }
+    }
   }
 }
 
-bool ImageQuasisampler::loadImg(PyObject *inputObject, double mag) {
-  cv::Mat returned = BN_Sample::fromNDArrayToMat(inputObject);
-  if (returned.channels() > 3 || returned.dims > 3) {
-    this->data.clear();
-    this->mag = 1.0;
-    this->width = this->height = this->channels = 0;
-    this->type = -1;
-    throw ChannelException();
-    return false;
+float ImageQuasisampler::maxInRect(int x0, int y0, int x1, int y1) const {
+  int k = 0;
+  while ((x1 >> k) - (x0 >> k) > 3 || (y1 >> k) - (y0 >> k) > 3)
+    k++;
+  if (k < this->pyramidBase) // Not kept: bound the rectangle on the plane
+    k = 0;
+  const float *level = k ? this->pyramid[k - 1].data() : this->plane;
+  int w = this->pyramidWidth[k];
+  float m = 0;
+  for (int y = y0 >> k; y <= y1 >> k; y++)
+    for (int x = x0 >> k; x <= x1 >> k; x++)
+      m = MAX(m, level[(size_t)y * w + x]);
+  return m;
+}
+
+// The largest factor searchMagnitude changes the magnitude by in one step
+static const double MAX_MAG_STEP = 16;
+
+// The importance of a magnitude-scaled value, saturated to the unsigned
+// range (converting a double beyond it is undefined behaviour)
+static unsigned saturatedImportance(double value) {
+  if (!(value > 0))
+    return 0;
+  return value >= (double)UINT_MAX ? UINT_MAX : (unsigned)value;
+}
+
+unsigned ImageQuasisampler::getTileImportance(TileNode *tile) {
+  if (!this->plane)
+    return Quasisampler::getTileImportance(tile);
+
+  Point2D p1 = tile->getP1(), p2 = tile->getP2(), p3 = tile->getP3();
+  double x0 = MAX(MIN(p1.x, MIN(p2.x, p3.x)), 0.0);
+  double y0 = MAX(MIN(p1.y, MIN(p2.y, p3.y)), 0.0);
+  double x1 = MIN(MAX(p1.x, MAX(p2.x, p3.x)), this->width - 1);
+  double y1 = MIN(MAX(p1.y, MAX(p2.y, p3.y)), this->height - 1);
+  if (x0 > x1 || y0 > y1) // Outside of the image
+    return 0;
+  float m = maxInRect((int)x0, (int)y0, (int)x1, (int)y1);
+  return saturatedImportance(this->mag * (double)m);
+}
+
+namespace {
+
+/// Releases the GIL for the lifetime of the object.
+struct ReleaseGIL {
+  PyThreadState *state;
+  ReleaseGIL() : state(PyEval_SaveThread()) {}
+  ~ReleaseGIL() { PyEval_RestoreThread(state); }
+};
+
+void releaseBuffer(Py_buffer *view) {
+  PyBuffer_Release(view);
+  delete view;
+}
+
+/// The OpenCV depth of a buffer format, or -1 if it is not supported.
+int formatDepth(const char *format) {
+  if (!format)
+    return CV_8U;
+  // Skip the byte order / alignment prefix
+  if (*format == '@' || *format == '=' || *format == '<' || *format == '>' ||
+      *format == '!')
+    format++;
+  if (format[0] == '\0' || format[1] != '\0')
+    return -1;
+  switch (format[0]) {
+  case 'B':
+    return CV_8U;
+  case 'H':
+    return CV_16U;
+  case 'h':
+    return CV_16S;
+  case 'i':
+    return CV_32S;
+  case 'f':
+    return CV_32F;
+  case 'd':
+    return CV_64F;
+  default:
+    return -1;
   }
+}
 
-  this->mag = mag;
-  this->width = returned.cols;
-  this->height = returned.rows;
-  this->channels = returned.channels();
-  this->type = returned.type();
-  int data_len = (int)(this->width * this->height * this->channels);
-  std::cout << "data_len: " << data_len << std::endl;
-  this->data.clear();
+/// Sum the channels of a strided buffer into a row-major float plane.
+/// The sum is taken in double, as getImportanceAt did per call before.
+template <typename T>
+void reducePlane(const Py_buffer &view, int channels, float *out) {
+  const char *base = static_cast<const char *>(view.buf);
+  const Py_ssize_t rows = view.shape[0], cols = view.shape[1];
+  const Py_ssize_t cstride = view.ndim == 3 ? view.strides[2] : 0;
+  for (Py_ssize_t y = 0; y < rows; y++) {
+    const char *row = base + y * view.strides[0];
+    for (Py_ssize_t x = 0; x < cols; x++) {
+      const char *px = row + x * view.strides[1];
+      double sum = 0;
+      for (int c = 0; c < channels; c++)
+        sum += *reinterpret_cast<const T *>(px + c * cstride);
+      out[y * cols + x] = (float)sum;
+    }
+  }
+}
 
-  cv::Mat typed;
-  returned.convertTo(typed, CV_64F);
+} // namespace
 
-  std::vector<cv::Mat> three_channels;
-  cv::split(typed, three_channels);
+bool ImageQuasisampler::loadImg(PyObject *inputObject, double mag) {
+  Py_buffer *view = new Py_buffer;
+  if (PyObject_GetBuffer(inputObject, view, PyBUF_RECORDS_RO) != 0) {
+    delete view;
+    PyErr_Clear();
+    reset();
+    throw FormatException();
+  }
+  std::shared_ptr<Py_buffer> held(view, releaseBuffer);
 
-  for (int i = 0; i < returned.channels(); i++) {
-    data.insert(data.end(), three_channels[i].begin<double>(),
-                three_channels[i].end<double>());
+  int depth = formatDepth(view->format);
+  if (depth < 0 || view->ndim < 2 || view->ndim > 3) {
+    reset();
+    throw FormatException();
+  }
+  int channels = view->ndim == 3 ? (int)view->shape[2] : 1;
+  if (channels < 1 || channels > 3) {
+    reset();
+    throw ChannelException();
   }
 
+  reset();
+  this->mag = mag;
+  this->width = (double)view->shape[1];
+  this->height = (double)view->shape[0];
+  this->channels = channels;
+  this->type = CV_MAKETYPE(depth, channels);
+
+  // An already reduced float32 plane is sampled in place
+  if (depth == CV_32F && channels == 1 && PyBuffer_IsContiguous(view, 'C')) {
+    this->view = held;
+    this->plane = static_cast<const float *>(view->buf);
+    buildPyramid();
+    return true;
+  }
 
-  std::cout << "loaded:" << data.size() << std::endl;
+  this->owned = std::make_shared<std::vector<float> >(
+      (size_t)view->shape[0] * (size_t)view->shape[1]);
+  float *out = owned->data();
+  switch (depth) {
+  case CV_8U:
+    reducePlane<unsigned char>(*view, channels, out);
+    break;
+  case CV_16U:
+    reducePlane<unsigned short>(*view, channels, out);
+    break;
+  case CV_16S:
+    reducePlane<short>(*view, channels, out);
+    break;
+  case CV_32S:
+    reducePlane<int>(*view, channels, out);
+    break;
+  case CV_32F:
+    reducePlane<float>(*view, channels, out);
+    break;
+  default:
+    reducePlane<double>(*view, channels, out);
+    break;
+  }
+  this->plane = out;
+  buildPyramid();
   return true;
 }
 // deprecated
 bool ImageQuasisampler::loadPGM(char *filename, double mag) {
-  std::cout << filename << std::endl;
   int w, h = 0;
   if (!filename) {
     cerr << "Could not load PGM: no filename given." << endl;
@@ -95,51 +302,30 @@ bool ImageQuasisampler::loadPGM(char *filename, double mag) {
   } while (buffer[0] == '#');
   unsigned maxval;
   maxval = atoi(buffer); // nb: not used.
-  this->data.clear();
+  reset();
+  this->owned = std::make_shared<std::vector<float> >();
   unsigned temp = 0;
   for (unsigned i = 0; i < w * h; i++) {
     infile >> temp;
-    this->data.push_back(temp);
-    //        std::cout<<(int)data[i]<<" ";
+    this->owned->push_back(temp);
   }
   infile.close();
-
-  if (mag != 1.0)
-    this->mag = mag;
+  this->plane = owned->data();
+  this->mag = mag;
 
   this->width = w;
   this->height = h;
   this->channels = 1;
+  buildPyramid();
   return true;
 }
 
 unsigned ImageQuasisampler::getImportanceAt(Point2D pt) {
+  if (!this->plane)
+    throw "No Valid Data loaded";
   int x = (int)pt.x;
   int y = (int)pt.y;
-  int w = (int)(this->width);
-  int h = (int)(this->height);
-
-  if (this->data.empty()) {
-    throw "No Valid Data loaded";
-    exit(-1);
-  }
-  int range = this->width * this->height;
-  double sum = 0;
-  for (int i = 0; i < this->channels; i++) {
-    int index = (y * w + x) + i * range;
-    if (index > (this->width * this->height * this->channels)) {
-      std::cerr << "outside" << std::endl;
-      continue;
-    }
-
-    sum += (this->data)[index];
-  }
-
-  //  }
-
-  sum = (unsigned)this->mag * sum;
-  //  std::cout<<sum<<" ";
-  return sum;
+  return saturatedImportance(this->mag * (double)plane[(size_t)y * (size_t)this->width + x]);
 }
 
 cv::Mat ImageQuasisampler::debugTool() {
@@ -157,19 +343,140 @@ cv::Mat ImageQuasisampler::debugTool() {
   return passing;
 }
 
-cv::Mat ImageQuasisampler::getSampledPoints() {
-
-  PointList points = this->getSamplingPoints();
+namespace {
 
-  int num_pts = points.size();
-  //  std::cout<<"numpts"<<num_pts<<std::endl;
-  cv::Mat passing = Mat::zeros(num_pts, 2, CV_64F);
+cv::Mat toMat(const PointList &points) {
+  cv::Mat passing = Mat::zeros((int)points.size(), 2, CV_64F);
   for (int i = 0; i < passing.rows; i++) {
     passing.at<double>(i, 0) = points[i].x;
     passing.at<double>(i, 1) = points[i].y;
   }
+  return passing;
+}
+
+} // namespace
+
+cv::Mat ImageQuasisampler::getSampledPoints() {
+  if (!this->plane)
+    throw "No Valid Data loaded";
+
+  // The sampler only reads its own state, so other Python threads (and
+  // other samplers) can run meanwhile
+  PointList points;
+  {
+    ReleaseGIL released;
+    points = this->getSamplingPoints();
+  }
+  return toMat(points);
+}
+
+PointList ImageQuasisampler::searchMagnitude(unsigned n_points,
+                                             double tolerance,
+                                             unsigned max_iter) {
+  if (root)
+    delete root;
+  root = NULL;
 
+  if (this->mag <= 0)
+    this->mag = 1.0;
+  const double target = n_points;
+  double lo = 0, hi = HUGE_VAL; // Magnitudes known to give too few / too many points
+  double best_mag = this->mag, best_err = HUGE_VAL;
+  PointList points, best;
+  std::vector<double> best_ranks;
+  for (unsigned iter = 0; iter < MAX(max_iter, 1u); iter++) {
+    buildAdaptiveSubdivision();
+    collectPoints(points);
+
+    double n = points.size();
+    double err = fabs(n - target);
+    if (err < best_err) {
+      best_err = err;
+      best_mag = this->mag;
+      best = points;
+      best_ranks = pointRanks;
+    }
+    if (err <= tolerance * target)
+      break;
+
+    if (n < target)
+      lo = this->mag;
+    else
+      hi = this->mag;
+    // The point count grows about linearly with the magnitude; bisect
+    // (geometrically) when that guess leaves the bracket. A step is at most
+    // MAX_MAG_STEP times, as a sparse map (a point or two) would otherwise
+    // ask for a magnitude, and so a subdivision depth, beyond all bounds
+    double next = n > 0 ? this->mag * target / n : this->mag * 4;
+    next = MIN(MAX(next, this->mag / MAX_MAG_STEP), this->mag * MAX_MAG_STEP);
+    if (next <= lo || next >= hi)
+      next = hi == HUGE_VAL ? lo * 2 : (lo > 0 ? sqrt(lo * hi) : hi / 2);
+    this->mag = next;
+  }
+
+  this->mag = best_mag;
+  pointRanks.swap(best_ranks);
+  return best;
+}
+
+cv::Mat ImageQuasisampler::sample(unsigned n_points, double tolerance,
+                                  unsigned max_iter) {
+  if (!this->plane)
+    throw "No Valid Data loaded";
+
+  PointList points;
+  pointRanks.clear();
+  if (n_points > 0) {
+    ReleaseGIL released;
+    points = searchMagnitude(n_points, tolerance, max_iter);
+  }
+  return toMat(points);
+}
+
+cv::Mat ImageQuasisampler::getSampledRanks() const {
+  cv::Mat passing = Mat::zeros((int)pointRanks.size(), 1, CV_64F);
+  for (int i = 0; i < passing.rows; i++)
+    passing.at<double>(i, 0) = pointRanks[i];
   return passing;
 }
 
+cv::Mat ImageQuasisampler::getDitheredPoints(double scale,
+                                             const std::string &kernel,
+                                             bool serpentine) {
+  if (!this->plane)
+    throw "No Valid Data loaded";
+
+  DiffusionKernel taps = diffusionKernelByName(kernel);
+  PointList points;
+  {
+    ReleaseGIL released;
+    points = diffuseErrors(this->plane, (int)this->width, (int)this->height,
+                           scale, taps, serpentine);
+  }
+  return toMat(points);
+}
+
+cv::Mat ImageQuasisampler::getEdgeTrace(int step, double threshold) {
+  if (!this->plane)
+    throw "No Valid Data loaded";
+
+  std::vector<EdgePoint> points;
+  {
+    ReleaseGIL released;
+    points = traceEdges(this->plane, (int)this->width, (int)this->height,
+                        step, threshold);
+  }
+  cv::Mat traced = Mat::zeros((int)points.size(), 3, CV_64F);
+  for (int i = 0; i < traced.rows; i++) {
+    traced.at<double>(i, 0) = points[i].pt.x;
+    traced.at<double>(i, 1) = points[i].pt.y;
+    traced.at<double>(i, 2) = points[i].parent;
+  }
+  return traced;
+}
+
+double ImageQuasisampler::getMagnitude() const { return this->mag; }
+
+void ImageQuasisampler::setMagnitude(double mag) { this->mag = mag; }
+
 } // namespace BN_Sample
\ No newline at end of file
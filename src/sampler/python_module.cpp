@@ -30,6 +30,10 @@ void translate(ChannelException const &e) {
   PyErr_SetString(PyExc_RuntimeError, e.what());
 }
 
+void translateFormat(FormatException const &e) {
+  PyErr_SetString(PyExc_TypeError, e.what());
+}
+
 PyObject *dot(PyObject *left, PyObject *right) {
 
   cv::Mat leftMat, rightMat;
@@ -119,11 +123,27 @@ BOOST_PYTHON_MODULE(BN_Sample) {
   matFromNDArrayBoostConverter();
 
   register_exception_translator<ChannelException>(translate);
+  register_exception_translator<FormatException>(translateFormat);
   // expose module-level functions
   class_<ImageQuasisampler>("ImageQuasisampler", init<>())
       .def(init<PyObject *, double>())
       .def("loadImg", &ImageQuasisampler::loadImg)
       .def("getSampledPoints", &ImageQuasisampler::getSampledPoints)
+      .def("setWindow", &ImageQuasisampler::setWindow)
+      .def("clearWindow", &ImageQuasisampler::clearWindow)
+      .def("setNumThreads", &ImageQuasisampler::setNumThreads)
+      .def("sample", &ImageQuasisampler::sample,
+           (arg("n_points"), arg("tolerance") = 0.05, arg("max_iter") = 8))
+      .def("getSampledRanks", &ImageQuasisampler::getSampledRanks)
+      .def("getDitheredPoints", &ImageQuasisampler::getDitheredPoints,
+           (arg("scale"), arg("kernel") = "floyd-steinberg",
+            arg("serpentine") = true))
+      .def("getEdgeTrace", &ImageQuasisampler::getEdgeTrace,
+           (arg("step") = 8, arg("threshold") = 0.2))
+      .def("getMagnitude", &ImageQuasisampler::getMagnitude)
+      .def("setMagnitude", &ImageQuasisampler::setMagnitude)
+      .def("setPyramidBase", &ImageQuasisampler::setPyramidBase)
+      .def("release", &ImageQuasisampler::release)
       .def("debugTool", &ImageQuasisampler::debugTool);
   //         def("dot", dot);
   //         def("dot2", dot2);
@@ -2,7 +2,9 @@
 #include <Python.h>
 #include <cstddef>
 #include <iostream>
+#include <atomic>
 #include <math.h>
+#include <thread>
 #include <vector>
 
 /*
@@ -635,6 +637,7 @@ Point2D Quasisampler::TileNode::getP3() const { return p3; }
 Point2D Quasisampler::TileNode::getCenter() const {
   return (p1 + p2 + p3) / 3.0;
 }
+double Quasisampler::TileNode::getScale() const { return scale; }
 unsigned Quasisampler::TileNode::getFCode() const { return f_code; }
 bool Quasisampler::TileNode::isSamplingType() const {
   return ((tileType == TileTypeA) || (tileType == TileTypeB));
@@ -645,6 +648,9 @@ Quasisampler::TileNode *Quasisampler::TileNode::getParent() { return parent; }
 Quasisampler::TileNode *Quasisampler::TileNode::getChild(unsigned i) {
   return children[i];
 }
+unsigned Quasisampler::TileNode::getNumChildren() const {
+  return children.size();
+}
 
 Point2D Quasisampler::TileNode::getDisplacedSamplingPoint(unsigned importance) {
   return p1 + calcDisplacementVector(importance, f_code, dir) * scale;
@@ -701,6 +707,9 @@ Quasisampler::Quasisampler(double width, double height) {
   this->width = width;
   this->height = height;
   root = NULL;
+  numThreads = 0;
+  minSubdivisionLevel = 6;
+  clearWindow();
 }
 
 unsigned Quasisampler::getImportanceAt_bounded(Point2D pt) {
@@ -710,6 +719,43 @@ unsigned Quasisampler::getImportanceAt_bounded(Point2D pt) {
     return 0;
 }
 
+unsigned Quasisampler::getTileImportance(TileNode *tile) {
+  return MAX(MAX(getImportanceAt_bounded(tile->getP1()),
+                 getImportanceAt_bounded(tile->getP2())),
+             MAX(getImportanceAt_bounded(tile->getP3()),
+                 getImportanceAt_bounded(tile->getCenter())));
+}
+
+bool Quasisampler::reachesWindow(TileNode *tile) const {
+  if (!windowed)
+    return true;
+
+  // Descendants stay inside the tile, and sampling points are displaced
+  // from their reference point by less than two tile scales.
+  Point2D p1 = tile->getP1(), p2 = tile->getP2(), p3 = tile->getP3();
+  double pad = 2.0 * tile->getScale();
+  double x0 = MIN(p1.x, MIN(p2.x, p3.x)) - pad;
+  double x1 = MAX(p1.x, MAX(p2.x, p3.x)) + pad;
+  double y0 = MIN(p1.y, MIN(p2.y, p3.y)) - pad;
+  double y1 = MAX(p1.y, MAX(p2.y, p3.y)) + pad;
+  return x1 >= win_x0 && x0 < win_x1 && y1 >= win_y0 && y0 < win_y1;
+}
+
+void Quasisampler::setWindow(double x0, double y0, double x1, double y1) {
+  windowed = true;
+  win_x0 = x0;
+  win_y0 = y0;
+  win_x1 = x1;
+  win_y1 = y1;
+}
+
+void Quasisampler::clearWindow() {
+  windowed = false;
+  win_x0 = win_y0 = win_x1 = win_y1 = 0.0;
+}
+
+void Quasisampler::setNumThreads(unsigned threads) { numThreads = threads; }
+
 void Quasisampler::subdivideAll(int times) {
   if (!root)
     return;
@@ -724,79 +770,167 @@ void Quasisampler::subdivideAll(int times) {
   }
 }
 
-void Quasisampler::buildAdaptiveSubdivision(unsigned minSubdivisionLevel) {
-  root = new TileNode(width, height);
+namespace {
+
+/// The number of threads to use for a requested count; 0 is every hardware thread.
+unsigned resolveThreads(unsigned threads) {
+  if (threads == 0)
+    threads = std::thread::hardware_concurrency();
+  return threads ? threads : 1;
+}
+
+/// Runs task(0) ... task(n - 1) on up to the given number of threads, the
+/// calling one included.
+template <typename Task> void runParallel(size_t n, unsigned threads, Task task) {
+  std::atomic<size_t> next(0);
+  auto worker = [&]() {
+    for (size_t i = next++; i < n; i = next++)
+      task(i);
+  };
+  std::vector<std::thread> pool;
+  for (unsigned t = 1; t < threads && t < n; t++)
+    pool.push_back(std::thread(worker));
+  worker();
+  for (size_t t = 0; t < pool.size(); t++)
+    pool[t].join();
+}
 
-  // Since we are approximating the MAX within each tile by the values at
-  // a few key points, we must provide a sufficiently dense initial
-  // tiling. This would not be necessary with a more thorough scan of each
-  // tile.
-  subdivideAll(minSubdivisionLevel);
+// Subtrees handed out per thread, so that uneven subtrees even out
+const size_t SUBTREES_PER_THREAD = 16;
 
-  TileLeafIterator it(root);
-  TileNode *tmp;
+} // namespace
 
-  // Recursively subdivide all triangles until each triangle's
-  // required level is reached.
-  unsigned level;
-  do {
-    level = it->getLevel();
-
-    if (it->isSamplingType()) // Sampling tiles are infinitesimal
-    {
-      if (level <
-          getReqSubdivisionLevel(getImportanceAt_bounded(it->getP1()))) {
-        tmp = *it;
-        tmp->refine();
-      }
-    } else {
-      if ((level <
-           getReqSubdivisionLevel(getImportanceAt_bounded(it->getP1()))) ||
-          (level <
-           getReqSubdivisionLevel(getImportanceAt_bounded(it->getP2()))) ||
-          (level <
-           getReqSubdivisionLevel(getImportanceAt_bounded(it->getP3()))) ||
-          (level <
-           getReqSubdivisionLevel(getImportanceAt_bounded(it->getCenter())))) {
-        tmp = *it;
-        tmp->refine();
+bool Quasisampler::needsRefinement(TileNode *tile) {
+  if (!reachesWindow(tile)) // Nothing to refine outside of the window
+    return false;
+
+  // Sampling tiles are infinitesimal
+  unsigned importance = tile->isSamplingType()
+                            ? getImportanceAt_bounded(tile->getP1())
+                            : getTileImportance(tile);
+  return tile->getLevel() < getReqSubdivisionLevel(importance);
+}
+
+bool Quasisampler::adaptTile(TileNode *tile) {
+  // The uniform initial tiling is kept as it is
+  if (tile->getLevel() >= minSubdivisionLevel) {
+    bool needed = needsRefinement(tile);
+    if (needed && tile->isTerminal())
+      tile->refine();
+    else if (!needed && !tile->isTerminal())
+      tile->collapse();
+  }
+  return !tile->isTerminal();
+}
+
+void Quasisampler::adaptSubtree(TileNode *tile) {
+  if (!adaptTile(tile))
+    return;
+  for (unsigned i = 0; i < tile->getNumChildren(); i++)
+    adaptSubtree(tile->getChild(i));
+}
+
+std::vector<Quasisampler::TileNode *>
+Quasisampler::splitSubtrees(size_t count, bool adapt) {
+  std::vector<TileNode *> subtrees(1, root), split;
+  bool grew = true;
+  while (grew && subtrees.size() < count) {
+    grew = false;
+    split.clear();
+    for (size_t i = 0; i < subtrees.size(); i++) {
+      TileNode *tile = subtrees[i];
+      if (adapt ? !adaptTile(tile) : tile->isTerminal()) {
+        split.push_back(tile);
+        continue;
       }
+      for (unsigned j = 0; j < tile->getNumChildren(); j++)
+        split.push_back(tile->getChild(j));
+      grew = true;
     }
-  } while (it.next());
+    subtrees.swap(split);
+  }
+  return subtrees;
+}
+
+void Quasisampler::buildAdaptiveSubdivision() {
+  if (!root) {
+    root = new TileNode(width, height);
+
+    // The importance of a tile is only estimated by getTileImportance(), which
+    // may miss features between its sampled points. A sufficiently dense
+    // initial tiling compensates for that.
+    subdivideAll(minSubdivisionLevel);
+  }
+
+  // Recursively subdivide all triangles until each triangle's
+  // required level is reached. Every tile is refined independently of the
+  // others, so the subtrees can be refined on any thread into the same tree.
+  unsigned threads = resolveThreads(numThreads);
+  std::vector<TileNode *> subtrees =
+      splitSubtrees(threads > 1 ? SUBTREES_PER_THREAD * threads : 1, true);
+  runParallel(subtrees.size(), threads,
+              [&](size_t i) { adaptSubtree(subtrees[i]); });
+}
+
+void Quasisampler::collectSubtree(TileNode *tile,
+                                  std::vector<Point2D> &pointlist,
+                                  std::vector<double> &ranks,
+                                  bool filterBounds) {
+  if (!tile->isTerminal()) {
+    for (unsigned i = 0; i < tile->getNumChildren(); i++)
+      collectSubtree(tile->getChild(i), pointlist, ranks, filterBounds);
+    return;
+  }
+  if (!tile->isSamplingType()) // Only "pentagonal" tiles generate sampling
+                               // points.
+    return;
+
+  Point2D pt = tile->getP1();
+  unsigned importance = getImportanceAt_bounded(pt);
+
+  // Threshold the function against the F-Code value.
+  unsigned threshold = calcFCodeValue(tile->getFCode(), 2 * tile->getLevel());
+  if (importance >= threshold) {
+    // Get the displaced point using the lookup table.
+    Point2D pt_displaced = tile->getDisplacedSamplingPoint(importance);
+
+    bool inWindow =
+        !windowed || (pt_displaced.x >= win_x0 && pt_displaced.x < win_x1 &&
+                      pt_displaced.y >= win_y0 && pt_displaced.y < win_y1);
+    if (inWindow &&
+        (!filterBounds || (pt_displaced.x >= 0 && pt_displaced.x < width &&
+                           pt_displaced.y >= 0 && pt_displaced.y < height))) {
+      pointlist.push_back(pt_displaced); // collect point.
+      ranks.push_back(importance ? (double)threshold / importance : 0.0);
+    }
+  }
 }
 
 void Quasisampler::collectPoints(std::vector<Point2D> &pointlist,
                                  bool filterBounds) {
   pointlist.clear();
 
-  Point2D pt, pt_displaced;
-  unsigned importance;
-  TileLeafIterator it(root);
-  do {
-    pt = it->getP1();
-    if (it->isSamplingType()) // Only "pentagonal" tiles generate sampling
-                              // points.
-    {
-      importance = getImportanceAt_bounded(pt);
-
-      // Threshold the function against the F-Code value.
-      if (importance >= calcFCodeValue(it->getFCode(), 2 * it->getLevel())) {
-        // Get the displaced point using the lookup table.
-        pt_displaced = it->getDisplacedSamplingPoint(importance);
-
-        if (!filterBounds || (pt_displaced.x >= 0 && pt_displaced.x < width &&
-                              pt_displaced.y >= 0 && pt_displaced.y < height)) {
-          pointlist.push_back(pt_displaced); // collect point.
-        }
-      }
-    }
-
-  } while (it.next());
+  // Collected per subtree and concatenated in depth-first order, so the
+  // order of the points does not depend on the number of threads
+  unsigned threads = resolveThreads(numThreads);
+  std::vector<TileNode *> subtrees =
+      splitSubtrees(threads > 1 ? SUBTREES_PER_THREAD * threads : 1, false);
+  std::vector<std::vector<Point2D> > parts(subtrees.size());
+  std::vector<std::vector<double> > partRanks(subtrees.size());
+  runParallel(subtrees.size(), threads, [&](size_t i) {
+    collectSubtree(subtrees[i], parts[i], partRanks[i], filterBounds);
+  });
+  pointRanks.clear();
+  for (size_t i = 0; i < parts.size(); i++) {
+    pointlist.insert(pointlist.end(), parts[i].begin(), parts[i].end());
+    pointRanks.insert(pointRanks.end(), partRanks[i].begin(), partRanks[i].end());
+  }
 }
 
 std::vector<Point2D> Quasisampler::getSamplingPoints() {
   if (root)
     delete root;
+  root = NULL;
   std::vector<Point2D> pointlist;
 
   buildAdaptiveSubdivision();
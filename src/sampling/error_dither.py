@@ -1,7 +1,9 @@
-from typing import List, Tuple
+from typing import Optional
+
 import numpy as np
 import cv2
 
+import sampler.BN_Sample as Sampler
 from util.settings import Settings
 
 
@@ -10,7 +12,12 @@ class ErrorDither:
     Returns a set of points generated from error dithering, which is the second
     step in blue-noise sampling (performing the "sampling" step).
 
-    Performs Floyd-Steinberg dithering, which is a form of error diffusion.
+    Performs error diffusion (Floyd-Steinberg, Jarvis-Judice-Ninke or Stucki)
+    of the importance map in the BN_Sample extension: the importance, scaled to
+    a point density per pixel, is thresholded pixel by pixel and the error is
+    diffused onto the unvisited neighbors, optionally scanning every other row
+    backwards (serpentine). A fast alternative to the Penrose tiling of the
+    Quasisampler, with a more regular but less isotropic spacing.
 
     The resulting shape is of the form Nx2, where N is the number of sampled points.
 
@@ -19,67 +26,47 @@ class ErrorDither:
     - https://www.youtube.com/watch?v=0L2n8Tg2FwI&t=0s&list=WL&index=151
     """
 
-    def _threshold_pixel(self, pixel: int) -> int:
-        """Threshold a pixel value to be in the range [0, 255]."""
-        if pixel > 255:
-            pixel = 255
-        elif pixel < 0:
-            pixel = 0
-        return pixel
-
-    def _dither(self, settings: Settings, img: np.ndarray) -> np.ndarray:
-        # Get the image dimensions
-        h = img.shape[0]
-        w = img.shape[1]
+    KERNELS = ("floyd-steinberg", "jarvis", "stucki")
 
-        # Loop over the image
-        for y in range(0, h - 1):
-            for x in range(1, w - 1):
-                for channel in range(3):
-                    # Update the current pixel
-                    old_pixel = img[y, x, channel]
-                    new_pixel = np.round(
-                        settings.sampling_f * old_pixel / 255.0) * (255 / settings.sampling_f)
-                    img[y, x, channel] = new_pixel
-                    quant_error = old_pixel - new_pixel
-
-                    # Perform error diffusion
-                    img[y, x + 1, channel] = self._threshold_pixel(
-                        img[y, x + 1, channel] + quant_error * 7 / 16.0)
-                    img[y + 1, x - 1, channel] = self._threshold_pixel(
-                        img[y + 1, x - 1, channel] + quant_error * 3 / 16.0)
-                    img[y + 1, x, channel] = self._threshold_pixel(
-                        img[y + 1, x, channel] + quant_error * 5 / 16.0)
-                    img[y + 1, x + 1, channel] = self._threshold_pixel(
-                        img[y + 1, x + 1, channel] + quant_error * 1 / 16.0)
-
-        return img
-
-    def _threshold_sample(self, img: np.ndarray) -> List[Tuple[int, int]]:
-        # Refactor to use argwhere
-        # Why????
-        sampled_point = (np.sum(img, axis=2) < 127) * 255
-
-        h, w = sampled_point.shape
-        points = []
-        for i in range(h):
-            for j in range(w):
-                if sampled_point[i][j] != 255:
-                    points.append((j, i))
-
-        return points
-
-    def run(self, settings: Settings, img: np.ndarray) -> List[Tuple[int, int]]:
+    def __init__(self, kernel: str = "floyd-steinberg", serpentine: bool = True):
+        """
+        Keyword arguments:
+            kernel -- the error-diffusion kernel, one of KERNELS
+            serpentine -- scan every other row from right to left
         """
-        Driver for the dithering process.
+        if kernel not in self.KERNELS:
+            raise ValueError(f"Unknown error-diffusion kernel '{kernel}', expected one of {self.KERNELS}")
+        self.kernel = kernel
+        self.serpentine = serpentine
+        self.sampler = Sampler.ImageQuasisampler()
+
+    @staticmethod
+    def scale_for(img: np.ndarray, n_points: int) -> float:
+        """The scale that gives about n_points points: the dithered count follows the summed density."""
+        total = float(np.sum(img, dtype=np.float64))
+        return n_points / total if total > 0 else 0.0
+
+    @staticmethod
+    def threshold_sample(img: np.ndarray) -> np.ndarray:
+        """The Nx2 (x, y) pixel centers of the pixels turned on in a dithered image."""
+        on = img.reshape(img.shape[0], img.shape[1], -1).any(axis=2)
+        y, x = np.nonzero(on)
+        return np.column_stack((x, y)).astype(np.float64) + 0.5
+
+    def run(self, settings: Settings, img: np.ndarray, scale: Optional[float] = None) -> np.ndarray:
         """
-        # dithering is not working correctly
-        # img = self._dither(settings, img)
-        sampled_points = self._threshold_sample(img)
+        Driver for the dithering process. Return the Nx2 array of sampled points.
 
-        return sampled_points
+        Keyword arguments:
+            img -- the importance map; its channels are summed
+            scale -- the points per unit of importance (default: settings.sampling_f / 255)
+        """
+        if scale is None:
+            scale = settings.sampling_f / 255
+        self.sampler.loadImg(img, 1.0)
+        return np.asarray(self.sampler.getDitheredPoints(scale, self.kernel, self.serpentine))
 
-    def run_and_export(self, settings: Settings, img: np.ndarray) -> List[Tuple[int, int]]:
+    def run_and_export(self, settings: Settings, img: np.ndarray) -> np.ndarray:
         """
         Same as run(), but exports the sampled points to an image.
         """
@@ -88,9 +75,9 @@ class ErrorDither:
         # Plot sampled points
         h = img.shape[0]
         w = img.shape[1]
-        img = np.zeros((h, w, 3), np.uint8)
-        for (j, i) in sampled:
-            img[i][j] = 255
-        cv2.imwrite(settings.output, img)
+        out = np.zeros((h, w, 3), np.uint8)
+        pixels = sampled.astype(np.intp)
+        out[pixels[:, 1], pixels[:, 0]] = 255
+        cv2.imwrite(settings.output, out)
 
         return sampled
@@ -1,3 +1,5 @@
+from typing import Optional
+
 import numpy as np
 import cv2
 
@@ -7,11 +9,24 @@ from util.settings import Settings
 class ImportanceMap:
     """
     First step of blue-noise sampling, based on Zhao et al.
+
+    The filter responses are computed in int16 (uint8 input) or float32 and
+    folded into a single running max of their absolute values, in buffers that
+    are kept between calls. For uint8 input the gradient takes at most 1021
+    integer values, so the normalization and power are a table lookup.
     """
 
-    def __init__(self):
+    # Number of pixels looked up in the table at a time
+    CHUNK = 1 << 16
+
+    def __init__(self, luma: bool = False):
         """
         Set up "improved" Sobel filters for blue-noise sampling.
+
+        Keyword arguments:
+            luma -- compute the map on the luma of color images, a third of the work;
+                    the single-channel result is scaled by the number of color channels
+                    so it samples about as many points as the color map
         """
         k1 = np.array([
             [-1, -2, -1],
@@ -29,38 +44,102 @@ class ImportanceMap:
             [0, 1, 2],
             [-1, 0, 1],
             [-2, -1, 0]])
-        self.filters = [k1, k2, k3, k4]
+        self.filters = [k.astype(np.float32) for k in (k1, k2, k3, k4)]
+        self.luma = luma
+        self._buffers = {}
 
-    def _get_importance(self, x: np.ndarray, gamma: float) -> np.ndarray:
+    def _buffer(self, name: str, shape: tuple, dtype) -> np.ndarray:
+        """A scratch array kept between calls, reallocated only when the shape or type changes."""
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = self._buffers[name] = np.empty(shape, dtype=dtype)
+        return buf
+
+    def _prepare(self, img: np.ndarray) -> np.ndarray:
+        if self.luma and img.ndim == 3 and img.shape[2] >= 3:
+            return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY if img.shape[2] == 3 else cv2.COLOR_BGRA2GRAY)
+        if img.dtype != np.uint8 and img.dtype != np.float32:
+            return img.astype(np.float32)
+        return img
+
+    def _gradient(self, img: np.ndarray, out: np.ndarray) -> np.ndarray:
+        """Write the pixel-wise max of the absolute filter responses into out."""
+        depth = cv2.CV_16S if img.dtype == np.uint8 else cv2.CV_32F
+        response = self._buffer("response", out.shape, out.dtype)
+        for i, k in enumerate(self.filters):
+            target = out if i == 0 else response
+            cv2.filter2D(img, depth, k, dst=target)
+            np.abs(target, out=target)
+            if i:
+                np.maximum(out, response, out=out)
+        return out
+
+    def gradient(self, img: np.ndarray) -> np.ndarray:
         """
-        Perform importance map pixel-wise over the image.
+        Pixel-wise max of the absolute filter responses, before normalization.
+
+        int16 for uint8 images, float32 otherwise.
         """
-        pix_max = np.amax(x)
-        power = 1 / gamma
-        importance = (x / pix_max) ** power
-        return importance * 255
+        img = self._prepare(img)
+        out = np.empty(img.shape, dtype=np.int16 if img.dtype == np.uint8 else np.float32)
+        return self._gradient(img, out)
 
-    def run(self, settings: Settings, img: np.ndarray, gamma: float = 0.1) -> np.ndarray:
+    def _get_importance(self, x: np.ndarray, gamma: float, pix_max: Optional[float] = None,
+                        scale: float = 255, out: Optional[np.ndarray] = None) -> np.ndarray:
         """
-        Blue-noise sampling driver.
+        Perform importance map pixel-wise over the image.
         """
+        if pix_max is None:
+            pix_max = np.amax(x)
+        if out is None:
+            out = np.empty(x.shape, dtype=np.float32)
+        if pix_max <= 0:
+            out[...] = 0
+            return out
 
-        # Apply each filter to the image
-        filtered_images = [
-            np.absolute(cv2.filter2D(img, -1, k)) 
-            for k in self.filters
-        ]
+        power = 1 / gamma
+        if x.dtype == np.int16:
+            # Integer gradients: one power per possible value
+            levels = np.arange(int(np.amax(x)) + 1, dtype=np.float64)
+            lut = (np.minimum(levels / pix_max, 1.0) ** power * scale).astype(np.float32)
+            # take() is much faster on native-size indices than on int16;
+            # convert them a cache-sized chunk at a time
+            flat_x = x.reshape(-1)
+            flat_out = out.reshape(-1)
+            index = self._buffer("index", (min(self.CHUNK, flat_x.size),), np.intp)
+            for start in range(0, flat_x.size, self.CHUNK):
+                n = min(self.CHUNK, flat_x.size - start)
+                np.copyto(index[:n], flat_x[start:start + n])
+                np.take(lut, index[:n], out=flat_out[start:start + n], mode="clip")
+        else:
+            np.divide(x, pix_max, out=out)
+            np.power(out, power, out=out)
+            out *= scale
+        return out
 
-        # Get the pixel-wise max value
-        image_max = np.maximum.reduce(filtered_images)
+    def run(self, settings: Settings, img: np.ndarray, gamma: float = 0.1,
+            pix_max: Optional[float] = None, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Blue-noise sampling driver. Return the float32 importance map.
+
+        Keyword arguments:
+            pix_max -- the gradient value mapped to full importance; defaults to the
+                       max over img, pass the max over the whole image when img is a tile
+            out -- a contiguous float32 array of the map's shape to write the result into
+        """
+        channels = img.shape[2] if img.ndim == 3 else 1
+        img = self._prepare(img)
+        gradient = self._gradient(img, self._buffer(
+            "gradient", img.shape, np.int16 if img.dtype == np.uint8 else np.float32))
 
         # Return importance map
-        return self._get_importance(image_max, gamma)
+        scale = 255 * channels if self.luma else 255
+        return self._get_importance(gradient, gamma, pix_max, scale, out)
 
     def run_and_export(self, settings: Settings, img: np.ndarray, gamma: float = 0.1) -> np.ndarray:
         """
         Same as run(), but also saves result to file.
         """
-        importance_map = self.run(settings, img)
+        importance_map = self.run(settings, img, gamma)
         cv2.imwrite(settings.output, importance_map)
         return importance_map
@@ -0,0 +1,93 @@
+from typing import List, Optional
+
+import numpy as np
+
+from mesh.delaunay import Delaunay
+from sampling.triangle_color import TriangleColor
+from util.geometry_types import Mesh
+
+
+class LevelOfDetail:
+    """
+    Nested levels of detail of a mesh, from the ranks of its blue-noise points.
+
+    The sampler ranks every point by the F-code threshold of its tile over its
+    importance: the points ranked at most t are about the points a sampling at
+    t times the magnitude gives. Every level keeps the boundary vertices of the
+    finest mesh and the best ranked of its other vertices, so each coarser
+    level is a subset of the finer ones and all of them cover the same area.
+    """
+
+    def __init__(self):
+        self.delaunay = Delaunay()
+        self.triangle_color = TriangleColor()
+
+    @staticmethod
+    def vertex_ranks(vertices: np.ndarray, points: np.ndarray, ranks: np.ndarray) -> np.ndarray:
+        """Look up the rank of every vertex among the sampled points by its exact float32 coordinates.
+
+        Keyword arguments:
+            vertices -- the Vx2 vertices of the mesh, a subset of the points
+            points -- the Nx2 sampled points
+            ranks -- the N ranks of the points; a point sampled twice keeps its lowest rank
+        """
+        keys = Delaunay._keys(np.asarray(points, dtype=np.float32).reshape(-1, 2))
+        order = np.lexsort((ranks, keys))
+        keys = keys[order]
+        vertex_keys = Delaunay._keys(vertices)
+        pos = np.minimum(np.searchsorted(keys, vertex_keys), len(keys) - 1)
+        found = keys[pos] == vertex_keys
+        # Vertices that are not sampled points come first in every level
+        return np.where(found, np.asarray(ranks, dtype=np.float64)[order[pos]], 0.0)
+
+    def levels(self, mesh: Mesh, vertex_ranks: np.ndarray, n_levels: int, factor: float = 4) -> List[np.ndarray]:
+        """Return the vertex indices of every level, coarsest first; the last level is every vertex.
+
+        Keyword arguments:
+            mesh -- the finest mesh
+            vertex_ranks -- the rank of every vertex of the mesh
+            n_levels -- the number of levels
+            factor -- the ratio of the number of interior vertices between consecutive levels
+        """
+        boundary = np.zeros(len(mesh.vertices), dtype=bool)
+        e = np.sort(np.concatenate((mesh.faces[:, [0, 1]], mesh.faces[:, [1, 2]], mesh.faces[:, [2, 0]])), axis=1)
+        edges, counts = np.unique(e, axis=0, return_counts=True)
+        boundary[edges[counts == 1].ravel()] = True
+
+        interior = np.flatnonzero(~boundary)
+        interior = interior[np.argsort(vertex_ranks[interior], kind="stable")]
+        outline = np.flatnonzero(boundary)
+        levels = []
+        for level in range(n_levels):
+            n = int(np.ceil(len(interior) / factor ** (n_levels - 1 - level)))
+            levels.append(np.sort(np.concatenate((outline, interior[:n]))))
+        return levels
+
+    def run(self, img: np.ndarray, mesh: Mesh, points: np.ndarray, ranks: np.ndarray,
+            n_levels: int = 4, factor: float = 4, color_mode: str = "mean",
+            rows: Optional[int] = None) -> List[Mesh]:
+        """Return the colored meshes of every level, coarsest first; the last one is mesh itself.
+
+        Keyword arguments:
+            img -- the image the triangles are colored from
+            mesh -- the finest, colored mesh; its vertices must be a subset of points
+            points -- the Nx2 sampled points
+            ranks -- the N ranks of the points, as returned by the sampler
+            n_levels -- the number of levels
+            factor -- the ratio of the number of interior vertices between consecutive levels
+            color_mode -- the statistic used to color each triangle from its pixels
+            rows -- color reading img this many rows at a time (see TriangleColor.run_strips)
+        """
+        h, w = img.shape[:2]
+        vertex_ranks = self.vertex_ranks(mesh.vertices, points, ranks)
+        meshes = []
+        for index in self.levels(mesh, vertex_ranks, n_levels, factor)[:-1]:
+            vertices, faces = self.delaunay.run(w, h, mesh.vertices[index])
+            coarse = Mesh(vertices, faces)
+            if rows:
+                colors = self.triangle_color.run_strips(img, coarse.triangles, color_mode, rows)
+            else:
+                colors = self.triangle_color.run(img, coarse.triangles, color_mode)
+            meshes.append(coarse.with_colors(colors))
+        meshes.append(mesh)
+        return meshes
@@ -1,5 +1,7 @@
 from typing import Tuple
 
+import os
+import sys
 import time
 import argparse
 import cv2
@@ -7,44 +9,15 @@ import cv2
 import numpy as np
 import matplotlib.pyplot as plt
 
+if __name__ == '__main__':
+    # Run as a script (python src/sampling/sample.py): make the src/ packages importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sampling.importance_map import ImportanceMap
+
 
 class Sampler:
     def __init__(self):
-        # 'Improved' Sobel filters
-        k1 = np.array([
-            [-1, -2, -1],
-            [0, 0, 0],
-            [1, 2, 1]])
-        k2 = np.array([
-            [-1, 0, 1],
-            [-2, 0, 2],
-            [-1, 0, 1]])
-        k3 = np.array([
-            [2, 1, 0],
-            [1, 0, -1],
-            [0, -1, -2]])
-        k4 = np.array([
-            [0, 1, 2],
-            [-1, 0, 1],
-            [-2, -1, 0]])
-
-        self.filters = [k1, k2, k3, k4]
-
-    @staticmethod
-    def _get_importance(x: np.ndarray, gamma: float) -> np.ndarray:
-        pix_max = np.amax(x)
-        power = 1 / gamma
-        importance = (x / pix_max) ** power
-        return importance * 255
-
-    @staticmethod
-    def _threshold_pixel(pixel: int) -> int:
-        """Threshold a pixel value to be in the range [0, 255]."""
-        if pixel > 255:
-            pixel = 255
-        elif pixel < 0:
-            pixel = 0
-        return pixel
+        self.importance_map = ImportanceMap()
 
     @staticmethod
     def _rect_contains(rect: Tuple[int, int, int, int], point: Tuple[int, int]) -> bool:
@@ -55,40 +28,6 @@ class Sampler:
             return False
         return True
 
-    def _dither_image(self, image: np.ndarray, sampling_f: float) -> np.ndarray:
-        """Perform Floyd-Steinberg dithering.
-        Based on:
-        https://en.wikipedia.org/wiki/Floyd–Steinberg_dithering
-        https://www.youtube.com/watch?v=0L2n8Tg2FwI&t=0s&list=WL&index=151
-
-        Keyword arguments:
-            image -- a matrix representing an RGB single image
-            sampling_f --
-        """
-        # Get the image dimensions
-        h = image.shape[0]
-        w = image.shape[1]
-
-        # Loop over the image
-        for y in range(0, h - 1):
-            for x in range(1, w - 1):
-                for channel in range(3):
-                    # Update the current pixel
-                    old_pixel = image[y, x, channel]
-                    new_pixel = np.round(sampling_f * old_pixel / 255.0) * (255 / sampling_f)
-                    image[y, x, channel] = new_pixel
-                    quant_error = old_pixel - new_pixel
-
-                    # Perform error diffusion
-                    image[y, x + 1, channel] = self._threshold_pixel(image[y, x + 1, channel] + quant_error * 7 / 16.0)
-                    image[y + 1, x - 1, channel] = self._threshold_pixel(
-                        image[y + 1, x - 1, channel] + quant_error * 3 / 16.0)
-                    image[y + 1, x, channel] = self._threshold_pixel(image[y + 1, x, channel] + quant_error * 5 / 16.0)
-                    image[y + 1, x + 1, channel] = self._threshold_pixel(
-                        image[y + 1, x + 1, channel] + quant_error * 1 / 16.0)
-
-        return image
-
     def _draw_delaunay(self, image: np.ndarray, subdiv: cv2.Subdiv2D, color: Tuple[int, int, int]) -> None:
         """Draw delaunay triangles using the provided image.
 
@@ -118,11 +57,8 @@ class Sampler:
         sampled_point = (np.sum(dithered_image, axis=2) < 127) * 255
 
         h, w = sampled_point.shape
-        points = []
-        for i in range(h):
-            for j in range(w):
-                if sampled_point[i][j] != 255:
-                    points.append((j, i))
+        y, x = np.nonzero(sampled_point != 255)
+        points = np.column_stack((x, y)).astype(np.float32)
         print(len(points))
         print(sampled_point.shape)
         print(h, w)
@@ -130,8 +66,8 @@ class Sampler:
         rect = (0, 0, w, h)
         subdiv = cv2.Subdiv2D(rect)
 
-        for x in points:
-            subdiv.insert(x)
+        if len(points):
+            subdiv.insert(points)
 
         self._draw_delaunay(dithered_image, subdiv, (255, 255, 255))
 
@@ -140,16 +76,8 @@ class Sampler:
         plt.show()
 
     def sample_image(self, image: np.ndarray) -> np.ndarray:
-        # Apply each filter to the image
-        filtered_images = [np.absolute(cv2.filter2D(image, -1, k)) for k in self.filters]
-
-        # Get the pixel-wise max value
-        image_max = np.maximum.reduce(filtered_images)
-
-        imp = self._get_importance(image_max, 0.01)
-
-        return imp
-        # return self._dither_image(imp, 1)
+        """The importance map of the image; see ErrorDither for dithering it into points."""
+        return self.importance_map.run(None, image, 0.01)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,186 @@
+import numpy as np
+
+from util.rasterize import rasterize_triangles
+
+
+class TriangleColor:
+    """
+    Batched per-triangle color computation.
+
+    All triangles are rasterized into a triangle-ID label image in one pass and
+    the color statistic of every triangle is computed with array reductions
+    over that label image, instead of walking the pixels of each triangle.
+    """
+
+    MODES = ("mean", "median", "mode")
+
+    # Triangles covering this many pixels or fewer use the mean of their vertices colors
+    # E.g. (150, 38), (151, 37), (151, 38)
+    MIN_PIXELS = 3
+
+    def _vertices_color(self, img: np.ndarray, tris: np.ndarray) -> np.ndarray:
+        """Mean of three vertices colors."""
+        h, w = img.shape[:2]
+        x = np.clip(tris[:, :, 0].astype(int), 0, w - 1)
+        y = np.clip(tris[:, :, 1].astype(int), 0, h - 1)
+        return img[y, x].astype(np.float64).mean(axis=1)
+
+    def _mean(self, labels: np.ndarray, pixels: np.ndarray, counts: np.ndarray) -> np.ndarray:
+        n = len(counts)
+        sums = np.stack([
+            np.bincount(labels, weights=pixels[:, c], minlength=n)
+            for c in range(pixels.shape[1])], axis=1)
+        return sums / np.maximum(counts, 1)[:, None]
+
+    def _median(self, labels: np.ndarray, pixels: np.ndarray, counts: np.ndarray) -> np.ndarray:
+        n = len(counts)
+        starts = np.cumsum(counts) - counts
+        lo = starts + np.maximum(counts - 1, 0) // 2
+        hi = starts + counts // 2
+        # Empty triangles point at a valid index, their value is replaced by the fallback
+        lo = np.minimum(lo, len(labels) - 1)
+        hi = np.minimum(hi, len(labels) - 1)
+
+        median = np.zeros((n, pixels.shape[1]))
+        for c in range(pixels.shape[1]):
+            values = pixels[np.lexsort((pixels[:, c], labels)), c].astype(np.float64)
+            median[:, c] = (values[lo] + values[hi]) / 2
+        return median
+
+    def _mode(self, labels: np.ndarray, pixels: np.ndarray, counts: np.ndarray) -> np.ndarray:
+        n = len(counts)
+        mode = np.zeros((n, pixels.shape[1]))
+        for c in range(pixels.shape[1]):
+            order = np.lexsort((pixels[:, c], labels))
+            values = pixels[order, c]
+            sorted_labels = labels[order]
+
+            # Find the runs of equal (label, value) pairs
+            change = np.ones(len(values), dtype=bool)
+            change[1:] = (values[1:] != values[:-1]) | (sorted_labels[1:] != sorted_labels[:-1])
+            run_starts = np.flatnonzero(change)
+            run_lengths = np.diff(np.append(run_starts, len(values)))
+            run_labels = sorted_labels[run_starts]
+
+            # Longest run of each label; ties go to the smallest value
+            best = np.lexsort((-run_lengths, run_labels))
+            first = np.ones(len(best), dtype=bool)
+            first[1:] = run_labels[best][1:] != run_labels[best][:-1]
+            best = best[first]
+            mode[run_labels[best], c] = values[run_starts[best]]
+        return mode
+
+    def run(self, img: np.ndarray, triangles: np.ndarray, mode: str = "mean") -> np.ndarray:
+        """Compute the color of every triangle. Return an Mx3 uint8 array of RGB colors.
+
+        Keyword arguments:
+            img -- the BGR image the triangles are colored from
+            triangles -- an Mx3x2 (or Mx6) array of (x, y) vertex coordinates
+            mode -- the statistic over the pixels of each triangle, one of "mean", "median" or "mode"
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown color mode '{mode}', expected one of {self.MODES}")
+
+        tris = np.asarray(triangles, dtype=np.float64).reshape(-1, 3, 2)
+        n = len(tris)
+        if n == 0:
+            return np.zeros((0, 3), dtype=np.uint8)
+
+        h, w = img.shape[:2]
+        labels = rasterize_triangles(tris, (h, w)).ravel()
+        covered = labels >= 0
+        labels = labels[covered]
+        pixels = img.reshape(h * w, -1)[covered]
+        counts = np.bincount(labels, minlength=n)
+
+        if len(labels) == 0:
+            colors = np.zeros((n, pixels.shape[1]))
+        elif mode == "mean":
+            colors = self._mean(labels, pixels, counts)
+        elif mode == "median":
+            colors = self._median(labels, pixels, counts)
+        else:
+            colors = self._mode(labels, pixels, counts)
+
+        # Used in case of very small triangles
+        small = counts <= self.MIN_PIXELS
+        if np.any(small):
+            colors[small] = self._vertices_color(img, tris[small])
+
+        # We return the reversed color because cv2 uses BGR
+        return np.ascontiguousarray(np.clip(np.round(colors), 0, 255).astype(np.uint8)[:, ::-1])
+
+    def run_strips(self, img: np.ndarray, triangles: np.ndarray, mode: str = "mean",
+                   rows: int = 256, batch: int = 1 << 14) -> np.ndarray:
+        """Same as run(), reading img a strip of rows at a time, e.g. from a memory-mapped file.
+
+        The mean is accumulated over the strips. The median and mode come from
+        per-triangle histograms of every channel, built batch triangles at a time.
+        The colors are the same as those of run().
+
+        Keyword arguments:
+            rows -- the number of rows read at a time
+            batch -- the number of triangles a 256-bin histogram is kept for at a time
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown color mode '{mode}', expected one of {self.MODES}")
+
+        tris = np.asarray(triangles, dtype=np.float64).reshape(-1, 3, 2)
+        n = len(tris)
+        if n == 0:
+            return np.zeros((0, 3), dtype=np.uint8)
+
+        h, w = img.shape[:2]
+        channels = img.shape[2] if img.ndim == 3 else 1
+        top = tris[:, :, 1].min(axis=1)
+        bottom = tris[:, :, 1].max(axis=1)
+
+        def strip_labels(y0: int, y1: int, first: int, last: int):
+            """The labels (offset by first) and pixels of the pixels of rows y0:y1 owned by triangles first:last."""
+            # Every triangle of the strip is rasterized, so shared pixels go to the same triangle as in run()
+            index = np.flatnonzero((bottom >= y0) & (top < y1))
+            # Rasterized a quarter strip of candidate pixels at a time, to stay within the strip's budget
+            chunk = min(1 << 20, (y1 - y0) * w // 4 + 1)
+            labels = rasterize_triangles(tris[index] - (0, y0), (y1 - y0, w), chunk).ravel()
+            covered = labels >= 0
+            labels = index[labels[covered]]
+            owned = (labels >= first) & (labels < last)
+            pixels = np.ascontiguousarray(img[y0:y1]).reshape(-1, channels)[covered][owned]
+            return labels[owned] - first, pixels
+
+        counts = np.zeros(n, dtype=np.int64)
+        colors = np.zeros((n, channels))
+        if mode == "mean":
+            for y0 in range(0, h, rows):
+                labels, pixels = strip_labels(y0, min(y0 + rows, h), 0, n)
+                counts += np.bincount(labels, minlength=n)
+                for c in range(channels):
+                    colors[:, c] += np.bincount(labels, weights=pixels[:, c], minlength=n)
+            colors /= np.maximum(counts, 1)[:, None]
+        else:
+            for first in range(0, n, batch):
+                last = min(first + batch, n)
+                m = last - first
+                hist = np.zeros((channels, m * 256), dtype=np.int32)
+                for y0 in range(0, h, rows):
+                    labels, pixels = strip_labels(y0, min(y0 + rows, h), first, last)
+                    for c in range(channels):
+                        hist[c] += np.bincount(labels * 256 + pixels[:, c], minlength=m * 256)
+                hist = hist.reshape(channels, m, 256)
+                counts[first:last] = hist[0].sum(axis=1)
+                for c in range(channels):
+                    if mode == "mode":
+                        # The most frequent value; ties go to the smallest value
+                        colors[first:last, c] = np.argmax(hist[c], axis=1)
+                    else:
+                        # The mean of the two middle values, as a sort would give
+                        cumulative = np.cumsum(hist[c], axis=1)
+                        lo = (np.maximum(counts[first:last] - 1, 0) // 2)[:, None]
+                        hi = (counts[first:last] // 2)[:, None]
+                        colors[first:last, c] = ((cumulative <= lo).sum(axis=1)
+                                                 + (cumulative <= hi).sum(axis=1)) / 2
+
+        small = counts <= self.MIN_PIXELS
+        if np.any(small):
+            colors[small] = self._vertices_color(img, tris[small])
+        return np.ascontiguousarray(np.clip(np.round(colors), 0, 255).astype(np.uint8)[:, ::-1])
@@ -0,0 +1,426 @@
+"""
+Temporally coherent conversion of a sequence of frames, e.g. an animation or a
+screen recording, into one SVG file per frame.
+
+The mesh is built as TiledPipeline builds it: the frame is split into cells
+that own the faces of the global Delaunay triangulation of the blue-noise
+points whose centroid they contain (see TileStitcher), and every cell is
+decimated and colored on its own, with its seams kept. A frame then only
+redoes the work where it differs from the previous one:
+  1. the blocks of pixels that changed by more than settings.seq_tol are found;
+  2. the importance map is recomputed around the changed blocks only, normalized
+     by the gradient maximum of the first frame, so the other blocks keep theirs;
+  3. the blocks around them are sampled again with the Penrose tiling restricted
+     to them, and their points replace those of the previous frame; the tiling
+     is deterministic, so the unchanged areas keep their points;
+  4. the cells whose faces may depend on a point that changed are triangulated
+     again, and those whose faces did change are decimated again;
+  5. those cells, and the cells overlapping changed pixels, are recolored.
+So the cost of a frame follows the amount of change rather than the frame size,
+and the unchanged areas keep exactly the same triangles, which avoids flicker.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import sampler.BN_Sample as Sampler
+from mesh.decimation import Decimate
+from mesh.stitch import Rect, TileStitcher
+from pipeline import write_svg
+from sampling.importance_map import ImportanceMap
+from sampling.triangle_color import TriangleColor
+from util.bench import Bench
+from util.geometry_types import Mesh
+from util.settings import Settings
+
+
+class Cell:
+    """
+    The part of the mesh owned by one cell of the frame.
+
+    key -- the digest of the undecimated faces the cell owns
+    circles -- the Mx3 (x, y, radius) circumcircles of those faces
+    mesh -- the decimated, colored faces of the cell
+    """
+
+    def __init__(self, key: str, circles: np.ndarray, mesh: Mesh):
+        self.key = key
+        self.circles = circles
+        self.mesh = mesh
+
+
+def read_frames(path: str) -> Iterator[Tuple[str, np.ndarray]]:
+    """Yield the (name, BGR frame) of a directory or glob of images in name order, or of a video file."""
+    if os.path.isdir(path) or not os.path.isfile(path):
+        from batch import find_images
+
+        paths = find_images(path)
+        if not paths:
+            raise SystemExit(f"No images found for '{path}'")
+        for frame_path in paths:
+            frame = cv2.imread(frame_path)
+            if frame is None:
+                raise ValueError(f"Could not read image '{frame_path}'")
+            yield os.path.splitext(os.path.basename(frame_path))[0], frame
+        return
+
+    video = cv2.VideoCapture(path)
+    if not video.isOpened():
+        raise ValueError(f"Could not open video '{path}'")
+    try:
+        i = 0
+        while True:
+            ok, frame = video.read()
+            if not ok:
+                break
+            yield f"frame_{i:05d}", frame
+            i += 1
+    finally:
+        video.release()
+
+
+class SequencePipeline:
+    """
+    The conversion of a sequence of frames of the same size, with the mesh
+    carried over from frame to frame and updated where the frames differ.
+    """
+
+    def __init__(self, settings: Settings, gamma: float = 0.5, mag: float = 1000.0,
+                 shrink: float = 10, block: int = 16, cell: int = 256, margin: int = 64,
+                 verbose: bool = False):
+        """
+        Keyword arguments:
+            settings -- the parsed command line settings
+            gamma -- the importance map gamma
+            mag -- the blue-noise sampling density (the starting guess with settings.points)
+            shrink -- the face count reduction factor of the decimation
+            block -- the side in pixels of the blocks changes are tracked in
+            cell -- the side in pixels of the cells the mesh is built in
+            margin -- the initial overlap in pixels a cell is triangulated with, grown as needed
+            verbose -- print a line per frame
+        """
+        self.settings = settings
+        self.gamma = gamma
+        self.mag = mag
+        self.shrink = shrink
+        self.block = block
+        self.cell = cell
+        self.margin = margin
+        self.verbose = verbose
+
+        self.importance_map = ImportanceMap(settings.luma)
+        self.sampler = Sampler.ImageQuasisampler()
+        self.stitcher = TileStitcher()
+        self.decimate = Decimate()
+        self.triangle_color = TriangleColor()
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget the previous frame; the next frame is converted from scratch."""
+        self.frame: Optional[np.ndarray] = None
+        self.plane: Optional[np.ndarray] = None
+        self.points: Optional[np.ndarray] = None
+        self.pix_max = 0.0
+        self.cells: Dict[Rect, Cell] = {}
+
+    def _log(self, message: str) -> None:
+        if self.verbose:
+            print(message)
+
+    def _block_mask(self, changed: np.ndarray) -> np.ndarray:
+        """The blocks holding any changed pixel of a HxW bool mask."""
+        b = self.block
+        h, w = changed.shape
+        rows, cols = -(-h // b), -(-w // b)
+        padded = np.zeros((rows * b, cols * b), dtype=bool)
+        padded[:h, :w] = changed
+        return padded.reshape(rows, b, cols, b).any(axis=(1, 3))
+
+    def _rects(self, blocks: np.ndarray) -> List[Rect]:
+        """The pixel bounding boxes of the connected groups of blocks."""
+        h, w = self.frame.shape[:2]
+        n, _, stats, _ = cv2.connectedComponentsWithStats(blocks.view(np.uint8), connectivity=8)
+        b = self.block
+        return [(x * b, y * b, min((x + bw) * b, w), min((y + bh) * b, h))
+                for x, y, bw, bh, _ in stats[1:n]]
+
+    def _in_blocks(self, points: np.ndarray, blocks: np.ndarray) -> np.ndarray:
+        """Whether every point lies in one of the blocks."""
+        by = np.minimum((points[:, 1] // self.block).astype(np.intp), blocks.shape[0] - 1)
+        bx = np.minimum((points[:, 0] // self.block).astype(np.intp), blocks.shape[1] - 1)
+        return blocks[by, bx]
+
+    @staticmethod
+    def _grow(blocks: np.ndarray) -> np.ndarray:
+        """The blocks and their eight neighbors."""
+        return cv2.dilate(blocks.view(np.uint8), np.ones((3, 3), np.uint8)).view(bool)
+
+    def _update_importance(self, frame: np.ndarray, rects: List[Rect]) -> None:
+        """Recompute the importance plane inside the rectangles."""
+        h, w = frame.shape[:2]
+        for x0, y0, x1, y1 in rects:
+            # Grown by the filter radius, so the rectangle gets exactly the values of the whole frame
+            px0, py0, px1, py1 = max(x0 - 1, 0), max(y0 - 1, 0), min(x1 + 1, w), min(y1 + 1, h)
+            crop = np.ascontiguousarray(frame[py0:py1, px0:px1])
+            importance = self.importance_map.run(self.settings, crop, self.gamma, self.pix_max)
+            importance = importance[y0 - py0:y1 - py0, x0 - px0:x1 - px0].reshape(y1 - y0, x1 - x0, -1)
+            # Summed in double channel by channel, as the sampler reduces a multi-channel map
+            total = importance[:, :, 0].astype(np.float64)
+            for c in range(1, importance.shape[2]):
+                total += importance[:, :, c]
+            self.plane[y0:y1, x0:x1] = total
+
+    def _sample(self, rects: List[Rect]) -> np.ndarray:
+        """Blue-noise sample the importance plane inside the rectangles."""
+        self.sampler.loadImg(self.plane, self.mag)
+        points = []
+        for x0, y0, x1, y1 in rects:
+            self.sampler.setWindow(x0, y0, x1, y1)
+            points.append(np.asarray(self.sampler.getSampledPoints()).reshape(-1, 2))
+        self.sampler.clearWindow()
+        return np.concatenate(points) if points else np.zeros((0, 2))
+
+    @staticmethod
+    def _digest(tri: np.ndarray) -> str:
+        """The digest of a set of triangles, whatever the order of the faces and of their vertices."""
+        # (x, y) float32 pairs as complex64 sort by x, then y
+        corners = np.sort(np.ascontiguousarray(tri, dtype=np.float32).view(np.complex64).reshape(-1, 3), axis=1)
+        flat = corners.view(np.float32).reshape(-1, 6)
+        order = np.lexsort(flat.T[::-1])
+        return hashlib.sha1(np.ascontiguousarray(flat[order]).tobytes()).hexdigest()
+
+    def _color(self, frame: np.ndarray, mesh: Mesh) -> Mesh:
+        """Color the faces on the crop of the frame around them."""
+        if len(mesh) == 0:
+            return mesh
+        h, w = frame.shape[:2]
+        tri = mesh.triangles
+        lo = np.maximum(np.floor(tri.reshape(-1, 2).min(axis=0)).astype(int), 0)
+        hi = np.minimum(np.ceil(tri.reshape(-1, 2).max(axis=0)).astype(int) + 1, (w, h))
+        crop = np.ascontiguousarray(frame[lo[1]:hi[1], lo[0]:hi[0]])
+        return mesh.with_colors(self.triangle_color.run(crop, tri - lo.astype(np.float32), self.settings.color_mode))
+
+    def _build(self, frame: np.ndarray, vertices: np.ndarray, core: Rect) -> Optional[Cell]:
+        """Triangulate one cell, and decimate and color it unless its faces are those it already has.
+
+        Return the new cell, or None if it is unchanged.
+        """
+        h, w = frame.shape[:2]
+        faces = self.stitcher.tile_faces(vertices, core, w, h, self.margin)
+        tri = vertices[faces]
+        key = self._digest(tri)
+        old = self.cells.get(core)
+        if old is not None and old.key == key:
+            return None
+
+        center, radius = self.stitcher.circumcircles(tri)
+        circles = np.column_stack((center, radius))
+        if len(faces) == 0:
+            return Cell(key, circles, Mesh(np.zeros((0, 2)), np.zeros((0, 3))))
+
+        # Decimate the cell on its own vertices; the seams are its boundary and stay in place
+        used, local = np.unique(faces, return_inverse=True)
+        mesh = self.decimate.simplify(frame, Mesh(vertices[used], local.reshape(-1, 3)), self.shrink).compact()
+        return Cell(key, circles, self._color(frame, mesh))
+
+    def _affected(self, changed: np.ndarray, cores: List[Rect]) -> List[Rect]:
+        """The cells whose faces may depend on the changed points.
+
+        A point that appears or disappears only replaces the faces whose
+        circumcircle holds it, and the new faces cover the same area, so the
+        cells touching the bounding box of the replaced faces are affected.
+        The circles are tested against the blocks of the changed points, which
+        may mark a few more faces but never fewer.
+        Points near a cell affect it too, for faces reaching past the hull.
+        """
+        affected = set()
+        m = self.margin
+        for core in cores:
+            x0, y0, x1, y1 = core
+            close = (changed[:, 0] >= x0 - m) & (changed[:, 0] < x1 + m) \
+                & (changed[:, 1] >= y0 - m) & (changed[:, 1] < y1 + m)
+            if np.any(close):
+                affected.add(core)
+
+        # A circle can only hold a changed point if it overlaps a block holding one; the
+        # summed-area table of the blocks' point counts tests every circle in constant time
+        h, w = self.frame.shape[:2]
+        b = self.block
+        rows, cols = -(-h // b), -(-w // b)
+        counts = np.zeros((rows + 1, cols + 1), dtype=np.int64)
+        np.add.at(counts, (np.minimum(changed[:, 1] // b, rows - 1).astype(np.intp) + 1,
+                           np.minimum(changed[:, 0] // b, cols - 1).astype(np.intp) + 1), 1)
+        table = counts.cumsum(axis=0).cumsum(axis=1)
+        for core, cell in self.cells.items():
+            x, y, r = cell.circles[:, 0], cell.circles[:, 1], cell.circles[:, 2]
+            with np.errstate(invalid="ignore"):
+                bx0 = np.clip((x - r) // b, 0, cols - 1).astype(np.intp)
+                bx1 = np.clip((x + r) // b, 0, cols - 1).astype(np.intp) + 1
+                by0 = np.clip((y - r) // b, 0, rows - 1).astype(np.intp)
+                by1 = np.clip((y + r) // b, 0, rows - 1).astype(np.intp) + 1
+            inside = table[by1, bx1] - table[by0, bx1] - table[by1, bx0] + table[by0, bx0]
+            replaced = np.isfinite(r) & (inside > 0)
+            if not np.any(replaced):
+                continue
+            # The bounding box of the replaced faces lies within that of their circumcircles
+            r = cell.circles[replaced]
+            bx0, by0 = np.min(r[:, 0] - r[:, 2]), np.min(r[:, 1] - r[:, 2])
+            bx1, by1 = np.max(r[:, 0] + r[:, 2]), np.max(r[:, 1] + r[:, 2])
+            affected.update(c for c in cores if c[0] <= bx1 and c[2] >= bx0 and c[1] <= by1 and c[3] >= by0)
+        return sorted(affected, key=lambda c: (c[1], c[0]))
+
+    def _mesh(self) -> Mesh:
+        """The mesh of all cells."""
+        meshes = [cell.mesh for cell in self.cells.values() if len(cell.mesh)]
+        if not meshes:
+            return Mesh(np.zeros((0, 2)), np.zeros((0, 3)))
+        offsets = np.cumsum([0] + [len(m.vertices) for m in meshes[:-1]])
+        return Mesh(np.concatenate([m.vertices for m in meshes]),
+                    np.concatenate([m.faces + o for m, o in zip(meshes, offsets)]),
+                    np.concatenate([m.colors for m in meshes]))
+
+    def step(self, frame: np.ndarray, bench: Optional[Bench] = None) -> Tuple[Mesh, dict]:
+        """Update the mesh to the next frame. Return it and the sizes of the work done."""
+        settings = self.settings
+        bench = bench or Bench()
+        h, w = frame.shape[:2]
+        first = self.frame is None
+        if not first and frame.shape != self.frame.shape:
+            raise ValueError(f"Frame of shape {frame.shape} in a sequence of shape {self.frame.shape}")
+
+        with bench.stage("frame diff", pixels=h * w) as stage:
+            if first:
+                changed = np.ones((-(-h // self.block), -(-w // self.block)), dtype=bool)
+            else:
+                diff = cv2.absdiff(frame, self.frame)
+                if diff.ndim == 3:
+                    diff = diff.max(axis=2)
+                changed = self._block_mask(diff > settings.seq_tol)
+            stage.set(blocks=int(np.count_nonzero(changed)))
+        stats = {"changed_blocks": float(np.mean(changed)), "changed_points": 0,
+                 "cells_rebuilt": 0, "cells_recolored": 0}
+        self.frame = frame
+        if not np.any(changed):
+            return self._mesh(), stats
+
+        # The gradient of a pixel depends on its neighbors, the points of a block on the tiles around it
+        touched = self._grow(changed)
+        resampled = self._grow(touched)
+        with bench.stage("importance map", pixels=int(np.count_nonzero(touched)) * self.block ** 2):
+            if first:
+                self.pix_max = float(np.amax(self.importance_map.gradient(frame)))
+                self.plane = np.zeros((h, w), dtype=np.float32)
+                self._update_importance(frame, [(0, 0, w, h)])
+            else:
+                self._update_importance(frame, self._rects(touched))
+
+        with bench.stage("BN sampling") as stage:
+            if first:
+                self.sampler.loadImg(self.plane, self.mag)
+                if settings.points:
+                    # The magnitude is searched on the first frame and kept for the others
+                    self.sampler.sample(settings.points)
+                    self.mag = self.sampler.getMagnitude()
+                    self.sampler.setMagnitude(self.mag)
+                self.points = np.asarray(self.sampler.getSampledPoints()).reshape(-1, 2)
+                gone = self.points[:0]
+                new = self.points
+            else:
+                new = self._sample(self._rects(resampled))
+                new = new[self._in_blocks(new, resampled)]
+                inside = self._in_blocks(self.points, resampled)
+                old = self.points[inside]
+                self.points = np.concatenate((self.points[~inside], new))
+                # Keep only the points that really changed
+                old_keys = set(map(tuple, old.tolist()))
+                new_keys = set(map(tuple, new.tolist()))
+                gone = np.array(sorted(old_keys - new_keys)).reshape(-1, 2)
+                new = np.array(sorted(new_keys - old_keys)).reshape(-1, 2)
+            stats["changed_points"] = len(gone) + len(new)
+            stage.set(points=len(self.points), changed=stats["changed_points"])
+
+        cores = self.stitcher.grid(w, h, self.cell)
+        with bench.stage("triangulation", points=stats["changed_points"]) as stage:
+            rebuilt = set()
+            if stats["changed_points"]:
+                affected = cores if first else self._affected(np.concatenate((gone, new)), cores)
+                vertices = np.unique(self.points.astype(np.float32), axis=0)
+                for core in affected:
+                    cell = self._build(frame, vertices, core)
+                    if cell is not None:
+                        self.cells[core] = cell
+                        rebuilt.add(core)
+            stats["cells_rebuilt"] = len(rebuilt)
+            stage.set(cells=len(rebuilt))
+
+        with bench.stage("coloring") as stage:
+            # The cells that kept their faces but overlap changed pixels
+            recolored = 0
+            b = self.block
+            for core, cell in self.cells.items():
+                if core in rebuilt or len(cell.mesh) == 0:
+                    continue
+                tri = cell.mesh.triangles.reshape(-1, 2)
+                bx0, by0 = np.maximum((tri.min(axis=0) // b).astype(int), 0)
+                bx1, by1 = (tri.max(axis=0) // b).astype(int)
+                if np.any(changed[by0:by1 + 1, bx0:bx1 + 1]):
+                    cell.mesh = self._color(frame, cell.mesh)
+                    recolored += 1
+            stats["cells_recolored"] = recolored
+            stage.set(cells=recolored)
+
+        return self._mesh(), stats
+
+    def run(self, image_path: str, output_path: str, bench: Optional[Bench] = None) -> dict:
+        """Convert the frames of image_path into one SVG file each in the directory output_path.
+
+        Return the manifest, which is also written to <output_path>/manifest.json.
+        """
+        settings = self.settings
+        bench = bench or Bench()
+        os.makedirs(output_path, exist_ok=True)
+        self.reset()
+
+        entries = []
+        previous = None
+        start = time.perf_counter()
+        for name, frame in read_frames(image_path):
+            begin = time.perf_counter()
+            mesh, stats = self.step(frame, bench)
+            path = os.path.join(output_path, f"{name}.{settings.extension}")
+            with bench.stage("SVG write", triangles=len(mesh)) as stage:
+                if previous is not None and not (stats["cells_rebuilt"] or stats["cells_recolored"]):
+                    # The mesh is that of the previous frame
+                    shutil.copyfile(previous, path)
+                else:
+                    write_svg(settings, frame.shape[1], frame.shape[0], [mesh], path)
+                stage.set(bytes=os.path.getsize(path))
+            previous = path
+
+            entry = {"frame": name, "output": path, "triangles": len(mesh),
+                     "bytes": os.path.getsize(path), **stats,
+                     "changed_blocks": round(stats["changed_blocks"], 4),
+                     "seconds": time.perf_counter() - begin}
+            entries.append(entry)
+            self._log(f"[{len(entries)}] {name}: {stats['changed_blocks']:.1%} changed, "
+                      f"{stats['cells_rebuilt']} cell(s) rebuilt, {stats['cells_recolored']} recolored "
+                      f"({entry['seconds']:.2f} s)")
+
+        manifest = {
+            "input": image_path,
+            "output": output_path,
+            "frames": len(entries),
+            "wall_s": time.perf_counter() - start,
+            "entries": entries,
+        }
+        manifest_path = os.path.join(output_path, "manifest.json")
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        print(f"{len(entries)} frames converted in {manifest['wall_s']:.1f} s; manifest written to {manifest_path}")
+        return manifest
@@ -0,0 +1,222 @@
+"""
+Out-of-core conversion of one image too large to hold in memory, in horizontal strips.
+
+Raw, .npy and binary PGM/PPM inputs are memory-mapped (see util.strip_io), and
+every stage that touches all pixels reads them a strip of rows at a time:
+  1. the gradient max of every strip, reduced to the global max the importance
+     map is normalized by;
+  2. the importance map of every strip, summed over the channels into a
+     memory-mapped float32 plane the sampler reads in place;
+  3. blue-noise sampling and decimation, which only touch the pixels under the
+     sampled points; the sampler's max-pyramid of the plane starts at a level
+     coarse enough to fit the ceiling, and the point count is estimated from
+     one strip first, so an input whose tiling and points cannot fit is
+     rejected before sampling;
+  4. coloring, with the color statistics accumulated over the strips.
+The strip height is chosen so the per-strip working set stays under the
+memory ceiling; the pages of the mapped image and plane are left to the OS.
+"""
+import os
+import tempfile
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+import sampler.BN_Sample as Sampler
+from mesh.decimation import Decimate
+from pipeline import write_svg
+from sampling.importance_map import ImportanceMap
+from sampling.lod import LevelOfDetail
+from sampling.triangle_color import TriangleColor
+from util.bench import Bench
+from util.settings import Settings
+from util.strip_io import open_image, strip_rows, strips
+
+
+class StripPipeline:
+    """
+    The image to SVG conversion of one image, reading it in strips within a memory ceiling.
+
+    Takes the same arguments as Pipeline; settings.memory is the ceiling in MB.
+    """
+
+    # Working bytes per pixel of a strip: the strip copy, the int16 gradient and filter
+    # response, the float32 importance and its float64 channel sum, or when coloring,
+    # the labels and gathered pixels
+    BYTES_PER_PIXEL = 48
+    # Bytes per sampled point: the tile tree of the sampler, the point and rank lists,
+    # and the triangulation and decimation arrays
+    BYTES_PER_POINT = 1024
+    # The share of the memory ceiling the sampler's max-pyramid may take
+    PYRAMID_SHARE = 0.25
+
+    def __init__(self, settings: Settings, gamma: float = 0.5, mag: float = 1000.0,
+                 shrink: float = 10, verbose: bool = False):
+        """
+        Keyword arguments:
+            settings -- the parsed command line settings (memory and raw_shape are used here)
+            gamma -- the importance map gamma
+            mag -- the blue-noise sampling density (the starting guess with settings.points)
+            shrink -- the face count reduction factor of the decimation
+            verbose -- print a line as every stage starts
+        """
+        self.settings = settings
+        self.gamma = gamma
+        self.mag = mag
+        self.shrink = shrink
+        self.verbose = verbose
+        self.memory_limit = settings.memory << 20
+
+        self.importance_map = ImportanceMap(settings.luma)
+        self.sampler = Sampler.ImageQuasisampler()
+        self.decimate = Decimate()
+        self.triangle_color = TriangleColor()
+        self.lod = LevelOfDetail()
+
+    def _log(self, message: str) -> None:
+        if self.verbose:
+            print(message)
+
+    def _importance(self, image: np.ndarray, plane: np.ndarray, rows: int) -> List[Tuple[int, int, float]]:
+        """Write the importance of the image, summed over the channels, into plane in two passes over the strips.
+
+        Return the (y0, y1, total importance) of every strip.
+        """
+        h = image.shape[0]
+        # Filtering a strip grown by the filter radius gives the strip exactly the values of the whole image
+        pix_max = 0.0
+        for y0, y1, py0, py1 in strips(h, rows, halo=1):
+            gradient = self.importance_map.gradient(np.ascontiguousarray(image[py0:py1]))
+            pix_max = max(pix_max, float(np.amax(gradient[y0 - py0:y1 - py0])))
+
+        totals = []
+        for y0, y1, py0, py1 in strips(h, rows, halo=1):
+            importance = self.importance_map.run(
+                self.settings, np.ascontiguousarray(image[py0:py1]), self.gamma, pix_max)[y0 - py0:y1 - py0]
+            importance = importance.reshape(y1 - y0, importance.shape[1], -1)
+            # Summed in double channel by channel, as the sampler reduces a multi-channel map
+            total = importance[:, :, 0].astype(np.float64)
+            for c in range(1, importance.shape[2]):
+                total += importance[:, :, c]
+            plane[y0:y1] = total
+            totals.append((y0, y1, float(total.sum())))
+        plane.flush()
+        return totals
+
+    @staticmethod
+    def _pyramid_level(w: int, h: int, budget: int) -> Tuple[int, int]:
+        """The finest max-pyramid level whose levels fit in budget bytes, and their bytes."""
+        level = 1
+        while True:
+            size, lw, lh = 0, w, h
+            for k in range(1, 64):
+                lw, lh = (lw + 1) // 2, (lh + 1) // 2
+                if k >= level:
+                    size += 4 * lw * lh
+                if lw == 1 and lh == 1:
+                    break
+            if size <= budget or size == 0:
+                return level, size
+            level += 1
+
+    def _estimate_points(self, totals: List[Tuple[int, int, float]], w: int) -> int:
+        """The point count of sampling the loaded plane, extrapolated from its strip of most importance."""
+        if self.settings.points:
+            return self.settings.points
+        y0, y1, strip = max(totals, key=lambda t: t[2])
+        if strip <= 0:
+            return 0
+        self.sampler.setWindow(0, y0, w, y1)
+        n = len(self.sampler.getSampledPoints())
+        self.sampler.clearWindow()
+        return int(n * sum(t[2] for t in totals) / strip)
+
+    def run(self, image_path: str, output_path: str, bench: Optional[Bench] = None) -> dict:
+        """Convert one image into an SVG file. Return the sizes of the result.
+
+        Keyword arguments:
+            image_path -- the image to read
+            output_path -- the SVG (or .svgz) file to write
+            bench -- records the stages if given
+        """
+        settings = self.settings
+        bench = bench or Bench()
+
+        self._log("Mapping image...")
+        with bench.stage("image decode") as stage:
+            image = open_image(image_path, settings.raw_shape)
+            stage.set(pixels=image.shape[0] * image.shape[1])
+        h, w = image.shape[:2]
+        pixels = h * w
+        channels = image.shape[2]
+        rows = strip_rows(w, self.BYTES_PER_PIXEL * channels // 3, self.memory_limit)
+        n_strips = -(-h // rows)
+        self._log(f"Processing {n_strips} strips of {rows} rows...")
+
+        with tempfile.TemporaryDirectory(prefix="vectorize-") as tmp:
+            plane = np.lib.format.open_memmap(os.path.join(tmp, "importance.npy"), "w+", np.float32, (h, w))
+
+            self._log("Performing importance map...")
+            with bench.stage("importance map", pixels=pixels) as stage:
+                totals = self._importance(image, plane, rows)
+                stage.set(pixels=pixels, strips=n_strips)
+
+            # The plane is sampled in place; the sampler only pages in the parts it refines
+            self._log("Performing blue-noise sampling...")
+            with bench.stage("BN sampling", pixels=pixels) as stage:
+                level, pyramid = self._pyramid_level(w, h, int(self.memory_limit * self.PYRAMID_SHARE))
+                self.sampler.setPyramidBase(level)
+                self.sampler.loadImg(plane, self.mag)
+                try:
+                    expected = self._estimate_points(totals, w)
+                    needed = pyramid + expected * self.BYTES_PER_POINT
+                    if needed > self.memory_limit:
+                        raise ValueError(
+                            f"Sampling '{image_path}' needs about {needed >> 20} MB for ~{expected} points, "
+                            f"above the --memory ceiling of {settings.memory} MB; raise it, or lower -n")
+                    if settings.points:
+                        sampled = self.sampler.sample(settings.points)
+                    else:
+                        sampled = self.sampler.getSampledPoints()
+                    sampled = np.array(sampled)
+                    ranks = np.asarray(self.sampler.getSampledRanks()).ravel() if settings.lod > 1 else None
+                finally:
+                    # Drop the sampler's view of the mapped plane before the file is removed
+                    self.sampler.release()
+                stage.set(points=len(sampled), pyramid_level=level)
+            del plane
+
+        self._log("Performing decimation...")
+        with bench.stage("decimation", points=len(sampled)) as stage:
+            mesh = self.decimate.run(image, sampled, self.shrink)
+            stage.set(points=len(mesh.vertices), triangles=len(mesh))
+
+        # A 256-bin histogram per triangle and channel for the median and mode
+        batch = max(self.memory_limit // (channels * 256 * 8), 1024)
+        self._log("Performing triangulation...")
+        with bench.stage("triangulation", points=len(mesh.vertices), pixels=pixels) as stage:
+            mesh = mesh.with_colors(self.triangle_color.run_strips(
+                image, mesh.triangles, settings.color_mode, rows, batch))
+            stage.set(triangles=len(mesh), strips=n_strips)
+
+        meshes = [mesh]
+        if settings.lod > 1:
+            self._log("Building levels of detail...")
+            with bench.stage("level of detail", points=len(mesh.vertices)) as stage:
+                meshes = self.lod.run(image, mesh, sampled, ranks, settings.lod,
+                                      color_mode=settings.color_mode, rows=rows)
+                stage.set(triangles=sum(len(m) for m in meshes[:-1]))
+
+        # Convert mesh to SVG
+        with bench.stage("SVG write", triangles=sum(len(m) for m in meshes)) as stage:
+            size = write_svg(settings, w, h, meshes, output_path)
+            stage.set(bytes=size)
+
+        return {
+            "width": w,
+            "height": h,
+            "points": len(sampled),
+            "vertices": len(mesh.vertices),
+            "triangles": len(mesh),
+            "bytes": size,
+        }
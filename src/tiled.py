@@ -0,0 +1,291 @@
+"""
+Tiled conversion of one large image over a pool of worker processes.
+
+The image is split into tiles that are processed in parallel in four rounds:
+  1. the gradient max of every tile, reduced to the global max the importance
+     map is normalized by, so every tile uses the same normalization;
+  2. the importance map of every tile, written into a shared memory-mapped plane;
+  3. blue-noise sampling of every tile: each worker samples the shared plane
+     with the global Penrose tiling restricted to the tile, so the tiles add up
+     to exactly the point set of a single pass (with a target point count, one
+     worker first searches the magnitude on the whole image);
+  4. triangulation, decimation and coloring of every tile: each tile owns the
+     triangles of the global Delaunay triangulation whose centroid it contains
+     (see TileStitcher), and decimates them with the vertices on the seams kept.
+
+The shared arrays live in .npy files in a temporary directory, so the workers
+map them instead of receiving copies.
+"""
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+from mesh.stitch import Rect, TileStitcher
+from pipeline import write_svg
+from util.bench import Bench
+from util.geometry_types import Mesh
+from util.settings import Settings
+
+# The per-process stages and shared arrays, set up by _init_worker
+_state = {}
+
+
+def _init_worker(settings: Settings, tmp: str, gamma: float, mag: float, shrink: float,
+                 threads: Optional[int]) -> None:
+    from mesh.decimation import Decimate
+    from sampling.importance_map import ImportanceMap
+    from sampling.triangle_color import TriangleColor
+
+    if threads is not None:
+        cv2.setNumThreads(threads)
+    _state.update({
+        "settings": settings,
+        "tmp": tmp,
+        "gamma": gamma,
+        "mag": mag,
+        "shrink": shrink,
+        "image": np.load(os.path.join(tmp, "image.npy"), mmap_mode="r"),
+        "importance_map": ImportanceMap(settings.luma),
+        "decimate": Decimate(),
+        "triangle_color": TriangleColor(),
+        "stitcher": TileStitcher(),
+        "sampler": None,
+        "threads": threads,
+    })
+
+
+def _padded(core: Rect) -> Tuple[np.ndarray, Tuple[slice, slice]]:
+    """The tile grown by the filter radius, and the slice of the tile within it.
+
+    Filtering the grown tile gives the tile exactly the values of filtering the whole image.
+    """
+    image = _state["image"]
+    h, w = image.shape[:2]
+    x0, y0, x1, y1 = core
+    px0, py0, px1, py1 = max(x0 - 1, 0), max(y0 - 1, 0), min(x1 + 1, w), min(y1 + 1, h)
+    crop = np.ascontiguousarray(image[py0:py1, px0:px1])
+    return crop, (slice(y0 - py0, y1 - py0), slice(x0 - px0, x1 - px0))
+
+
+def _gradient_max(core: Rect) -> float:
+    crop, inner = _padded(core)
+    return float(np.amax(_state["importance_map"].gradient(crop)[inner]))
+
+
+def _importance(core: Rect, pix_max: float) -> None:
+    """Write the importance of one tile, summed over the channels, into the shared float32 plane."""
+    x0, y0, x1, y1 = core
+    crop, inner = _padded(core)
+    importance = _state["importance_map"].run(_state["settings"], crop, _state["gamma"], pix_max)[inner]
+    importance = importance.reshape(y1 - y0, x1 - x0, -1)
+
+    plane = np.load(os.path.join(_state["tmp"], "importance.npy"), mmap_mode="r+")
+    # Summed in double channel by channel, as the sampler reduces a multi-channel map,
+    # so the shared plane holds exactly the values of a single pass
+    total = importance[:, :, 0].astype(np.float64)
+    for c in range(1, importance.shape[2]):
+        total += importance[:, :, c]
+    plane[y0:y1, x0:x1] = total
+    plane.flush()
+
+
+def _sampler():
+    if _state["sampler"] is None:
+        import sampler.BN_Sample as Sampler
+
+        # Every tile needs the importance of the whole image, the coarse
+        # Penrose tiles extend far beyond the tile they are refined for.
+        # The reduced float32 plane is sampled in place, not copied
+        _state["sampler"] = Sampler.ImageQuasisampler()
+        if _state["threads"] is not None:
+            _state["sampler"].setNumThreads(_state["threads"])
+        plane = np.load(os.path.join(_state["tmp"], "importance.npy"), mmap_mode="c")
+        _state["sampler"].loadImg(plane, _state["mag"])
+    return _state["sampler"]
+
+
+def _magnitude(n_points: int) -> float:
+    """The sampling magnitude that gives about n_points points over the whole image."""
+    sampler = _sampler()
+    sampler.clearWindow()
+    sampler.sample(n_points)
+    return sampler.getMagnitude()
+
+
+def _sample(core: Rect, mag: float) -> np.ndarray:
+    """Blue-noise sample the part of the shared importance plane inside one tile.
+
+    Return the Nx3 array of the points and their ranks.
+    """
+    sampler = _sampler()
+    x0, y0, x1, y1 = core
+    sampler.setMagnitude(mag)
+    sampler.setWindow(x0, y0, x1, y1)
+    points = np.asarray(sampler.getSampledPoints()).reshape(-1, 2)
+    ranks = np.asarray(sampler.getSampledRanks()).reshape(-1, 1)
+    return np.hstack((points, ranks))
+
+
+def _mesh(core: Rect, margin: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Triangulate, decimate and color the faces owned by one tile. Return (faces, colors)."""
+    settings = _state["settings"]
+    image = _state["image"]
+    h, w = image.shape[:2]
+    vertices = np.load(os.path.join(_state["tmp"], "vertices.npy"))
+
+    faces = _state["stitcher"].tile_faces(vertices, core, w, h, margin)
+    if len(faces) == 0:
+        return faces.astype(np.int32), np.zeros((0, 3), dtype=np.uint8)
+
+    # Decimate the tile on its own vertices; the seams are its boundary and stay in place
+    used, local = np.unique(faces, return_inverse=True)
+    mesh = _state["decimate"].simplify(image, Mesh(vertices[used], local.reshape(-1, 3)), _state["shrink"])
+    faces = used[mesh.faces]
+
+    # Color on the crop around the faces of the tile
+    tri = vertices[faces]
+    lo = np.maximum(np.floor(tri.reshape(-1, 2).min(axis=0)).astype(int), 0)
+    hi = np.minimum(np.ceil(tri.reshape(-1, 2).max(axis=0)).astype(int) + 1, (w, h))
+    crop = np.ascontiguousarray(image[lo[1]:hi[1], lo[0]:hi[0]])
+    colors = _state["triangle_color"].run(crop, tri - lo.astype(np.float32), settings.color_mode)
+    return faces.astype(np.int32), colors
+
+
+class TiledPipeline:
+    """
+    The image to SVG conversion of one image, split into tiles over worker processes.
+
+    Takes the same arguments as Pipeline, plus the tile size and initial margin.
+    """
+
+    def __init__(self, settings: Settings, gamma: float = 0.5, mag: float = 1000.0,
+                 shrink: float = 10, verbose: bool = False):
+        """
+        Keyword arguments:
+            settings -- the parsed command line settings (tile_size, tile_margin and jobs are used here)
+            gamma -- the importance map gamma
+            mag -- the blue-noise sampling density
+            shrink -- the face count reduction factor of the decimation
+            verbose -- print a line as every stage starts
+        """
+        self.settings = settings
+        self.gamma = gamma
+        self.mag = mag
+        self.shrink = shrink
+        self.verbose = verbose
+        self.stitcher = TileStitcher()
+
+    def _log(self, message: str) -> None:
+        if self.verbose:
+            print(message)
+
+    def _stitch(self, image: np.ndarray, vertices: np.ndarray, faces: np.ndarray, colors: np.ndarray) -> Mesh:
+        """Merge the tile meshes; fall back to a single pass if the tiles do not fit together."""
+        mesh = Mesh(vertices, faces, colors)
+        if self.stitcher.is_seamless(mesh):
+            return mesh.compact()
+
+        from mesh.decimation import Decimate
+        from sampling.triangulate import Triangulate
+
+        print("Warning: the tile meshes do not fit together, meshing in a single pass")
+        mesh = Decimate().run(image, vertices, self.shrink)
+        return Triangulate().color(self.settings, image, mesh, self.settings.color_mode)
+
+    def run(self, image_path: str, output_path: str, bench: Optional[Bench] = None) -> dict:
+        """Convert one image into an SVG file. Return the sizes of the result.
+
+        Keyword arguments:
+            image_path -- the image to read
+            output_path -- the SVG (or .svgz) file to write
+            bench -- records the stages if given
+        """
+        settings = self.settings
+        bench = bench or Bench()
+
+        self._log("Loading image...")
+        with bench.stage("image decode") as stage:
+            image = cv2.imread(image_path)
+            if image is None:
+                raise ValueError(f"Could not read image '{image_path}'")
+            stage.set(pixels=image.shape[0] * image.shape[1])
+        h, w = image.shape[:2]
+        pixels = h * w
+
+        tiles = TileStitcher.grid(w, h, settings.tile_size)
+        jobs = max(min(settings.jobs, len(tiles)), 1)
+        threads = 1 if jobs > 1 else None
+        self._log(f"Processing {len(tiles)} tiles with {jobs} worker(s)...")
+
+        with tempfile.TemporaryDirectory(prefix="vectorize-") as tmp:
+            shared = np.lib.format.open_memmap(os.path.join(tmp, "image.npy"), "w+", image.dtype, image.shape)
+            shared[:] = image
+            shared.flush()
+            del shared
+            np.lib.format.open_memmap(os.path.join(tmp, "importance.npy"), "w+", np.float32, (h, w)).flush()
+
+            with ProcessPoolExecutor(jobs, initializer=_init_worker,
+                                     initargs=(settings, tmp, self.gamma, self.mag, self.shrink, threads)) as pool:
+                self._log("Performing importance map...")
+                with bench.stage("importance map", pixels=pixels, tiles=len(tiles)) as stage:
+                    pix_max = max(pool.map(_gradient_max, tiles))
+                    list(pool.map(_importance, tiles, [pix_max] * len(tiles)))
+                    stage.set(pixels=pixels)
+
+                self._log("Performing blue-noise sampling...")
+                with bench.stage("BN sampling", pixels=pixels, tiles=len(tiles)) as stage:
+                    # The count is only known for the whole image, so the magnitude is
+                    # searched for once and every tile samples with it
+                    mag = pool.submit(_magnitude, settings.points).result() if settings.points else self.mag
+                    ranked = np.concatenate(list(pool.map(_sample, tiles, [mag] * len(tiles))))
+                    sampled, ranks = ranked[:, :2], ranked[:, 2]
+                    vertices = np.unique(sampled.astype(np.float32), axis=0)
+                    np.save(os.path.join(tmp, "vertices.npy"), vertices)
+                    stage.set(points=len(sampled))
+
+                self._log("Performing triangulation, decimation and coloring...")
+                with bench.stage("tile meshes", points=len(vertices), tiles=len(tiles)) as stage:
+                    results = list(pool.map(_mesh, tiles, [settings.tile_margin] * len(tiles)))
+                    faces = np.concatenate([r[0] for r in results])
+                    colors = np.concatenate([r[1] for r in results])
+                    mesh = self._stitch(image, vertices, faces, colors)
+                    stage.set(points=len(mesh.vertices), triangles=len(mesh))
+
+        meshes = [mesh]
+        if settings.lod > 1:
+            from sampling.lod import LevelOfDetail
+
+            self._log("Building levels of detail...")
+            with bench.stage("level of detail", points=len(mesh.vertices)) as stage:
+                meshes = LevelOfDetail().run(image, mesh, sampled, ranks, settings.lod,
+                                             color_mode=settings.color_mode)
+                stage.set(triangles=sum(len(m) for m in meshes[:-1]))
+
+        quality = {}
+        if settings.quality:
+            from util.metrics import psnr, ssim
+            from util.render import MeshRenderer
+
+            self._log("Measuring quality...")
+            with bench.stage("quality", pixels=pixels, triangles=len(mesh)):
+                rendered = MeshRenderer().render(mesh, w, h)
+                quality = {"psnr": round(psnr(rendered, image), 3), "ssim": round(ssim(rendered, image), 4)}
+
+        # Convert mesh to SVG
+        with bench.stage("SVG write", triangles=sum(len(m) for m in meshes)) as stage:
+            size = write_svg(settings, w, h, meshes, output_path)
+            stage.set(bytes=size)
+
+        return {
+            "width": w,
+            "height": h,
+            "points": len(sampled),
+            "vertices": len(mesh.vertices),
+            "triangles": len(mesh),
+            "bytes": size,
+            **quality,
+        }
@@ -1,43 +1,169 @@
+from typing import Iterator, Optional
+
 import numpy as np
 import cv2
-import subprocess as sp
 
 from util.settings import Settings
 
 
+class QuantizedImage:
+    """
+    A color-quantized image as a label image and a palette.
+
+    labels -- uint8 HxW array of palette indices
+    palette -- uint8 kx3 array of BGR colors
+
+    The per-color masks are built on request, one at a time.
+    """
+
+    def __init__(self, labels: np.ndarray, palette: np.ndarray):
+        self.labels = labels
+        self.palette = palette
+
+    def __len__(self) -> int:
+        return len(self.palette)
+
+    def mask(self, i: int) -> np.ndarray:
+        """The uint8 mask of the pixels of color i, 255 inside and 0 outside."""
+        mask = np.equal(self.labels, i).view(np.uint8)
+        mask *= 255
+        return mask
+
+    def masks(self) -> Iterator[np.ndarray]:
+        """Yield the mask of every color in turn."""
+        for i in range(len(self)):
+            yield self.mask(i)
+
+    def image(self) -> np.ndarray:
+        """The quantized BGR image."""
+        return self.palette[self.labels]
+
+
 class ColorQuantization:
     """
     Color quantization using k-means clustering.
 
+    The palette is fit on a spatially stratified subsample of the pixels, or
+    with mini-batch k-means updates over random batches of them, and every
+    pixel is then assigned its nearest palette color in one vectorized pass.
+
     Based on https://www.analyticsvidhya.com/blog/2021/07/colour-quantization-using-k-means-clustering-and-opencv/
+    and Sculley, "Web-scale k-means clustering" (2010)
     """
 
-    def run(self, settings: Settings, img: np.ndarray, k: int) -> np.ndarray:
-        img_flat = np.float32(img).reshape(-1, 3)
+    METHODS = ("sample", "minibatch")
+
+    # Number of pixels assigned at a time
+    CHUNK = 1 << 18
+
+    def __init__(self, method: str = "sample", sample_size: int = 1 << 16, batch_size: int = 4096,
+                 max_iter: int = 100, seed: Optional[int] = 0):
+        """
+        Keyword arguments:
+            method -- "sample" runs cv2.kmeans on a stratified subsample, "minibatch" runs mini-batch k-means
+            sample_size -- the number of pixels of the subsample
+            batch_size -- the number of pixels per mini-batch
+            max_iter -- the number of mini-batches
+            seed -- the seed of the subsample, batches and initial centers
+        """
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown quantization method '{method}', expected one of {self.METHODS}")
+        self.method = method
+        self.sample_size = sample_size
+        self.batch_size = batch_size
+        self.max_iter = max_iter
+        self.seed = seed
+
+    def _stratified_sample(self, pixels: np.ndarray, h: int, w: int, rng: np.random.Generator) -> np.ndarray:
+        """One random pixel out of every cell of a grid of about sample_size cells."""
+        if h * w <= self.sample_size:
+            return pixels
+        step = np.sqrt(h * w / self.sample_size)
+        ys = np.arange(0, h, step)
+        xs = np.arange(0, w, step)
+        y = np.minimum(ys[:, None] + rng.random((len(ys), len(xs))) * step, h - 1).astype(np.intp)
+        x = np.minimum(xs[None, :] + rng.random((len(ys), len(xs))) * step, w - 1).astype(np.intp)
+        return pixels[(y * w + x).ravel()]
+
+    def _fit_sample(self, pixels: np.ndarray, h: int, w: int, k: int, rng: np.random.Generator) -> np.ndarray:
+        sample = self._stratified_sample(pixels, h, w, rng).astype(np.float32)
         condition = (cv2.TERM_CRITERIA_EPS +
                      cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
-        _, labels, center = cv2.kmeans(
-            img_flat, k, None, condition, 10, cv2.KMEANS_RANDOM_CENTERS)
-        # center = np.uint8(center)
-        # img_out = center[label.flatten()]
-        # img_out = img_out.reshape(img.shape)
-        # return img_out
+        cv2.setRNGSeed(int(rng.integers(1 << 31)))
+        _, _, centers = cv2.kmeans(sample, k, None, condition, 3, cv2.KMEANS_PP_CENTERS)
+        return centers
 
-        h, w, _ = img.shape
-        labels = labels.reshape(h, w)
-        color_scans = np.zeros((k, h, w), dtype=np.uint8)
-        for i in range(k):
-            color_scans[i] = labels == i
+    def _fit_minibatch(self, pixels: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+        # Seed the centers with k-means++ on a first batch
+        batch = pixels[rng.integers(len(pixels), size=max(self.batch_size, k))].astype(np.float32)
+        centers = np.empty((k, pixels.shape[1]), dtype=np.float32)
+        centers[0] = batch[rng.integers(len(batch))]
+        dist = ((batch - centers[0]) ** 2).sum(axis=1)
+        for i in range(1, k):
+            total = dist.sum()
+            j = rng.choice(len(batch), p=dist / total) if total > 0 else rng.integers(len(batch))
+            centers[i] = batch[j]
+            np.minimum(dist, ((batch - centers[i]) ** 2).sum(axis=1), out=dist)
 
-        return color_scans * 255
+        # Move every center towards the mean of its batch pixels, at a rate decaying with its count
+        counts = np.zeros(k)
+        for _ in range(self.max_iter):
+            batch = pixels[rng.integers(len(pixels), size=self.batch_size)].astype(np.float32)
+            labels = self._nearest(batch, centers)
+            n = np.bincount(labels, minlength=k)
+            sums = np.stack([np.bincount(labels, weights=batch[:, c], minlength=k)
+                             for c in range(batch.shape[1])], axis=1)
+            counts += n
+            hit = n > 0
+            rate = (n[hit] / counts[hit])[:, None]
+            centers[hit] += (rate * (sums[hit] / n[hit, None] - centers[hit])).astype(np.float32)
+        return centers
 
-    def run_and_export(self, settings: Settings, img: np.ndarray, k: int) -> np.ndarray:
-        img_scans = self.run(settings, img, k)
+    @staticmethod
+    def _nearest(pixels: np.ndarray, centers: np.ndarray) -> np.ndarray:
+        """The index of the nearest center of every float32 pixel."""
+        # |p - c|^2 = |p|^2 - 2 p.c + |c|^2, and |p|^2 is the same for every center
+        dist = pixels @ (-2 * centers.T)
+        dist += (centers ** 2).sum(axis=1)
+        return np.argmin(dist, axis=1)
+
+    def fit(self, img: np.ndarray, k: int) -> np.ndarray:
+        """Return the float32 kx3 palette of the BGR image."""
+        if not 0 < k <= 256:
+            raise ValueError(f"Invalid number of colors {k}, expected 1 to 256")
+        h, w = img.shape[:2]
+        pixels = img.reshape(h * w, -1)
+        rng = np.random.default_rng(self.seed)
+        if self.method == "minibatch":
+            return self._fit_minibatch(pixels, k, rng)
+        return self._fit_sample(pixels, h, w, k, rng)
+
+    def assign(self, img: np.ndarray, palette: np.ndarray) -> np.ndarray:
+        """Return the uint8 HxW label image of the nearest palette color of every pixel."""
+        h, w = img.shape[:2]
+        pixels = img.reshape(h * w, -1)
+        centers = np.asarray(palette, dtype=np.float32)
+        labels = np.empty(h * w, dtype=np.uint8)
+        for start in range(0, h * w, self.CHUNK):
+            chunk = pixels[start:start + self.CHUNK].astype(np.float32)
+            labels[start:start + len(chunk)] = self._nearest(chunk, centers)
+        return labels.reshape(h, w)
 
-        for i in range(k):
-            filename = f"img/out{i}"
-            cv2.imwrite(f"{filename}.bmp", img_scans[i, :, :])
-            sp.Popen(
-                f"potrace {filename}.bmp -o {filename}.svg -b svg".split(' '))
+    def run(self, settings: Settings, img: np.ndarray, k: int) -> QuantizedImage:
+        """Quantize the BGR image to k colors."""
+        palette = self.fit(img, k)
+        labels = self.assign(img, palette)
+        return QuantizedImage(labels, np.clip(np.round(palette), 0, 255).astype(np.uint8))
+
+    def run_and_export(self, settings: Settings, img: np.ndarray, k: int) -> np.ndarray:
+        """
+        Same as run(), but also traces the color regions into the SVG file settings.output.
+        """
+        from tracer.contour_trace import ContourTracer
+        from util.mesh_to_svg import SVGWriter
 
-        return img
+        quantized = self.run(settings, img, k)
+        layers = ContourTracer(precision=settings.precision).run(quantized)
+        h, w = img.shape[:2]
+        SVGWriter(w, h, 1, settings.precision).draw_paths(settings.output, layers)
+        return quantized.image()
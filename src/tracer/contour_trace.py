@@ -0,0 +1,129 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from tracer.color_quant import QuantizedImage
+
+
+class ContourTracer:
+    """
+    In-process tracing of the color regions of a quantized image into SVG paths.
+
+    The colors are stacked from the largest region to the smallest, and the
+    layer of every color covers its own pixels and those of all the colors
+    above it, so the layers leave no gaps between neighboring regions.
+    Every layer is one path: the outer contours and holes found by
+    cv2.findContours, simplified with Douglas-Peucker and fit with cubic
+    Bezier curves through the remaining points (Catmull-Rom splines), filled
+    with the even-odd rule. As in potrace, a point where the contour turns
+    sharply is kept as a corner: the curves do not round it, and the sides
+    between two corners stay straight, so rectilinear shapes keep their edges. The layers are traced in parallel threads;
+    OpenCV releases the GIL while it searches the contours.
+    """
+
+    def __init__(self, epsilon: float = 1.0, smooth: bool = True, min_area: float = 4,
+                 precision: int = 1, jobs: Optional[int] = None, corner_angle: float = 60):
+        """
+        Keyword arguments:
+            epsilon -- the maximum distance in pixels of the simplified contours from the traced ones
+            smooth -- fit curves through the simplified contours instead of keeping them as polygons
+            min_area -- contours enclosing fewer pixels are dropped
+            precision -- the number of decimal digits kept for each coordinate
+            jobs -- the number of threads tracing layers (default: one per core)
+            corner_angle -- the contour turns sharper than this many degrees are kept as corners
+        """
+        self.epsilon = epsilon
+        self.smooth = smooth
+        self.min_area = min_area
+        self.precision = max(int(precision), 0)
+        self.jobs = jobs
+        self.corner_angle = corner_angle
+
+    def _paths(self, contours: List[np.ndarray]) -> str:
+        """The closed path data of the simplified contours, in coordinates scaled by 10^precision.
+
+        All contours are formatted at once: every point is one fixed format, with
+        the commands of the first and last point of a contour folded into it.
+        """
+        if not contours:
+            return ""
+        q = 10 ** self.precision
+        lengths = np.array([len(c) for c in contours])
+        # Contours run through the centers of the boundary pixels
+        p = np.concatenate(contours).reshape(-1, 2).astype(np.float64) + 0.5
+        starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        size = np.repeat(lengths, lengths)
+        local = np.arange(len(p)) - starts
+        first = local == 0
+        last = local == size - 1
+
+        def shifted(k: int) -> np.ndarray:
+            return p[starts + (local + k) % size]
+
+        # Catmull-Rom through every point: the segment of point i runs from p[i] to p[i + 1].
+        # The tangent at a corner is zero, so the curves meet it at an angle without overshooting,
+        # and a segment between two corners is a line; short contours stay polygons
+        prv, nxt = shifted(-1), shifted(1)
+        d_in, d_out = p - prv, nxt - p
+        norm = np.linalg.norm(d_in, axis=1) * np.linalg.norm(d_out, axis=1)
+        cos = np.einsum("ij,ij->i", d_in, d_out) / np.maximum(norm, 1e-12)
+        corner = cos < np.cos(np.radians(self.corner_angle))
+        tangent = np.where(corner[:, None], 0, (nxt - prv) / 6)
+        following = starts + (local + 1) % size
+        curved = (size >= 3) & ~(corner & corner[following]) if self.smooth else np.zeros(len(p), dtype=bool)
+        values = np.empty((len(p), 8))
+        values[:, :2] = p
+        values[:, 2:4] = p + tangent
+        values[:, 4:6] = nxt - tangent[following]
+        values[:, 6:] = nxt
+        values = np.round(values * q).astype(np.int64)
+
+        # Every point writes its segment: curves continue a preceding curve without repeating the
+        # command, and the line of the last point is the closing z
+        line = ~curved & ~last
+        keep = np.zeros(values.shape, dtype=bool)
+        keep[:, :2] = first[:, None]
+        keep[:, 2:6] = curved[:, None]
+        keep[:, 6:] = (curved | line)[:, None]
+        continued = curved & ~first & curved[starts + (local - 1) % size]
+        templates = np.where(first, "M%d %d", "").astype(object)
+        templates += np.where(curved, np.where(continued, " %d %d %d %d %d %d", "C%d %d %d %d %d %d"),
+                              np.where(line, "L%d %d", ""))
+        templates[last] += "z"
+        return "".join(templates.tolist()) % tuple(values[keep].tolist())
+
+    def trace_mask(self, mask: np.ndarray) -> str:
+        """The path data of all outer contours and holes of a uint8 mask, or "" if it is empty."""
+        contours, _ = cv2.findContours(mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+        simplified = [cv2.approxPolyDP(c, self.epsilon, True) for c in contours
+                      if abs(cv2.contourArea(c)) >= self.min_area]
+        return self._paths(simplified)
+
+    def run(self, quantized: QuantizedImage) -> List[Tuple[np.ndarray, str]]:
+        """Trace every color of the quantized image. Return its (RGB color, path data) layers, bottom first.
+
+        The bottom layer covers the whole image.
+        """
+        h, w = quantized.labels.shape
+        area = np.bincount(quantized.labels.ravel(), minlength=len(quantized))
+        order = np.argsort(-area, kind="stable")
+        order = order[area[order] > 0]
+        # The stacking position of every pixel's color; layer i covers the positions >= i
+        position = np.empty(len(quantized), dtype=np.uint8)
+        position[order] = np.arange(len(order))
+        stacked = position[quantized.labels]
+
+        def trace(i: int) -> str:
+            if i == 0:
+                q = 10 ** self.precision
+                return "M0 0H%dV%dH0z" % (w * q, h * q)
+            return self.trace_mask(np.greater_equal(stacked, i).view(np.uint8))
+
+        with ThreadPoolExecutor(self.jobs) as pool:
+            paths = list(pool.map(trace, range(len(order))))
+
+        # The palette is BGR, as cv2 uses
+        colors = quantized.palette[order][:, ::-1]
+        return [(color, d) for color, d in zip(colors, paths) if d]
@@ -0,0 +1,141 @@
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def _peak_rss() -> int:
+    """Peak resident set size of this process so far, in bytes (0 if unknown)."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageRecord:
+    """
+    Timing and memory numbers of one pipeline stage.
+    """
+
+    def __init__(self, name: str, inputs: Dict[str, int]):
+        self.name = name
+        self.inputs = dict(inputs)
+        self.outputs: Dict[str, int] = {}
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.process_peak_rss = 0
+        self.traced_peak = 0
+
+    def set(self, **outputs: int) -> None:
+        """Record the output sizes of the stage, e.g. set(points=len(points))."""
+        self.outputs.update({k: int(v) for k, v in outputs.items()})
+
+    def to_dict(self) -> dict:
+        return {
+            "stage": self.name,
+            "wall_s": self.wall,
+            "cpu_s": self.cpu,
+            "process_peak_rss_bytes": self.process_peak_rss,
+            "traced_peak_bytes": self.traced_peak,
+            "inputs": self.inputs,
+            "outputs": self.outputs,
+        }
+
+
+class Bench:
+    """
+    Per-stage instrumentation of the pipeline.
+
+    Records wall time, CPU time, the tracemalloc peak above the memory in use
+    when the stage started (the per-stage memory figure), the peak RSS of the
+    process so far (a lifetime high-water mark, not per stage) and input/output
+    sizes. When disabled, stage() records nothing and costs nothing; with
+    memory=False only the (cheap) times and sizes are recorded.
+    """
+
+    def __init__(self, enabled: bool = False, profile_dir: Optional[str] = None, memory: bool = True):
+        """
+        Keyword arguments:
+            enabled -- whether to record anything at all
+            profile_dir -- if set, a cProfile dump <stage>.prof is written per stage into this directory
+            memory -- whether to trace memory, which slows down allocation-heavy stages
+        """
+        self.enabled = enabled
+        self.profile_dir = profile_dir
+        self.memory = memory
+        self.records: List[StageRecord] = []
+        if enabled and memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if enabled and profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    @contextmanager
+    def stage(self, name: str, **inputs: int) -> Iterator[StageRecord]:
+        """Instrument the enclosed block as one stage, e.g. with bench.stage("sampling", pixels=n) as s."""
+        record = StageRecord(name, inputs)
+        if not self.enabled:
+            yield record
+            return
+
+        profiler = cProfile.Profile() if self.profile_dir else None
+        if self.memory:
+            traced_before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        if profiler:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler:
+                profiler.disable()
+            record.wall = time.perf_counter() - wall
+            record.cpu = time.process_time() - cpu
+            if self.memory:
+                _, traced_peak = tracemalloc.get_traced_memory()
+                record.traced_peak = max(traced_peak - traced_before, 0)
+                record.process_peak_rss = _peak_rss()
+            self.records.append(record)
+            if profiler:
+                filename = name.replace(" ", "_").replace("/", "_") + ".prof"
+                profiler.dump_stats(os.path.join(self.profile_dir, filename))
+
+    def table(self) -> str:
+        """Format the recorded stages as a text table."""
+        def mb(n: int) -> str:
+            return f"{n / (1 << 20):.1f}"
+
+        def sizes(d: Dict[str, int]) -> str:
+            return ", ".join(f"{k}={v}" for k, v in d.items())
+
+        header = ("stage", "wall s", "cpu s", "process peak RSS MB", "traced MB", "in", "out")
+        rows = [header] + [
+            (r.name, f"{r.wall:.3f}", f"{r.cpu:.3f}", mb(r.process_peak_rss),
+             mb(r.traced_peak), sizes(r.inputs), sizes(r.outputs))
+            for r in self.records]
+        total_wall = sum(r.wall for r in self.records)
+        total_cpu = sum(r.cpu for r in self.records)
+        rows.append(("total", f"{total_wall:.3f}", f"{total_cpu:.3f}", "", "", "", ""))
+
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        lines = ["  ".join(cell.ljust(w) for cell, w in zip(row, widths)).rstrip() for row in rows]
+        lines.insert(1, "  ".join("-" * w for w in widths))
+        return "\n".join(lines)
+
+    def to_dict(self) -> dict:
+        return {"stages": [r.to_dict() for r in self.records]}
+
+    def write_json(self, filename: str) -> None:
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
@@ -0,0 +1,112 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import Dict, Optional
+
+import numpy as np
+
+
+class StageCache:
+    """
+    Content-addressed on-disk cache of the arrays produced by pipeline stages.
+
+    Every entry is a directory <directory>/<key> with one .npy file per array,
+    loaded memory-mapped. Keys are hashes of the stage name and everything the
+    stage output depends on, usually the key of the stage before it, so a
+    change of a parameter only invalidates the stages after the one it is used
+    in. Entries are written to a temporary directory and renamed into place,
+    so processes can share a cache. Once the cache is larger than max_bytes,
+    the least recently used entries are removed.
+    """
+
+    # Bump to invalidate every entry written by an older layout
+    VERSION = 1
+
+    def __init__(self, directory: str, max_bytes: int = 1 << 30):
+        """
+        Keyword arguments:
+            directory -- the cache directory, created if needed
+            max_bytes -- the size the cache is trimmed to after every store
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats: Dict[str, Dict[str, int]] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        """Hash of the input bytes, the root of the keys of one input."""
+        return hashlib.sha256(data).hexdigest()
+
+    @classmethod
+    def key(cls, stage: str, *parts) -> str:
+        """The key of a stage output depending on parts (strings, numbers, booleans or None)."""
+        h = hashlib.sha256(f"v{cls.VERSION}:{stage}".encode())
+        for part in parts:
+            h.update(b"\0" + repr(part).encode())
+        return f"{stage.replace(' ', '_')}-{h.hexdigest()[:40]}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _count(self, key: str, outcome: str) -> None:
+        stage = key.rsplit("-", 1)[0]
+        counts = self.stats.setdefault(stage, {"hits": 0, "misses": 0})
+        counts[outcome] += 1
+
+    def contains(self, key: str) -> bool:
+        """Check for an entry without loading it or counting a hit or miss."""
+        return os.path.isdir(self._path(key))
+
+    def load(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """Return the memory-mapped arrays of an entry, or None on a miss."""
+        path = self._path(key)
+        try:
+            names = [n for n in os.listdir(path) if n.endswith(".npy")]
+            arrays = {n[:-4]: np.load(os.path.join(path, n), mmap_mode="r") for n in names}
+            # The directory time is the last use, for the eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            # Missing, or removed by another process while being read
+            self._count(key, "misses")
+            return None
+        self._count(key, "hits")
+        return arrays
+
+    def store(self, key: str, arrays: Dict[str, np.ndarray]) -> None:
+        """Write the arrays of an entry, then trim the cache to its size."""
+        path = self._path(key)
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=self.directory)
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp, f"{name}.npy"), np.asarray(array))
+            os.replace(tmp, path)
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache fits into max_bytes."""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = self._path(name)
+            if name.startswith(".tmp-") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(e.stat().st_size for e in os.scandir(path))
+                entries.append((os.stat(path).st_mtime, size, path))
+            except OSError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def summary(self) -> str:
+        """One line of hits and misses per stage."""
+        return ", ".join(f"{stage}: {c['hits']} hit(s) / {c['misses']} miss(es)"
+                         for stage, c in sorted(self.stats.items())) or "unused"
@@ -1,31 +1,125 @@
+import hashlib
+import warnings
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
 import tensorflow as tf
 
+Image = Union[tf.Tensor, np.ndarray]
+
 
 class Evaluator:
-    def __init__(self):
-        model = tf.keras.applications.VGG19()
+    """
+    Content loss between images: the Euclidean distance between the feature
+    maps of a truncated VGG19.
+
+    The model is built on first use, and the feature maps of reference images
+    are cached by their content, so scoring many candidates against the same
+    reference only runs the reference through the model once. Candidates are
+    scored in batches, one forward pass per batch.
+    """
+
+    def __init__(self, intra_op_threads: Optional[int] = None, inter_op_threads: Optional[int] = None,
+                 batch_size: int = 16, cache_size: int = 32):
+        """
+        Keyword arguments:
+            intra_op_threads -- the threads TensorFlow runs a single operation on (default: TensorFlow's choice)
+            inter_op_threads -- the threads TensorFlow runs independent operations on (default: TensorFlow's choice)
+            batch_size -- the number of images per forward pass
+            cache_size -- the number of reference feature maps kept, least recently used first out
+        """
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.batch_size = max(int(batch_size), 1)
+        self.cache_size = cache_size
+        self._model = None
+        self._features = OrderedDict()
 
-        # Strip layers off of the model
-        # We are only interested in feature maps, not the actual output
-        self.model = tf.keras.Model(inputs=model.input, outputs=model.layers[-11].output)
+    @property
+    def model(self) -> tf.keras.Model:
+        """The truncated VGG19, built on first use."""
+        if self._model is None:
+            # The thread pools can only be set before TensorFlow runs its first operation
+            try:
+                if self.intra_op_threads:
+                    tf.config.threading.set_intra_op_parallelism_threads(self.intra_op_threads)
+                if self.inter_op_threads:
+                    tf.config.threading.set_inter_op_parallelism_threads(self.inter_op_threads)
+            except RuntimeError as e:
+                warnings.warn(f"TensorFlow is already initialized, intra_op_threads={self.intra_op_threads} and "
+                              f"inter_op_threads={self.inter_op_threads} are ignored: {e}", RuntimeWarning)
 
-        # Get the TensorShape of the input layer and convert it to a Tensor
+            model = tf.keras.applications.VGG19()
+
+            # Strip layers off of the model
+            # We are only interested in feature maps, not the actual output
+            self._model = tf.keras.Model(inputs=model.input, outputs=model.layers[-11].output)
+        return self._model
+
+    @property
+    def input_shape(self) -> List[int]:
+        # Get the TensorShape of the input layer and convert it to a list
         # We drop the first element of the list because it is None
         # We drop the last element because it represents the number of channels
         input_tensor_shape = self.model.layers[0].input.shape.as_list()
-        self.input_shape = input_tensor_shape[1:-1]
+        return input_tensor_shape[1:-1]
 
-    def preprocess_input(self, image: tf.Tensor) -> tf.Tensor:
+    @staticmethod
+    def digest(image: Image) -> str:
+        """The hash of the pixels and shape of an image, the key of its cached feature maps."""
+        pixels = np.ascontiguousarray(image)
+        h = hashlib.sha1(str((pixels.shape, pixels.dtype.str)).encode())
+        h.update(pixels.data)
+        return h.hexdigest()
+
+    def preprocess_input(self, image: Image) -> tf.Tensor:
         """Preprocess the image for input to the model."""
-        image = tf.image.resize(image, self.input_shape)
-        image = tf.keras.applications.vgg19.preprocess_input(image)
-        return tf.expand_dims(image, axis=0)
+        return self.preprocess_batch([image])
+
+    def preprocess_batch(self, images: Sequence[Image]) -> tf.Tensor:
+        """Resize the images, which may differ in size, and stack them into one preprocessed batch."""
+        batch = tf.stack([tf.image.resize(image, self.input_shape) for image in images])
+        return tf.keras.applications.vgg19.preprocess_input(batch)
 
-    def get_content_loss(self, image_1: tf.Tensor, image_2: tf.Tensor) -> float:
-        """Compute the Euclidean distance between the high level features of two images."""
-        image_1 = self.preprocess_input(image_1)
-        image_2 = self.preprocess_input(image_2)
-        return tf.sqrt(tf.reduce_sum(tf.math.squared_difference(self.model(image_1), self.model(image_2))))
+    def get_features(self, images: Sequence[Image]) -> np.ndarray:
+        """The feature maps of the images, batch_size images per forward pass."""
+        model = self.model
+        batches = [self.preprocess_batch(images[start:start + self.batch_size])
+                   for start in range(0, len(images), self.batch_size)]
+        return np.concatenate([model(batch, training=False).numpy() for batch in batches])
+
+    def reference_features(self, image: Image) -> np.ndarray:
+        """The feature maps of a reference image, computed once per distinct image."""
+        key = self.digest(image)
+        features = self._features.get(key)
+        if features is None:
+            features = self.get_features([image])[0]
+            self._features[key] = features
+            while len(self._features) > self.cache_size:
+                self._features.popitem(last=False)
+        else:
+            self._features.move_to_end(key)
+        return features
+
+    @staticmethod
+    def distance(features_1: np.ndarray, features_2: np.ndarray) -> np.ndarray:
+        """The Euclidean distance between feature maps, over the last three axes."""
+        diff = features_1.astype(np.float64) - features_2
+        return np.sqrt(np.sum(diff * diff, axis=(-3, -2, -1)))
+
+    def get_content_losses(self, reference: Image, candidates: Sequence[Image]) -> np.ndarray:
+        """Compute the content loss of every candidate, e.g. renderings of variants, against the reference."""
+        if len(candidates) == 0:
+            return np.zeros(0)
+        return self.distance(self.get_features(candidates), self.reference_features(reference))
+
+    def get_content_loss(self, image_1: Image, image_2: Image) -> float:
+        """Compute the Euclidean distance between the high level features of two images.
+
+        image_1 is treated as the reference, and its feature maps are cached.
+        """
+        return float(self.get_content_losses(image_1, [image_2])[0])
 
 
 def read_image_file(filename: str) -> tf.Tensor:
@@ -44,12 +138,14 @@ if __name__ == '__main__':
     img_2 = read_image_file(cwd + "/../../img/lab2.jpg")
     img_3 = read_image_file(cwd + "/../../img/lab3.jpg")
 
-    # Get the loss
-    loss = evaluator.get_content_loss(img_1, img_3)
+    # Get the loss, with the feature maps of all three images from one forward pass
+    features = evaluator.get_features([img_1, img_2, img_3])
+
+    loss = evaluator.distance(features[0], features[2])
     print('Loss:', loss)
-    
-    loss = evaluator.get_content_loss(img_1, img_2)
+
+    loss = evaluator.distance(features[0], features[1])
     print('Loss:', loss)
-    
-    loss = evaluator.get_content_loss(img_2, img_3)
+
+    loss = evaluator.distance(features[1], features[2])
     print('Loss:', loss)
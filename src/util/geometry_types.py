@@ -1,7 +1,65 @@
-from typing import Tuple, List
+from typing import Optional, Tuple, List
+
+import numpy as np
 
 Color = Tuple[int, int, int]
 Point = Tuple[int, int]
 PointList = List[Point]
-Triangle = Tuple[int, int, int, int, int, int, int, int, int]
-TriangleList = List[Triangle]
+
+
+class Mesh:
+    """
+    Compact struct-of-arrays triangle mesh.
+
+    vertices -- float32 Nx2 array of (x, y) coordinates
+    faces -- int32 Mx3 array of indices into vertices
+    colors -- uint8 Mx3 array of RGB face colors
+
+    Indexing a Mesh selects faces and returns a Mesh that shares the vertex
+    array; basic slices are zero-copy views of the face and color arrays.
+    """
+
+    def __init__(self, vertices: np.ndarray, faces: np.ndarray, colors: Optional[np.ndarray] = None):
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, 2)
+        self.faces = np.ascontiguousarray(faces, dtype=np.int32).reshape(-1, 3)
+        if colors is None:
+            colors = np.zeros((len(self.faces), 3), dtype=np.uint8)
+        self.colors = np.ascontiguousarray(colors, dtype=np.uint8).reshape(-1, 3)
+        if len(self.colors) != len(self.faces):
+            raise ValueError(f"Mesh has {len(self.faces)} faces but {len(self.colors)} colors")
+
+    def __len__(self) -> int:
+        return len(self.faces)
+
+    def __getitem__(self, index) -> "Mesh":
+        faces = self.faces[index]
+        colors = self.colors[index]
+        if faces.ndim == 1:
+            faces = faces[None]
+            colors = colors[None]
+        mesh = Mesh.__new__(Mesh)
+        mesh.vertices = self.vertices
+        mesh.faces = faces
+        mesh.colors = colors
+        return mesh
+
+    def __repr__(self) -> str:
+        return f"Mesh(vertices={len(self.vertices)}, faces={len(self.faces)})"
+
+    @property
+    def triangles(self) -> np.ndarray:
+        """The Mx3x2 vertex coordinates of every face (a copy)."""
+        return self.vertices[self.faces]
+
+    @property
+    def nbytes(self) -> int:
+        return self.vertices.nbytes + self.faces.nbytes + self.colors.nbytes
+
+    def with_colors(self, colors: np.ndarray) -> "Mesh":
+        """Return a Mesh sharing the vertices and faces of this one, with new face colors."""
+        return Mesh(self.vertices, self.faces, colors)
+
+    def compact(self) -> "Mesh":
+        """Return a copy without the vertices that are not referenced by any face."""
+        used, faces = np.unique(self.faces, return_inverse=True)
+        return Mesh(self.vertices[used], faces.reshape(-1, 3), self.colors)
@@ -1,36 +1,176 @@
-import cairo
+import gzip
+from typing import IO, List, Tuple
 
-from util.geometry_types import Triangle, TriangleList
+import numpy as np
+
+from util.geometry_types import Mesh
 
 
 class SVGWriter():
-    def __init__(self, w: int, h: int, line_width: int) -> None:
+    BACKENDS = ("text", "cairo")
+
+    # Path commands of one triangle: absolute start point, then two relative line segments
+    TRIANGLE_FMT = "M%d %dl%d %dl%d %dz"
+
+    def __init__(self, w: int, h: int, line_width: int, precision: int = 1,
+                 backend: str = "text", chunk_size: int = 1 << 16) -> None:
         """
         Keyword arguments:
             img_size -- the height and width dimension of the canvas (img_size by img_size)
             line_width -- the line width used for the vector graphics
+            precision -- the number of decimal digits kept for each coordinate (text backend)
+            backend -- "text" streams SVG markup directly, "cairo" draws through a cairo SVGSurface
+            chunk_size -- the number of triangles formatted and written at a time (text backend)
         """
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown SVG backend '{backend}', expected one of {self.BACKENDS}")
         self.img_size = (w, h)
         self.line_width = line_width
+        self.precision = max(int(precision), 0)
+        self.backend = backend
+        self.chunk_size = chunk_size
+
+    def draw_triangles(self, filename: str, mesh: Mesh) -> None:
+        """Draw the triangles of the provided mesh into an SVG file.
 
-    def draw_triangles(self, filename: str, triangles: TriangleList) -> None:
-        """Draw the provided list of triangles into an SVG file.
+        Filenames ending in .svgz are written gzip-compressed.
 
         Keyword arguments:
             filename -- the filename to save the triangles to
-            triangles -- a list of tuples representing the triangles, where each coordinate is represented by a tuple of (x, y)
+            mesh -- the colored triangle mesh
+        """
+        if self.backend == "cairo":
+            self._draw_cairo(filename, mesh)
+            return
+
+        with self._open(filename) as f:
+            self._write_header(f)
+            self._write_mesh(f, mesh)
+            self._write_footer(f)
+
+    def draw_layers(self, filename: str, meshes: List[Mesh]) -> None:
+        """Draw several meshes into one SVG file, each in its own <g id="lod<i>"> layer.
+
+        The layers are written in order, so with the meshes ordered from coarse to
+        fine a viewer can show the first layer while the finer ones are still loading,
+        and every finer layer paints over the coarser ones.
+
+        Keyword arguments:
+            filename -- the filename to save the layers to
+            meshes -- the colored triangle meshes, coarsest first
+        """
+        if self.backend == "cairo":
+            raise ValueError("Layered output needs the text SVG backend")
+
+        with self._open(filename) as f:
+            self._write_header(f)
+            for i, mesh in enumerate(meshes):
+                f.write(f'<g id="lod{i}">\n')
+                self._write_mesh(f, mesh)
+                f.write('</g>\n')
+            self._write_footer(f)
+
+    def draw_paths(self, filename: str, layers: List[Tuple[np.ndarray, str]]) -> None:
+        """Draw filled paths into an SVG file, one <path id="layer<i>"> per layer, bottom first.
+
+        Keyword arguments:
+            filename -- the filename to save the paths to
+            layers -- the (RGB color, path data) of every layer, with coordinates
+                      scaled by 10^precision, as ContourTracer returns them
         """
+        if self.backend == "cairo":
+            raise ValueError("Path output needs the text SVG backend")
+
+        q = 10 ** self.precision
+        with self._open(filename) as f:
+            self._write_header(f)
+            if q != 1:
+                f.write(f'<g transform="scale({1 / q:g})">\n')
+            for i, (color, d) in enumerate(layers):
+                r, g, b = (int(c) for c in color)
+                f.write(f'<path id="layer{i}" fill="#{r:02x}{g:02x}{b:02x}" fill-rule="evenodd" d="{d}"/>\n')
+            if q != 1:
+                f.write('</g>\n')
+            self._write_footer(f)
+
+    def _open(self, filename: str) -> IO[str]:
+        if filename.endswith(".svgz"):
+            return gzip.open(filename, "wt", compresslevel=6, encoding="utf-8")
+        return open(filename, "w", buffering=1 << 20, encoding="utf-8")
+
+    def _write_header(self, f: IO[str]) -> None:
+        w, h = self.img_size
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<svg xmlns="http://www.w3.org/2000/svg" width="{w}" height="{h}" viewBox="0 0 {w} {h}">\n')
+
+    def _write_footer(self, f: IO[str]) -> None:
+        f.write('</svg>\n')
+
+    def _write_mesh(self, f: IO[str], mesh: Mesh) -> None:
+        """Stream the faces as <path> elements, one element per fill color."""
+        if len(mesh) == 0:
+            return
+
+        # Quantize the shared vertices once; coordinates are written as integers
+        # in a group scaled back down by the quantization factor
+        q = 10 ** self.precision
+        coords = np.round(mesh.vertices.astype(np.float64) * q).astype(np.int64)
+        if q != 1:
+            f.write(f'<g transform="scale({1 / q:g})">\n')
+
+        # Group the faces by fill color
+        packed = (mesh.colors[:, 0].astype(np.int64) << 16) \
+            | (mesh.colors[:, 1].astype(np.int64) << 8) \
+            | mesh.colors[:, 2].astype(np.int64)
+        order = np.argsort(packed, kind="stable")
+        packed = packed[order]
+        group_start = np.ones(len(packed), dtype=bool)
+        group_start[1:] = packed[1:] != packed[:-1]
+
+        first_fmt = '<path fill="#%06x" d="' + self.TRIANGLE_FMT
+        next_fmt = '"/>\n' + first_fmt
+
+        for start in range(0, len(order), self.chunk_size):
+            stop = min(start + self.chunk_size, len(order))
+
+            # Absolute first vertex, then deltas to the second and third
+            tri = coords[mesh.faces[order[start:stop]]]
+            tri[:, 2] -= tri[:, 1]
+            tri[:, 1] -= tri[:, 0]
+
+            # Every face is one fixed format; faces starting a color group also
+            # close the previous path element and open a new one with the fill
+            starts = group_start[start:stop]
+            templates = np.where(starts, next_fmt, self.TRIANGLE_FMT)
+            if start == 0:
+                templates[0] = first_fmt
+            values = np.empty((stop - start, 7), dtype=np.int64)
+            values[:, 0] = packed[start:stop]
+            values[:, 1:] = tri.reshape(-1, 6)
+            keep = np.ones(values.shape, dtype=bool)
+            keep[:, 0] = starts
+
+            f.write("".join(templates.tolist()) % tuple(values[keep].tolist()))
+
+        f.write('"/>\n')
+        if q != 1:
+            f.write('</g>\n')
+
+    def _draw_cairo(self, filename: str, mesh: Mesh) -> None:
+        import cairo
+
         w, h = self.img_size
         with cairo.SVGSurface(filename, w, h) as surface:
             ctx = cairo.Context(surface)
             ctx.set_line_width(self.line_width)
-            for triangle in triangles:
-                self._draw_triangle(ctx, triangle)
+            for points, color in zip(mesh.triangles.reshape(-1, 6).tolist(), mesh.colors.tolist()):
+                self._draw_triangle(ctx, points, color)
 
-    def _draw_triangle(self, ctx: cairo.Context, triangle_points: Triangle) -> None:
+    def _draw_triangle(self, ctx, points: list, color: list) -> None:
         """Draw a single triangle using the provided Context."""
         # Extract points
-        x1, y1, x2, y2, x3, y3, r, g, b = triangle_points
+        x1, y1, x2, y2, x3, y3 = points
+        r, g, b = color
 
         ctx.set_source_rgb(r/255., g/255., b/255.)
 
@@ -49,8 +189,8 @@ if __name__ == '__main__':
     converter = SVGWriter(img_size, img_size, line_width)
 
     filename = 'example.svg'
-    triangles = [
-        ((240, 40), (240, 160), (350, 160)),
-        ((100, 20), (100, 50), (50, 50)),
-    ]
-    converter.draw_triangles(filename, triangles)
+    mesh = Mesh(
+        np.array([(240, 40), (240, 160), (350, 160), (100, 20), (100, 50), (50, 50)]),
+        np.array([(0, 1, 2), (3, 4, 5)]),
+        np.array([(255, 0, 0), (0, 0, 255)]))
+    converter.draw_triangles(filename, mesh)
@@ -0,0 +1,101 @@
+"""
+Full-reference image quality metrics of a rendering against its source image.
+
+Every metric is a few whole-array operations, so they are cheap enough to run
+on every output of a batch. The images are uint8 (or float) arrays of the same
+shape, with or without a channel axis.
+"""
+from typing import Optional
+
+import cv2
+import numpy as np
+
+
+def error_map(image: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    """The float32 HxW squared error of every pixel, averaged over the channels."""
+    if image.shape != reference.shape:
+        raise ValueError(f"Image shapes differ: {image.shape} and {reference.shape}")
+    diff = image.astype(np.float32) - reference.astype(np.float32)
+    diff *= diff
+    return diff.reshape(diff.shape[0], diff.shape[1], -1).mean(axis=2)
+
+
+def mse(image: np.ndarray, reference: np.ndarray) -> float:
+    """The mean squared error over all pixels and channels."""
+    return float(error_map(image, reference).mean(dtype=np.float64))
+
+
+def psnr(image: np.ndarray, reference: np.ndarray, peak: float = 255.0) -> float:
+    """The peak signal-to-noise ratio in dB; infinite for identical images."""
+    error = mse(image, reference)
+    return float("inf") if error == 0 else float(10 * np.log10(peak ** 2 / error))
+
+
+def ssim_map(image: np.ndarray, reference: np.ndarray, peak: float = 255.0) -> np.ndarray:
+    """The float32 HxW structural similarity of every pixel, averaged over the channels.
+
+    Wang et al., "Image quality assessment: from error visibility to structural
+    similarity" (2004), with the usual 11x11 Gaussian window of sigma 1.5.
+    """
+    if image.shape != reference.shape:
+        raise ValueError(f"Image shapes differ: {image.shape} and {reference.shape}")
+    c1 = (0.01 * peak) ** 2
+    c2 = (0.03 * peak) ** 2
+
+    def blur(a: np.ndarray) -> np.ndarray:
+        return cv2.GaussianBlur(a, (11, 11), 1.5, borderType=cv2.BORDER_REFLECT)
+
+    # One channel at a time, which bounds the float32 temporaries to a few planes
+    image = image.reshape(image.shape[0], image.shape[1], -1)
+    reference = reference.reshape(image.shape)
+    total = np.zeros(image.shape[:2], dtype=np.float32)
+    for c in range(image.shape[2]):
+        x = image[:, :, c].astype(np.float32)
+        y = reference[:, :, c].astype(np.float32)
+        mu_x = blur(x)
+        mu_y = blur(y)
+        mu_xy = mu_x * mu_y
+        mu_x *= mu_x
+        mu_y *= mu_y
+        var_x = blur(x * x) - mu_x
+        var_y = blur(y * y) - mu_y
+        cov = blur(x * y) - mu_xy
+        total += (2 * mu_xy + c1) * (2 * cov + c2) / ((mu_x + mu_y + c1) * (var_x + var_y + c2))
+    total /= image.shape[2]
+    return total
+
+
+def ssim(image: np.ndarray, reference: np.ndarray, peak: float = 255.0) -> float:
+    """The mean structural similarity, 1 for identical images."""
+    return float(ssim_map(image, reference, peak).mean(dtype=np.float64))
+
+
+def region_errors(image: np.ndarray, reference: np.ndarray, labels: np.ndarray,
+                  n_regions: Optional[int] = None) -> np.ndarray:
+    """The mean squared error of every region of a label image, e.g. of every face of a rendered mesh.
+
+    Keyword arguments:
+        labels -- the int HxW region of every pixel, negative for none
+        n_regions -- the number of regions (default: the largest label + 1); empty regions get 0
+    """
+    error = error_map(image, reference).ravel()
+    labels = labels.ravel()
+    inside = labels >= 0
+    n = int(labels.max()) + 1 if n_regions is None else n_regions
+    n = max(n, 0)
+    counts = np.bincount(labels[inside], minlength=n)
+    sums = np.bincount(labels[inside], weights=error[inside], minlength=n)
+    return sums / np.maximum(counts, 1)
+
+
+def block_errors(image: np.ndarray, reference: np.ndarray, block: int = 32) -> np.ndarray:
+    """The mean squared error of every block x block tile, as a ceil(H / block) x ceil(W / block) map."""
+    error = error_map(image, reference)
+    h, w = error.shape
+    rows, cols = -(-h // block), -(-w // block)
+    padded = np.zeros((rows * block, cols * block), dtype=np.float32)
+    padded[:h, :w] = error
+    counts = np.zeros_like(padded)
+    counts[:h, :w] = 1
+    sums = padded.reshape(rows, block, cols, block).sum(axis=(1, 3))
+    return sums / counts.reshape(rows, block, cols, block).sum(axis=(1, 3))
@@ -0,0 +1,83 @@
+from typing import Tuple
+
+import numpy as np
+
+
+def rasterize_triangles(triangles: np.ndarray, shape: Tuple[int, int],
+                        chunk_pixels: int = 1 << 20) -> np.ndarray:
+    """Rasterize every triangle into a triangle-ID label image in one batched pass.
+
+    A pixel (x, y) belongs to a triangle if the integer point (x, y) lies inside
+    it or on one of its edges. Pixels shared by two triangles go to the one with
+    the higher index and pixels not covered by any triangle are labelled -1.
+
+    Keyword arguments:
+        triangles -- an Mx3x2 (or Mx6) array of (x, y) vertex coordinates
+        shape -- the (height, width) of the label image
+        chunk_pixels -- the number of candidate pixels tested per batch, which bounds memory use
+    """
+    h, w = shape[:2]
+    labels = np.full((h, w), -1, dtype=np.int32)
+    tris = np.asarray(triangles, dtype=np.float64).reshape(-1, 3, 2)
+    if len(tris) == 0:
+        return labels
+
+    xs = tris[:, :, 0]
+    ys = tris[:, :, 1]
+
+    # Skip degenerate (zero-area) triangles, they do not cover any pixel
+    area = (xs[:, 1] - xs[:, 0]) * (ys[:, 2] - ys[:, 0]) \
+        - (xs[:, 2] - xs[:, 0]) * (ys[:, 1] - ys[:, 0])
+
+    # Pixel bounding box of each triangle, clipped to the image
+    x0 = np.clip(np.ceil(xs.min(axis=1)), 0, w).astype(np.int64)
+    x1 = np.clip(np.floor(xs.max(axis=1)), -1, w - 1).astype(np.int64)
+    y0 = np.clip(np.ceil(ys.min(axis=1)), 0, h).astype(np.int64)
+    y1 = np.clip(np.floor(ys.max(axis=1)), -1, h - 1).astype(np.int64)
+    bw = np.maximum(x1 - x0 + 1, 0)
+    bh = np.maximum(y1 - y0 + 1, 0)
+    n_pixels = np.where(area != 0, bw * bh, 0)
+
+    # Edge functions a * x + b * y + c, oriented to be non-negative inside the triangle
+    sign = np.sign(area)[:, None]
+    xb, yb = np.roll(xs, -1, axis=1), np.roll(ys, -1, axis=1)
+    edges = np.stack([
+        -(yb - ys) * sign,
+        (xb - xs) * sign,
+        ((yb - ys) * xs - (xb - xs) * ys) * sign], axis=2)
+
+    # Split the triangles into batches with a bounded number of candidate pixels
+    ends = np.cumsum(n_pixels)
+    start = 0
+    while start < len(tris):
+        stop = np.searchsorted(ends, ends[start] - n_pixels[start] + chunk_pixels, side='right')
+        stop = max(int(stop), start + 1)
+        _rasterize_chunk(labels, edges, np.arange(start, stop), x0, y0, bw, n_pixels)
+        start = stop
+
+    return labels
+
+
+def _rasterize_chunk(labels: np.ndarray, edges: np.ndarray, ids: np.ndarray,
+                     x0: np.ndarray, y0: np.ndarray, bw: np.ndarray, n_pixels: np.ndarray) -> None:
+    """Test all bounding-box pixels of the given triangles and write the hits into labels."""
+    counts = n_pixels[ids]
+    total = int(counts.sum())
+    if total == 0:
+        return
+
+    # Enumerate the bounding-box pixels of every triangle
+    tri_id = np.repeat(ids, counts)
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    local = np.arange(total, dtype=np.int64) - offsets
+    width = bw[tri_id]
+    px = x0[tri_id] + local % width
+    py = y0[tri_id] + local // width
+
+    # A point is inside if all three edge functions are non-negative
+    e = edges[tri_id]
+    inside = np.ones(total, dtype=bool)
+    for k in range(3):
+        inside &= e[:, k, 0] * px + e[:, k, 1] * py + e[:, k, 2] >= 0
+
+    labels[py[inside], px[inside]] = tri_id[inside]
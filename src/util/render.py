@@ -0,0 +1,60 @@
+from typing import Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from util.geometry_types import Mesh
+from util.rasterize import rasterize_triangles
+
+
+class MeshRenderer:
+    """
+    CPU rasterizer of colored triangle meshes into NumPy images.
+
+    All triangles are rasterized into a triangle-ID label image in one batched
+    pass (see rasterize_triangles) and the image is a lookup of the face
+    colors. At scale s, pixel (x, y) takes the color of the triangle holding
+    the point (x, y) / s, the same pixels TriangleColor colors the triangle
+    from, so at scale 1 a rendering compares pixel for pixel with the source.
+    """
+
+    def __init__(self, supersample: int = 1, chunk_pixels: int = 1 << 20):
+        """
+        Keyword arguments:
+            supersample -- render this many times larger in both directions and
+                           average down (cv2.INTER_AREA), which anti-aliases the edges
+            chunk_pixels -- the number of candidate pixels rasterized per batch, which bounds memory use
+        """
+        self.supersample = max(int(supersample), 1)
+        self.chunk_pixels = chunk_pixels
+
+    @staticmethod
+    def _shape(width: int, height: int, scale: float) -> Tuple[int, int]:
+        return max(int(round(height * scale)), 1), max(int(round(width * scale)), 1)
+
+    def labels(self, mesh: Mesh, width: int, height: int, scale: float = 1.0) -> np.ndarray:
+        """The int32 label image of the face covering every pixel at scale, -1 where none does."""
+        shape = self._shape(width, height, scale)
+        return rasterize_triangles(mesh.triangles.astype(np.float64) * scale, shape, self.chunk_pixels)
+
+    def render(self, mesh: Mesh, width: int, height: int, scale: float = 1.0,
+               background: Sequence[int] = (0, 0, 0)) -> np.ndarray:
+        """Render the mesh into a uint8 BGR image of the size of the width x height canvas times scale.
+
+        Keyword arguments:
+            mesh -- the colored triangle mesh, with RGB face colors
+            width -- the width of the canvas the mesh lives in, e.g. of its source image
+            height -- the height of that canvas
+            scale -- the output pixels per canvas unit
+            background -- the RGB color of the pixels no face covers
+        """
+        shape = self._shape(width, height, scale)
+        factor = scale * self.supersample
+        labels = self.labels(mesh, width, height, factor)
+
+        # Face colors are RGB; the image is BGR as cv2 uses. The last row is the background
+        palette = np.vstack((mesh.colors[:, ::-1], np.asarray(background, dtype=np.uint8)[::-1]))
+        image = palette[labels]
+        if self.supersample > 1:
+            image = cv2.resize(image, shape[::-1], interpolation=cv2.INTER_AREA)
+        return image
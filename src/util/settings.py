@@ -1,6 +1,27 @@
 import argparse
+import glob
+import os
+from typing import Tuple
 
 from util.geometry_types import Color
+from util.strip_io import parse_raw_shape
+
+
+# The metrics an --autotune target can bound: quality floors, and size budgets
+TARGET_METRICS = ("psnr", "ssim", "triangles", "bytes")
+
+
+def parse_target(text: str) -> Tuple[str, float]:
+    """Parse an --autotune target such as "psnr=30" or "triangles=5000" into (metric, bound)."""
+    metric, _, value = text.lower().partition("=")
+    try:
+        bound = float(value)
+    except ValueError:
+        bound = -1
+    if metric not in TARGET_METRICS or bound < 0:
+        raise ValueError(f"Invalid autotune target '{text}', expected one of "
+                         f"{', '.join(m + '=N' for m in TARGET_METRICS)}")
+    return metric, bound
 
 
 class Settings:
@@ -8,27 +29,198 @@ class Settings:
     def __init__(self):
         # Construct the argument parser and parse the arguments
         ap = argparse.ArgumentParser()
-        ap.add_argument("-i", "--image", required=True, help="path to input image")
-        ap.add_argument("-o", "--output", required=True, help="path to outputs")
+        ap.add_argument("-i", "--image", required=True,
+            help="path to input image, or a directory or glob of images for batch mode")
+        ap.add_argument("-o", "--output", required=True,
+            help="path to outputs (the output directory in batch mode)")
+        ap.add_argument("-j", "--jobs",
+            required=False, type=int, default=os.cpu_count() or 1,
+            help="number of worker processes in batch mode")
+        ap.add_argument("-t", "--tilesize",
+            required=False, type=int, default=0,
+            help="split a single image into tiles of this many pixels processed by -j workers (0: off)")
+        ap.add_argument("-tm", "--tilemargin",
+            required=False, type=int, default=64,
+            help="initial overlap in pixels between neighboring tiles, grown as needed")
+        ap.add_argument("-m", "--memory",
+            required=False, type=int, default=0,
+            help="convert a single image in strips with about this many MB of working memory, "
+                 "memory-mapping .npy, .raw and binary .pgm/.ppm inputs (0: off)")
+        ap.add_argument("-rs", "--rawshape",
+            required=False, type=parse_raw_shape, default=None,
+            help="WxH or WxHxC shape of a .raw input of interleaved uint8 samples")
+        ap.add_argument("-ext", "--extension",
+            required=False, choices=["svg", "svgz"], default="svg",
+            help="output file extension in batch mode")
+        ap.add_argument("-md", "--mode",
+            required=False, choices=["triangles", "regions"], default="triangles",
+            help="vectorize into a triangle mesh, or into traced regions of -k quantized colors")
+        ap.add_argument("-k", "--colors",
+            required=False, type=int, default=16,
+            help="number of colors of the regions mode")
+        ap.add_argument("-n", "--points",
+            required=False, type=int, default=0,
+            help="sample about this many blue-noise points instead of a fixed density "
+                 "(about 2 * points / 10 triangles after decimation; 0: off)")
+        ap.add_argument("-lod", "--lod",
+            required=False, type=int, default=0,
+            help="also write this many nested levels of detail, each about 4x coarser (0: off)")
+        ap.add_argument("-lm", "--lodmode",
+            required=False, choices=["files", "layers"], default="files",
+            help="write the levels of detail as <output>.lod<i> files, or as layers of the output")
+        ap.add_argument("-c", "--cache",
+            required=False, default=None,
+            help="directory of an on-disk cache of the stage outputs, reused when only later stages change "
+                 "(not used in tiled mode)")
+        ap.add_argument("-cs", "--cachesize",
+            required=False, type=int, default=1024,
+            help="size in MB the --cache directory is trimmed to, least recently used first")
+        ap.add_argument("-sm", "--sampler",
+            required=False, choices=["quasi", "dither"], default="quasi",
+            help="sample the points with the Penrose tiling quasisampler, or by error diffusion")
+        ap.add_argument("-dk", "--ditherkernel",
+            required=False, choices=["floyd-steinberg", "jarvis", "stucki"], default="floyd-steinberg",
+            help="error-diffusion kernel of the dither sampler (rows are scanned serpentine)")
+        ap.add_argument("-e", "--edges",
+            required=False, type=int, default=0,
+            help="also place points this many pixels apart along the boundaries of strong importance (0: off)")
+        ap.add_argument("-et", "--edgethreshold",
+            required=False, type=float, default=0.2,
+            help="fraction of the maximum importance the --edges boundaries are traced at")
         ap.add_argument("-sf", "--samplingf",
             required=False, const=1.0, type=float, nargs='?', default=1.0,
-            help="sampling_f value for Floyd-Steinberg dithering")
+            help="points per 255 of importance of the dither sampler, unless -n is given")
+        ap.add_argument("-q", "--quality",
+            required=False, action="store_true",
+            help="render the mesh back to pixels and report its PSNR and SSIM against the image")
+        ap.add_argument("-at", "--autotune",
+            required=False, type=parse_target, default=None,
+            help="search gamma, density and decimation per image: psnr=X or ssim=X for the fewest triangles "
+                 "reaching that quality, triangles=N or bytes=N for the best PSNR within that budget")
+        ap.add_argument("-ae", "--autoevals",
+            required=False, type=int, default=12,
+            help="most parameter candidates --autotune evaluates per image")
+        ap.add_argument("-sq", "--sequence",
+            required=False, action="store_true",
+            help="convert the frames of a video, or of a directory or glob of images, into one SVG file each "
+                 "in the output directory, updating the mesh only where the frames differ")
+        ap.add_argument("-st", "--seqtol",
+            required=False, type=int, default=8,
+            help="largest difference in pixel value between frames that --sequence treats as unchanged")
         ap.add_argument("-b", "--bench",
-            required=False, const=False, type=bool, nargs='?', default=False,
+            required=False, action="store_true",
             help="time each stage of the algorithm")
+        ap.add_argument("-bj", "--benchjson",
+            required=False, default=None,
+            help="path of the --bench JSON report (default: <output>.bench.json)")
+        ap.add_argument("-pd", "--profiledir",
+            required=False, default=None,
+            help="with --bench, write a cProfile dump per stage into this directory")
         ap.add_argument("-lc", "--linecolor",
             required=False, type=Color, nargs='+', default=(255,255,255),
             help="color of mesh lines")
+        ap.add_argument("-cm", "--colormode",
+            required=False, choices=["mean", "median", "mode"], default="mean",
+            help="statistic used to color each triangle from its pixels")
+        ap.add_argument("-l", "--luma",
+            required=False, action="store_true",
+            help="compute the importance map on the luma channel only (about 3x less work)")
+        ap.add_argument("-p", "--precision",
+            required=False, type=int, default=1,
+            help="decimal digits kept for SVG coordinates")
+        ap.add_argument("-sb", "--svgbackend",
+            required=False, choices=["text", "cairo"], default="text",
+            help="SVG writer backend; an output ending in .svgz is gzip-compressed")
         settings_dict = vars(ap.parse_args())
+        if settings_dict["quality"] and (settings_dict["memory"] or settings_dict["mode"] == "regions"
+                                         or settings_dict["sequence"]):
+            ap.error("--quality renders the triangle mesh of a single image held in memory, "
+                     "not strips, regions or sequences")
+        if settings_dict["sampler"] == "dither" and settings_dict["lod"] > 1:
+            ap.error("levels of detail need the ranks of the quasi sampler")
+        if settings_dict["sampler"] == "dither" and (settings_dict["tilesize"] or settings_dict["memory"]):
+            ap.error("the tiled and strip modes sample with the quasi sampler only")
+        if settings_dict["edges"] and (settings_dict["tilesize"] or settings_dict["memory"]):
+            ap.error("--edges traces the whole importance map, not tiles or strips")
+        if settings_dict["mode"] == "regions" and (settings_dict["tilesize"] or settings_dict["memory"]
+                                                   or settings_dict["lod"] > 1 or settings_dict["cache"]
+                                                   or settings_dict["autotune"] or settings_dict["edges"]):
+            ap.error("the regions mode traces the whole image in one pass, without tiles, strips, "
+                     "levels of detail, cache, autotune or edges")
+        if settings_dict["autotune"] and (settings_dict["sampler"] == "dither" or settings_dict["lod"] > 1):
+            ap.error("--autotune searches the density of the quasi sampler for a single level of detail")
+        if settings_dict["sequence"] and (settings_dict["sampler"] == "dither" or settings_dict["lod"] > 1
+                                          or settings_dict["autotune"] or settings_dict["edges"]
+                                          or settings_dict["tilesize"] or settings_dict["memory"]
+                                          or settings_dict["mode"] == "regions"):
+            ap.error("--sequence resamples the quasi sampler in place, for a single level of detail "
+                     "of a triangle mesh without edges, autotune, tiles or strips")
 
         self.image = settings_dict["image"]
         self.output = settings_dict["output"]
+        self.batch = os.path.isdir(self.image) or glob.has_magic(self.image)
+        self.jobs = settings_dict["jobs"]
+        self.extension = settings_dict["extension"]
+        self.tile_size = settings_dict["tilesize"]
+        self.tile_margin = settings_dict["tilemargin"]
+        self.memory = settings_dict["memory"]
+        self.raw_shape = settings_dict["rawshape"]
+        self.mode = settings_dict["mode"]
+        self.colors = settings_dict["colors"]
+        self.points = settings_dict["points"]
+        self.lod = settings_dict["lod"]
+        self.lod_mode = settings_dict["lodmode"]
+        self.cache = settings_dict["cache"]
+        self.cache_size = settings_dict["cachesize"]
+        self.sampler = settings_dict["sampler"]
+        self.dither_kernel = settings_dict["ditherkernel"]
+        self.edges = settings_dict["edges"]
+        self.edge_threshold = settings_dict["edgethreshold"]
         self.sampling_f = settings_dict["samplingf"]
+        self.quality = settings_dict["quality"]
+        self.autotune = settings_dict["autotune"]
+        self.auto_evals = settings_dict["autoevals"]
+        self.sequence = settings_dict["sequence"]
+        self.seq_tol = settings_dict["seqtol"]
         self.bench = settings_dict["bench"]
+        self.bench_json = settings_dict["benchjson"] or f"{self.output}.bench.json"
+        self.profile_dir = settings_dict["profiledir"]
         self.line_color = settings_dict["linecolor"]
+        self.color_mode = settings_dict["colormode"]
+        self.luma = settings_dict["luma"]
+        self.precision = settings_dict["precision"]
+        self.svg_backend = settings_dict["svgbackend"]
 
     def print(self):
         print("Running vectorization with parameters:")
+        if self.batch or self.tile_size:
+            print(f"\tJobs:\t{self.jobs}")
+        if self.tile_size:
+            print(f"\tTile size:\t{self.tile_size}")
+        if self.memory:
+            print(f"\tMemory:\t{self.memory} MB")
+        if self.mode == "regions":
+            print(f"\tMode:\t{self.mode} ({self.colors} colors)")
+        if self.points:
+            print(f"\tPoints:\t{self.points}")
+        if self.lod:
+            print(f"\tLevels of detail:\t{self.lod} ({self.lod_mode})")
+        if self.cache:
+            print(f"\tCache:\t{self.cache} ({self.cache_size} MB)")
+        if self.sampler == "dither":
+            print(f"\tSampler:\t{self.sampler} ({self.dither_kernel})")
+        if self.edges:
+            print(f"\tEdges:\t{self.edges} px ({self.edge_threshold} threshold)")
         print(f"\tSampling_f:\t{self.sampling_f}")
+        if self.autotune:
+            print(f"\tAutotune:\t{self.autotune[0]}={self.autotune[1]:g} ({self.auto_evals} evaluations)")
+        if self.quality:
+            print(f"\tQuality:\t{self.quality}")
+        if self.sequence:
+            print(f"\tSequence:\t{self.sequence} (tolerance {self.seq_tol})")
         print(f"\tBench:\t{self.bench}")
-        print(f"\tLine color:\t{self.line_color}")
\ No newline at end of file
+        print(f"\tLine color:\t{self.line_color}")
+        print(f"\tColor mode:\t{self.color_mode}")
+        print(f"\tLuma:\t{self.luma}")
+        print(f"\tPrecision:\t{self.precision}")
+        print(f"\tSVG backend:\t{self.svg_backend}")
\ No newline at end of file
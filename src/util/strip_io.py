@@ -0,0 +1,101 @@
+"""
+Out-of-core access to images too large to decode into memory at once.
+
+Raw, .npy and binary PGM/PPM images are memory-mapped instead of decoded, so
+reading a horizontal strip of rows only pages in those rows. Other formats
+are decoded with OpenCV as usual.
+"""
+import os
+from typing import Iterator, Optional, Tuple
+
+import cv2
+import numpy as np
+
+MAPPABLE_EXTENSIONS = (".npy", ".raw", ".pgm", ".ppm", ".pnm")
+
+
+def parse_raw_shape(text: str) -> Tuple[int, ...]:
+    """Parse a "WxH" or "WxHxC" raw image shape into (height, width[, channels])."""
+    try:
+        dims = tuple(int(d) for d in text.lower().split("x"))
+    except ValueError:
+        dims = ()
+    if len(dims) not in (2, 3) or min(dims) <= 0:
+        raise ValueError(f"Invalid raw image shape '{text}', expected WxH or WxHxC")
+    return (dims[1], dims[0]) + dims[2:]
+
+
+def _read_pnm_header(f) -> Tuple[str, int, int, int]:
+    """Read the magic number, width, height and maxval of a binary PGM/PPM file, leaving f at the pixels."""
+    fields = []
+    while len(fields) < 4:
+        line = f.readline()
+        if not line:
+            raise ValueError("Truncated PGM/PPM header")
+        fields += line.split(b"#")[0].split()
+    magic = fields[0].decode()
+    width, height, maxval = (int(v) for v in fields[1:4])
+    return magic, width, height, maxval
+
+
+def _map_pnm(path: str) -> np.ndarray:
+    with open(path, "rb") as f:
+        magic, width, height, maxval = _read_pnm_header(f)
+        offset = f.tell()
+    if magic not in ("P5", "P6"):
+        raise ValueError(f"'{path}' is not a binary PGM/PPM file (magic {magic})")
+    if maxval > 255:
+        raise ValueError(f"'{path}' has 16-bit samples, only 8-bit PGM/PPM files are supported")
+    shape = (height, width) if magic == "P5" else (height, width, 3)
+    image = np.memmap(path, np.uint8, "r", offset, shape)
+    # PPM is RGB; the pipeline works in BGR, so flip the view, not the data
+    return image if magic == "P5" else image[:, :, ::-1]
+
+
+def _as_color(image: np.ndarray) -> np.ndarray:
+    """View a grayscale image as 3 equal channels, as cv2.imread reads it, without copying it."""
+    if image.ndim == 3:
+        return image
+    return np.broadcast_to(image[:, :, None], image.shape + (3,))
+
+
+def open_image(path: str, raw_shape: Optional[Tuple[int, ...]] = None) -> np.ndarray:
+    """Return the uint8 (H, W, C) image at path, memory-mapped if its format allows.
+
+    Grayscale images are viewed as 3 equal channels, as cv2.imread reads them.
+
+    Keyword arguments:
+        path -- a .npy, .raw, binary .pgm/.ppm/.pnm or any format OpenCV reads
+        raw_shape -- the (height, width[, channels]) of a .raw file of interleaved uint8 samples
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npy":
+        image = np.load(path, mmap_mode="r")
+        if image.dtype != np.uint8 or image.ndim not in (2, 3):
+            raise ValueError(f"'{path}' is not a uint8 (H, W[, C]) array")
+        return _as_color(image)
+    if ext == ".raw":
+        if raw_shape is None:
+            raise ValueError(f"The shape of the raw image '{path}' is not given")
+        if os.path.getsize(path) != int(np.prod(raw_shape)):
+            raise ValueError(f"'{path}' does not hold a {raw_shape} uint8 image")
+        return _as_color(np.memmap(path, np.uint8, "r", 0, raw_shape))
+    if ext in (".pgm", ".ppm", ".pnm"):
+        return _as_color(_map_pnm(path))
+
+    image = cv2.imread(path)
+    if image is None:
+        raise ValueError(f"Could not read image '{path}'")
+    return image
+
+
+def strip_rows(width: int, bytes_per_pixel: int, memory_limit: int, min_rows: int = 16) -> int:
+    """The number of rows per strip that keeps a working set of bytes_per_pixel under memory_limit."""
+    return max(memory_limit // max(width * bytes_per_pixel, 1), min_rows)
+
+
+def strips(height: int, rows: int, halo: int = 0) -> Iterator[Tuple[int, int, int, int]]:
+    """Yield (y0, y1, py0, py1): the rows of every strip, and its rows grown by halo within the image."""
+    for y0 in range(0, height, rows):
+        y1 = min(y0 + rows, height)
+        yield y0, y1, max(y0 - halo, 0), min(y1 + halo, height)